@@ -0,0 +1,208 @@
+"""Análisis de maletas por lotes, sin interfaz, para todos los técnicos (o los indicados).
+
+Ejecuta para cada técnico la misma cadena que el botón "Procesar Análisis" de la app
+(limpieza → procesar_analisis → Excel en historial/ registrado en la base de datos),
+repartiendo los técnicos entre varios procesos. El stock de Holded se consulta una sola vez
+en el proceso principal (todos los almacenes en paralelo) y se pasa a cada análisis.
+
+    python analisis_lote.py --entrada lote/ --desde 2024-05-01 --hasta 2024-05-31
+    python analisis_lote.py "Rigoberto" --entrada lote/ --procesos 2 --sin-holded
+
+Archivos en --entrada (xlsx o csv), por técnico con el nombre normalizado (francisco_javier):
+    consumo_<tecnico>.xlsx   Consumo registrado; si no existe se usa consumo.xlsx común.
+    conteo_<tecnico>.xlsx    Conteo físico (SKUs en columna B y cantidades en D desde la fila 3).
+                             Si no existe se usa el último inventario completado del técnico
+                             guardado por la app.
+
+Termina con código 1 si falla el análisis de algún técnico.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import streamlit.logger
+from streamlit import config as config_streamlit
+
+# Fuera de `streamlit run` cada llamada a st.* avisa de que no hay contexto de ejecución. Se fija
+# también en la configuración: Streamlit vuelve a aplicar su nivel de log al leerla
+config_streamlit.set_option("logger.level", "error")
+streamlit.logger.set_log_level("error")
+
+import app
+
+EXTENSIONES = (".xlsx", ".csv")
+
+
+def buscar_archivo(directorio: str, *nombres: str) -> Optional[str]:
+    """Devuelve la primera ruta existente entre los nombres base dados (probando xlsx y csv)."""
+    for nombre in nombres:
+        for extension in EXTENSIONES:
+            ruta = os.path.join(directorio, nombre + extension)
+            if os.path.exists(ruta):
+                return ruta
+    return None
+
+
+def ultimo_inventario_completado(tecnico: str) -> Optional[str]:
+    """Archivo del inventario completado más reciente del técnico (de la base de datos o de sus JSON)."""
+    inventarios = app.cargar_inventarios_disponibles(tecnico, 'completado')
+    # Ya vienen por fecha y hora, del más reciente al más antiguo
+    return inventarios[0]['archivo'] if inventarios else None
+
+
+def preparar_tareas(args: argparse.Namespace, tecnicos: List[str]) -> List[Dict[str, Any]]:
+    """Localiza las entradas de cada técnico; los técnicos sin datos se devuelven con su error."""
+    tareas = []
+    for tecnico in tecnicos:
+        nombre = app.nombre_tecnico_archivo(tecnico)
+        tarea = {
+            'tecnico': tecnico,
+            'consumo': buscar_archivo(args.entrada, f"consumo_{nombre}", "consumo"),
+            'conteo': buscar_archivo(args.entrada, f"conteo_{nombre}"),
+            'inventario': None,
+            'error': None
+        }
+        if tarea['conteo'] is None:
+            tarea['inventario'] = ultimo_inventario_completado(tecnico)
+
+        if tarea['consumo'] is None:
+            tarea['error'] = f"no hay consumo_{nombre} ni consumo común en {args.entrada}"
+        elif tarea['conteo'] is None and tarea['inventario'] is None:
+            tarea['error'] = f"no hay conteo_{nombre} ni inventarios completados"
+        tareas.append(tarea)
+    return tareas
+
+
+def consultar_stocks(tecnicos: List[str]) -> Dict[str, Optional[Dict]]:
+    """Consulta en paralelo la oficina y las maletas de los técnicos (None si falla un almacén)."""
+    ids = [app.HOLDED_CONFIG["almacen_oficina"]] + [app.TECNICOS_CONFIG[t]["warehouse_id"] for t in tecnicos]
+    stocks = {}
+    for warehouse_id, resultado in app.consultar_stock_almacenes(ids).items():
+        if resultado['ok']:
+            stocks[warehouse_id] = resultado['stock']
+            print(f"🔗 Almacén {warehouse_id[-8:]}: {len(resultado['stock'])} productos")
+        else:
+            stocks[warehouse_id] = None
+            print(f"⚠️ Almacén {warehouse_id[-8:]}: sin stock ({resultado['error']}: {resultado['mensaje']})")
+    return stocks
+
+
+def analizar_tecnico(tarea: Dict[str, Any], dotacion_df: pd.DataFrame, stock_maleta: Optional[Dict],
+                     stock_oficina: Dict, fecha_inicio: date, fecha_fin: date,
+                     formato_ordenes: str = 'texto') -> Dict[str, Any]:
+    """Analiza un técnico en un proceso del pool y guarda el resultado en el historial."""
+    inicio = time.perf_counter()
+    tecnico = tarea['tecnico']
+
+    # Los consumos grandes se leen por bloques y llegan ya agregados por (SKU, ID Parte)
+    if app.consumo_por_bloques(os.path.getsize(tarea['consumo'])):
+        consumo_df, _ = app.cargar_consumo_agregado(tarea['consumo'], tarea['consumo'])
+    else:
+        consumo_df = app.leer_consumo(tarea['consumo'], tarea['consumo'])
+
+    if tarea['conteo'] is not None:
+        conteo_df = app.leer_conteo(tarea['conteo'], tarea['conteo'])
+        dotacion, conteo, consumo = app.limpiar_datos(dotacion_df, conteo_df, consumo_df)
+    else:
+        conteo_df = app.conteo_desde_inventario(app.cargar_inventario_guardado(tarea['inventario'])['inventario'])
+        dotacion, conteo, consumo = app.preparar_datos_inventario(dotacion_df, conteo_df, consumo_df)
+
+    resultado, alertas = app.procesar_analisis(
+        dotacion, conteo, consumo, stock_maleta, tecnico, stock_oficina=stock_oficina,
+        formato_ordenes=formato_ordenes
+    )
+    if resultado.empty:
+        raise ValueError("el análisis no devolvió resultados")
+
+    nombre_archivo = app.generar_nombre_archivo(tecnico, fecha_inicio, fecha_fin)
+    path_archivo = app.guardar_analisis_en_historial(nombre_archivo, resultado, tecnico, fecha_inicio, fecha_fin, alertas)
+    resumen = app.calcular_resumen_analisis(resultado)
+
+    return {
+        'archivo': path_archivo,
+        'skus': resumen['total'],
+        'faltan': resumen['faltan'],
+        'alertas': len(alertas),
+        'segundos': time.perf_counter() - inicio
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Análisis de maletas por lotes para todos los técnicos")
+    parser.add_argument("tecnicos", nargs="*", help="Técnicos a analizar (por defecto, todos los configurados)")
+    parser.add_argument("--entrada", default=".", help="Directorio con los archivos de consumo y conteo")
+    parser.add_argument("--dotacion", default=app.DOTACION_ARCHIVO, help="Excel de dotación fija")
+    parser.add_argument("--desde", type=date.fromisoformat, default=date.today(), help="Fecha inicio (AAAA-MM-DD)")
+    parser.add_argument("--hasta", type=date.fromisoformat, default=date.today(), help="Fecha fin (AAAA-MM-DD)")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1, help="Procesos en paralelo")
+    parser.add_argument("--ordenes", choices=app.FORMATOS_ORDENES, default="texto",
+                        help="Formato de 'Trabajos/Órdenes': texto, lista de IDs o número de órdenes")
+    parser.add_argument("--sin-holded", dest="holded", action="store_false", help="No consultar stock en Holded")
+    args = parser.parse_args()
+
+    tecnicos = args.tecnicos or list(app.TECNICOS_CONFIG)
+    desconocidos = [t for t in tecnicos if t not in app.TECNICOS_CONFIG]
+    if desconocidos:
+        parser.error(f"técnicos no configurados: {', '.join(desconocidos)}")
+    if args.hasta < args.desde:
+        parser.error("la fecha fin debe ser posterior a la fecha inicio")
+
+    app.crear_directorios()
+    # Importar los archivos existentes a la base de datos antes de buscar inventarios y abrir los procesos
+    app.obtener_base_datos()
+
+    try:
+        # Misma caché de disco que la app: solo se recompila si el Excel de dotación cambió
+        info = os.stat(args.dotacion)
+        dotacion_df = app._cargar_dotacion_compilada(args.dotacion, info.st_mtime_ns, info.st_size)['df']
+    except (OSError, ValueError) as e:
+        print(f"❌ Error cargando dotación fija: {e}")
+        return 1
+
+    tareas = preparar_tareas(args, tecnicos)
+    fallos = 0
+    for tarea in tareas:
+        if tarea['error']:
+            print(f"❌ {tarea['tecnico']}: {tarea['error']}")
+            fallos += 1
+    pendientes = [t for t in tareas if not t['error']]
+    if not pendientes:
+        return 1
+
+    stocks = consultar_stocks([t['tecnico'] for t in pendientes]) if args.holded else {}
+    stock_oficina = stocks.get(app.HOLDED_CONFIG["almacen_oficina"]) or {}
+
+    print(f"🚀 Analizando {len(pendientes)} técnicos con {min(args.procesos, len(pendientes))} procesos")
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, min(args.procesos, len(pendientes)))) as executor:
+        futuros = {
+            executor.submit(
+                analizar_tecnico, tarea, dotacion_df,
+                stocks.get(app.TECNICOS_CONFIG[tarea['tecnico']]["warehouse_id"]),
+                stock_oficina, args.desde, args.hasta, args.ordenes
+            ): tarea['tecnico']
+            for tarea in pendientes
+        }
+        for futuro in as_completed(futuros):
+            tecnico = futuros[futuro]
+            try:
+                r = futuro.result()
+            except Exception as e:
+                print(f"❌ {tecnico}: {e}")
+                fallos += 1
+                continue
+            print(f"✅ {tecnico}: {r['skus']} SKUs, {r['faltan']} con faltas, {r['alertas']} alertas "
+                  f"→ {r['archivo']} ({r['segundos']:.1f} s)")
+
+    print(f"🏁 {len(tareas) - fallos}/{len(tareas)} análisis en {time.perf_counter() - inicio:.1f} s")
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
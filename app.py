@@ -1,38 +1,82 @@
 import streamlit as st
 import pandas as pd
-from io import BytesIO
+import numpy as np
 import os
 from datetime import date, datetime
 import traceback
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List, Iterable, Iterator
 import warnings
 import requests
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
+import uuid
+import hashlib
+import pickle
+import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import threading
 warnings.filterwarnings('ignore')
 
-# Configuración de la página
-st.set_page_config(
-    page_title="Analizador de Maletas Técnicas",
-    page_icon="🔧",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+# Parser JSON incremental (opcional): sin él las respuestas de Holded se decodifican completas
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Cerrojos de archivo (solo POSIX): sin ellos no se detectan diarios abiertos en otra sesión
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # Constantes
 HISTORIAL_DIR = "historial"
 INVENTARIOS_DIR = "inventarios"
+DIARIOS_DIR = os.path.join(INVENTARIOS_DIR, "diarios")
+SNAPSHOTS_DIR = os.environ.get("MALETA_SNAPSHOTS_DIR", "snapshots_stock")
+BD_RUTA = os.environ.get("MALETA_DB", "maleta.db")
+CACHE_DIR = os.environ.get("MALETA_CACHE_DIR", "cache")
+MODO_DEBUG = os.environ.get("MALETA_DEBUG") == "1"  # muestra estadísticas internas (cachés) en la interfaz
+DOTACION_ARCHIVO = "dotacion_fija.xlsx"
+VERSION_CACHE_DOTACION = 1  # subir si cambia la forma de la dotación compilada
+ESTILO_CABECERA_EXCEL = {
+    'font': Font(bold=True),
+    'border': Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin')),
+    'alignment': Alignment(horizontal='center', vertical='top')
+}
+VISTA_PREVIA_FILAS = 500  # filas que se muestran al previsualizar un análisis del historial
+CONSUMO_BLOQUES_MB = 20  # los archivos de consumo más grandes se leen por bloques y se agregan al vuelo
+CONSUMO_FILAS_BLOQUE = 100000
+COLUMNAS_TEXTO_CONSUMO = ('ID Parte', 'Articulo')  # siempre como texto: CSV o xlsx, entero o por bloques
 COLUMNAS_ESPERADAS = {
     'dotacion': ['SKU', 'DOTACIÓN', 'CAJA', 'SECCION', 'Nº ORDEN'],
     'conteo': ['SKU', 'Cantidad'],
     'consumo': ['ID Parte', 'Cantidad', 'Articulo']
 }
 
-# Configuración de Holded
+# Configuración de Holded. Al desplegar hay que definir la variable de entorno HOLDED_API_KEY
+# (la clave ya no va en el código): sin ella la app funciona, pero sin stock de Holded.
+# HOLDED_BASE_URL permite apuntar a holded_fake.py para pruebas.
 HOLDED_CONFIG = {
-    "api_key": "9371575c4698f7f1109a5d3cfe76ee00",
-    "base_url": "https://api.holded.com/api/invoicing/v1",
-    "almacen_oficina": "5ac3f3a82e1d932034516b9c"
+    "api_key": os.environ.get("HOLDED_API_KEY", ""),  # obligatoria: sin ella no se consulta Holded
+    "base_url": os.environ.get("HOLDED_BASE_URL", "https://api.holded.com/api/invoicing/v1"),
+    "almacen_oficina": "5ac3f3a82e1d932034516b9c",
+    "timeout_conexion": 3.05,  # segundos
+    "timeout_lectura": 10,  # segundos
+    "reintentos": 3,  # reintentos ante 429/5xx y fallos de conexión
+    "backoff": 0.5,  # espera exponencial: 0.5s, 1s, 2s...
+    "retry_after_max": 5,  # segundos: tope de la espera que pide Holded en Retry-After
+    "pool_conexiones": 10,
+    "streaming": True,  # parsear el stock según llega la respuesta (requiere ijson)
+    "snapshot_ttl": 300,  # segundos: pasado este tiempo se sirve el snapshot y se refresca en segundo plano
+    "snapshot_max_edad": 3600  # segundos: pasado este tiempo se refresca de forma síncrona
 }
 
 # Configuración de Técnicos
@@ -47,120 +91,597 @@ TECNICOS_CONFIG = {
     }
 }
 
+# Diario de escaneos: fsync agrupado cada N escrituras o cada X segundos
+DIARIO_LOTE_FSYNC = 20
+DIARIO_INTERVALO_FSYNC = 2.0  # segundos
+
 # Configuración de alertas
 ALERTA_CONSUMO_OFICINA_UMBRAL = 0.40  # 40%
 
-# Crear directorios
-os.makedirs(HISTORIAL_DIR, exist_ok=True)
-os.makedirs(INVENTARIOS_DIR, exist_ok=True)
+# Caché de resultados de análisis (subir VERSION_ANALISIS si cambia la lógica del análisis)
+VERSION_ANALISIS = 1
+CACHE_ANALISIS_MAX_MB = 256
+
+# Caché de archivos subidos ya leídos y validados, por hash de su contenido
+CACHE_ARCHIVOS_MAX_MB = 256
+
+# Códigos de estado del diagnóstico (columna 'Código Estado')
+ESTADO_NO_REGISTRADO = 1
+ESTADO_PERFECTO = 2
+ESTADO_OK_JUSTIFICADO = 3
+ESTADO_OK_PARTE_OFICINA = 4
+ESTADO_MALETA_VACIA = 5
+ESTADO_FALTAN_NO_ESCANEADO = 6
+ESTADO_FALTAN_CON_OFICINA = 7
+ESTADO_FALTAN_SIN_JUSTIFICAR = 8
+ESTADO_EXCESO = 9
+ESTADO_CONSUMO_EXCESIVO = 10
+ESTADO_DIFERENCIA_HOLDED = 11
+ESTADO_SIN_DATOS = 12
+ESTADO_REVISION = 13
+
+# Agrupación de los códigos de estado en las métricas de resumen
+CODIGOS_ESTADO_OK = (ESTADO_PERFECTO, ESTADO_OK_JUSTIFICADO, ESTADO_OK_PARTE_OFICINA)
+CODIGOS_ESTADO_FALTAN = (ESTADO_MALETA_VACIA, ESTADO_FALTAN_NO_ESCANEADO, ESTADO_FALTAN_CON_OFICINA,
+                         ESTADO_FALTAN_SIN_JUSTIFICAR)
+CODIGOS_ESTADO_EXCESO = (ESTADO_EXCESO, ESTADO_CONSUMO_EXCESIVO)
+
+# Categorías de la columna 'Origen Consumo'
+ORIGEN_SOLO_MALETA = '✅ Solo desde maleta'
+ORIGEN_MIXTO = '📦 Consumo mixto'
+ORIGEN_INSUFICIENTE = '⚠️ Stock insuficiente'
+ORIGEN_SIN_CONSUMO = '⚪ Sin consumo'
+ORIGENES_CONSUMO = (ORIGEN_SOLO_MALETA, ORIGEN_MIXTO, ORIGEN_INSUFICIENTE, ORIGEN_SIN_CONSUMO)
+
+# Formatos de la columna 'Trabajos/Órdenes': texto "101, 102", lista de IDs o número de órdenes
+FORMATOS_ORDENES = ('texto', 'lista', 'conteo')
+
+def crear_directorios():
+    """Crea los directorios de trabajo (al arrancar la app o el análisis por lotes, no al importar)."""
+    for directorio in (HISTORIAL_DIR, INVENTARIOS_DIR, DIARIOS_DIR, SNAPSHOTS_DIR, CACHE_DIR):
+        os.makedirs(directorio, exist_ok=True)
 
 # ============================================================================
 # FUNCIONES DE HOLDED API
 # ============================================================================
 
-@st.cache_data(ttl=300)  # Cache por 5 minutos
-def obtener_stock_warehouse(warehouse_id: str) -> Optional[Dict]:
-    """Obtiene el stock de un almacén específico desde Holded API."""
-    try:
-        headers = {
-            "key": HOLDED_CONFIG["api_key"],
+# Claves de las respuestas de Holded que envuelven la lista de productos, por prioridad
+CLAVES_LISTA_STOCK = ('data', 'products', 'items')
+
+def _normalizar_sku_holded(valor: Any) -> str:
+    """Normaliza un SKU recibido de Holded (mayúsculas, sin espacios)."""
+    if valor is None:
+        return ''
+    return str(valor).upper().strip()
+
+def normalizar_stock_holded(data: Any) -> Tuple[Optional[Dict[str, Any]], int]:
+    """Convierte cualquier formato de respuesta de stock de Holded en SKU -> stock en una sola pasada.
+    
+    Formatos soportados: lista de items, {"data"|"products"|"items": [items...]} y diccionario plano
+    con SKUs como claves (valor numérico o {"stock": ...}).
+    Devuelve (stock, items_descartados); stock es None si el formato no está soportado.
+    """
+    stock_dict = {}
+    descartados = 0
+    
+    # Detectar dónde está la lista de items
+    if isinstance(data, list):
+        items = data
+    elif isinstance(data, dict):
+        items = next((data[clave] for clave in CLAVES_LISTA_STOCK if isinstance(data.get(clave), list)), None)
+    else:
+        return None, 0
+    
+    if items is not None:
+        for item in items:
+            if isinstance(item, dict) and 'sku' in item:
+                sku = _normalizar_sku_holded(item['sku'])
+                if sku:  # Solo agregar si el SKU no está vacío
+                    stock_dict[sku] = item.get('stock', 0)
+            else:
+                descartados += 1
+    else:
+        # Diccionario plano con SKUs como claves
+        for key, value in data.items():
+            sku = _normalizar_sku_holded(key)
+            if not sku:
+                continue
+            if isinstance(value, (int, float)):
+                stock_dict[sku] = value
+            elif isinstance(value, dict) and 'stock' in value:
+                stock_dict[sku] = value['stock']
+    
+    return stock_dict, descartados
+
+class _NormalizadorStockIncremental:
+    """Versión incremental de normalizar_stock_holded: consume eventos de ijson según llega la respuesta,
+    sin materializar el JSON completo. Acumula solo los mapeos SKU -> stock de cada formato posible y
+    al final elige el mismo que elegiría normalizar_stock_holded.
+    """
+    
+    def __init__(self):
+        self.pila = []  # contenedores abiertos: 'map' o 'array'
+        self.claves = []  # clave actual de cada contenedor abierto (None en arrays)
+        self.raiz = None
+        self.listas = {clave: {} for clave in ('', ) + CLAVES_LISTA_STOCK}  # '' = lista raíz
+        self.listas_vistas = set()
+        self.plano = {}
+        self.descartados = {clave: 0 for clave in self.listas}
+        self.item = None  # item en construcción: {'nivel', 'destino', 'sku', 'stock', 'tiene_sku'}
+        self.valor = None  # 'sku' o 'stock' del item que es un objeto/lista: (clave, ObjectBuilder)
+    
+    def _lista_destino(self) -> Optional[str]:
+        """Si el contenedor actual es una lista de items de stock, devuelve su clave."""
+        nivel = len(self.pila)
+        if not self.pila or self.pila[-1] != 'array':
+            return None
+        if nivel == 1 and self.raiz == 'array':
+            return ''
+        if nivel == 2 and self.raiz == 'map' and self.claves[0] in CLAVES_LISTA_STOCK:
+            return self.claves[0]
+        return None
+    
+    def _abrir(self, tipo: str):
+        nivel = len(self.pila)
+        if nivel == 0:
+            self.raiz = tipo
+        elif self.item is not None:
+            # normalizar_stock_holded guarda 'sku' y 'stock' tal cual aunque no sean escalares
+            clave = self.claves[-1]
+            if nivel == self.item['nivel'] and clave in ('sku', 'stock') and self.valor is None:
+                self.valor = (clave, ijson.ObjectBuilder())
+                self.valor[1].event(f'start_{tipo}', None)
+        else:
+            destino = self._lista_destino()
+            if destino is not None:
+                if tipo == 'map':
+                    self.item = {'nivel': nivel + 1, 'destino': destino, 'sku': None, 'stock': 0, 'tiene_sku': False, 'tiene_stock': False}
+                else:
+                    self.descartados[destino] += 1
+            elif nivel == 1 and self.raiz == 'map':
+                clave = self.claves[0]
+                if tipo == 'array' and clave in CLAVES_LISTA_STOCK:
+                    self.listas_vistas.add(clave)
+                elif tipo == 'map':
+                    # Formato plano {"SKU": {"stock": n}}: solo cuenta si trae 'stock'
+                    self.item = {'nivel': nivel + 1, 'destino': None, 'sku': clave, 'stock': 0, 'tiene_sku': False, 'tiene_stock': False}
+        self.pila.append(tipo)
+        self.claves.append(None)
+    
+    def _cerrar(self):
+        if self.valor is not None and len(self.pila) == self.item['nivel'] + 1:
+            (clave, constructor), self.valor = self.valor, None
+            self._escalar_item(clave, constructor.value)
+        if self.item is not None and len(self.pila) == self.item['nivel']:
+            item, self.item = self.item, None
+            if item['destino'] is None:
+                sku = _normalizar_sku_holded(item['sku'])
+                if sku and item['tiene_stock']:
+                    self.plano[sku] = item['stock']
+            elif item['tiene_sku']:
+                sku = _normalizar_sku_holded(item['sku'])
+                if sku:
+                    self.listas[item['destino']][sku] = item['stock']
+            else:
+                self.descartados[item['destino']] += 1
+        self.pila.pop()
+        self.claves.pop()
+    
+    def _escalar_item(self, clave: str, valor: Any):
+        if clave == 'sku' and self.item['destino'] is not None:
+            self.item['sku'] = valor
+            self.item['tiene_sku'] = True
+        elif clave == 'stock':
+            self.item['stock'] = valor
+            self.item['tiene_stock'] = True
+    
+    def _escalar(self, valor: Any):
+        nivel = len(self.pila)
+        if self.item is not None:
+            if nivel == self.item['nivel']:
+                self._escalar_item(self.claves[-1], valor)
+            return
+        destino = self._lista_destino()
+        if destino is not None:
+            self.descartados[destino] += 1
+        elif nivel == 1 and self.raiz == 'map':
+            sku = _normalizar_sku_holded(self.claves[0])
+            if sku and isinstance(valor, (int, float)):
+                self.plano[sku] = valor
+        elif nivel == 0:
+            self.raiz = 'escalar'
+    
+    def procesar(self, eventos) -> Tuple[Optional[Dict[str, Any]], int]:
+        """Procesa los eventos (evento, valor) de ijson.basic_parse y devuelve (stock, items_descartados)."""
+        for evento, valor in eventos:
+            if self.valor is not None:
+                self.valor[1].event(evento, valor)
+            if evento == 'map_key':
+                self.claves[-1] = valor
+            elif evento == 'start_map':
+                self._abrir('map')
+            elif evento == 'start_array':
+                self._abrir('array')
+            elif evento in ('end_map', 'end_array'):
+                self._cerrar()
+            else:
+                self._escalar(valor)
+        
+        if self.raiz == 'array':
+            return self.listas[''], self.descartados['']
+        if self.raiz == 'map':
+            clave = next((c for c in CLAVES_LISTA_STOCK if c in self.listas_vistas), None)
+            if clave is not None:
+                return self.listas[clave], self.descartados[clave]
+            return self.plano, 0
+        return None, 0
+
+def normalizar_stock_holded_stream(fuente) -> Tuple[Optional[Dict[str, Any]], int]:
+    """Normaliza el stock leyendo la respuesta como flujo (objeto tipo fichero).
+    
+    Con ijson el JSON se procesa por eventos y nunca existe completo en memoria; sin ijson se decodifica entero.
+    """
+    if ijson is None:
+        return normalizar_stock_holded(json.load(fuente))
+    return _NormalizadorStockIncremental().procesar(ijson.basic_parse(fuente, use_float=True))
+
+def _resultado_holded(warehouse_id: str, inicio: float, stock: Optional[Dict] = None, error: Optional[str] = None,
+                      status: Optional[int] = None, mensaje: str = "", detalle: str = "",
+                      descartados: int = 0) -> Dict[str, Any]:
+    """Construye el resultado estructurado de una consulta a Holded."""
+    return {
+        'warehouse_id': warehouse_id,
+        'ok': error is None,
+        'stock': stock,
+        'error': error,  # None, 'configuracion', 'http', 'json', 'formato', 'timeout', 'conexion' o 'inesperado'
+        'status': status,
+        'mensaje': mensaje,
+        'detalle': detalle,
+        'descartados': descartados,
+        'duracion': time.perf_counter() - inicio
+    }
+
+class _RetryHolded(Retry):
+    """Retry de urllib3 que respeta Retry-After pero sin esperar más de `espera_maxima` segundos."""
+    
+    def __init__(self, *args, espera_maxima: float = HOLDED_CONFIG["retry_after_max"], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.espera_maxima = espera_maxima
+    
+    def new(self, **kwargs) -> "_RetryHolded":
+        # urllib3 crea un Retry nuevo en cada intento: se conserva el tope
+        nuevo = super().new(**kwargs)
+        nuevo.espera_maxima = self.espera_maxima
+        return nuevo
+    
+    def get_retry_after(self, response) -> Optional[float]:
+        espera = super().get_retry_after(response)
+        if espera is None:
+            return None
+        return min(espera, self.espera_maxima)
+
+class ClienteHolded:
+    """Cliente HTTP reutilizable para Holded: pool keep-alive, timeouts configurables,
+    reintentos con espera exponencial ante 429/5xx y compresión gzip.
+    
+    No pinta nada en la interfaz: devuelve resultados estructurados (ver _resultado_holded).
+    """
+    
+    def __init__(self, api_key: str, base_url: str, timeout_conexion: float = 3.05,
+                 timeout_lectura: float = 10, reintentos: int = 3, backoff: float = 0.5,
+                 pool_conexiones: int = 10, streaming: bool = True,
+                 retry_after_max: float = HOLDED_CONFIG["retry_after_max"]):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (timeout_conexion, timeout_lectura)
+        self.streaming = streaming and ijson is not None
+        
+        self.session = requests.Session()
+        self.session.headers.update({
+            "key": api_key,
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
             "Content-Type": "application/json"
-        }
+        })
         
-        url = f"{HOLDED_CONFIG['base_url']}/warehouses/{warehouse_id}/stock"
+        retry = _RetryHolded(
+            total=reintentos,
+            connect=reintentos,
+            read=reintentos,
+            status=reintentos,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+            espera_maxima=retry_after_max
+        )
+        adapter = HTTPAdapter(pool_connections=pool_conexiones, pool_maxsize=pool_conexiones, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+    
+    def obtener_stock(self, warehouse_id: str) -> Dict[str, Any]:
+        """Obtiene el stock de un almacén y devuelve un resultado estructurado."""
+        inicio = time.perf_counter()
+        url = f"{self.base_url}/warehouses/{warehouse_id}/stock"
         
-        with st.spinner(f"🔗 Consultando stock almacén {warehouse_id[-8:]}..."):
-            response = requests.get(url, headers=headers, timeout=10)
-            
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                
-                # Procesar según el tipo de respuesta
-                stock_dict = {}
-                
-                if isinstance(data, list):
-                    # Formato lista - procesar cada item
-                    for item in data:
-                        if isinstance(item, dict) and 'sku' in item:
-                            sku = item.get('sku', '').upper().strip()
-                            stock = item.get('stock', 0)
-                            if sku:  # Solo agregar si el SKU no está vacío
-                                stock_dict[sku] = stock
-                        else:
-                            st.warning(f"⚠️ Item con estructura inesperada: {item}")
-                
-                elif isinstance(data, dict):
-                    # Formato diccionario - puede tener diferentes estructuras
-                    if 'data' in data and isinstance(data['data'], list):
-                        # Caso: {"data": [items...], "meta": {...}}
-                        for item in data['data']:
-                            if isinstance(item, dict) and 'sku' in item:
-                                sku = item.get('sku', '').upper().strip()
-                                stock = item.get('stock', 0)
-                                if sku:
-                                    stock_dict[sku] = stock
-                    
-                    elif 'products' in data and isinstance(data['products'], list):
-                        # Caso: {"products": [items...]}
-                        for item in data['products']:
-                            if isinstance(item, dict) and 'sku' in item:
-                                sku = item.get('sku', '').upper().strip()
-                                stock = item.get('stock', 0)
-                                if sku:
-                                    stock_dict[sku] = stock
-                    
-                    elif 'items' in data and isinstance(data['items'], list):
-                        # Caso: {"items": [items...]}
-                        for item in data['items']:
-                            if isinstance(item, dict) and 'sku' in item:
-                                sku = item.get('sku', '').upper().strip()
-                                stock = item.get('stock', 0)
-                                if sku:
-                                    stock_dict[sku] = stock
-                    
-                    else:
-                        # Caso: diccionario plano con SKUs como claves
-                        for key, value in data.items():
-                            if isinstance(value, (int, float)) and key.upper().strip():
-                                stock_dict[key.upper().strip()] = value
-                            elif isinstance(value, dict) and 'stock' in value:
-                                sku = key.upper().strip()
-                                stock = value.get('stock', 0)
-                                if sku:
-                                    stock_dict[sku] = stock
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    return _resultado_holded(warehouse_id, inicio, error='http', status=response.status_code,
+                                             detalle=response.text[:300])
                 
+                if self.streaming:
+                    # Parsear según llega el cuerpo (descomprimiendo gzip al vuelo)
+                    response.raw.decode_content = True
+                    try:
+                        stock_dict, descartados = normalizar_stock_holded_stream(response.raw)
+                    except (ValueError, ijson.JSONError) as e:
+                        return _resultado_holded(warehouse_id, inicio, error='json', status=response.status_code,
+                                                 mensaje=str(e))
+                    if stock_dict is None:
+                        return _resultado_holded(warehouse_id, inicio, error='formato', status=response.status_code,
+                                                 mensaje="respuesta sin lista ni diccionario")
                 else:
-                    st.error(f"❌ Formato de respuesta no soportado de Holded: {type(data)}")
-                    st.code(f"Muestra de datos: {str(data)[:200]}...")
-                    return None
-                
-                st.success(f"✅ Stock obtenido del almacén: {len(stock_dict)} productos")
-                return stock_dict
-                
-            except json.JSONDecodeError as e:
-                st.error(f"❌ Error decodificando JSON de Holded: {str(e)}")
-                st.code(f"Respuesta recibida: {response.text[:500]}...")
-                return None
-                
-        else:
-            st.error(f"❌ Error API Holded almacén {warehouse_id[-8:]}: {response.status_code}")
-            if response.text:
-                st.code(f"Detalle del error: {response.text[:300]}...")
-            return None
+                    try:
+                        data = response.json()
+                    except ValueError as e:
+                        return _resultado_holded(warehouse_id, inicio, error='json', status=response.status_code,
+                                                 mensaje=str(e), detalle=response.text[:500])
+                    
+                    stock_dict, descartados = normalizar_stock_holded(data)
+                    if stock_dict is None:
+                        return _resultado_holded(warehouse_id, inicio, error='formato', status=response.status_code,
+                                                 mensaje=str(type(data)), detalle=str(data)[:200])
             
-    except requests.exceptions.Timeout:
+            return _resultado_holded(warehouse_id, inicio, stock=stock_dict, status=response.status_code,
+                                     descartados=descartados)
+        
+        except requests.exceptions.Timeout:
+            return _resultado_holded(warehouse_id, inicio, error='timeout')
+        except requests.exceptions.RequestException as e:
+            return _resultado_holded(warehouse_id, inicio, error='conexion', mensaje=str(e))
+        except Exception as e:
+            return _resultado_holded(warehouse_id, inicio, error='inesperado', mensaje=str(e),
+                                     detalle=type(e).__name__)
+
+@st.cache_resource
+def obtener_cliente_holded() -> ClienteHolded:
+    """Devuelve el cliente Holded compartido (una sesión HTTP por proceso)."""
+    return ClienteHolded(
+        HOLDED_CONFIG["api_key"],
+        HOLDED_CONFIG["base_url"],
+        timeout_conexion=HOLDED_CONFIG["timeout_conexion"],
+        timeout_lectura=HOLDED_CONFIG["timeout_lectura"],
+        reintentos=HOLDED_CONFIG["reintentos"],
+        backoff=HOLDED_CONFIG["backoff"],
+        pool_conexiones=HOLDED_CONFIG["pool_conexiones"],
+        streaming=HOLDED_CONFIG["streaming"],
+        retry_after_max=HOLDED_CONFIG["retry_after_max"]
+    )
+
+class AlmacenSnapshotsStock:
+    """Snapshots en disco del stock de cada almacén, con política stale-while-revalidate.
+    
+    - Snapshot más joven que `ttl`: se sirve tal cual.
+    - Entre `ttl` y `max_edad`: se sirve al instante y se lanza un refresco en segundo plano.
+    - Sin snapshot o más viejo que `max_edad`: se consulta Holded de forma síncrona.
+    
+    Los snapshots sobreviven a reinicios y se comparten entre procesos; en memoria se guarda
+    la última lectura de cada fichero y solo se vuelve a leer si cambia su mtime.
+    """
+    
+    def __init__(self, directorio: str, cliente: ClienteHolded, ttl: float, max_edad: float):
+        self.directorio = directorio
+        self.cliente = cliente
+        self.ttl = ttl
+        self.max_edad = max_edad
+        self._lock = threading.Lock()
+        self._memoria = {}  # warehouse_id -> (mtime_ns, snapshot)
+        self._refrescando = set()
+        os.makedirs(directorio, exist_ok=True)
+    
+    def _ruta(self, warehouse_id: str) -> str:
+        return os.path.join(self.directorio, f"{warehouse_id}.json")
+    
+    def leer(self, warehouse_id: str) -> Optional[Dict[str, Any]]:
+        """Lee el snapshot de un almacén ({'warehouse_id', 'timestamp', 'stock'}) o None si no existe."""
+        ruta = self._ruta(warehouse_id)
+        try:
+            mtime = os.stat(ruta).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        
+        with self._lock:
+            en_memoria = self._memoria.get(warehouse_id)
+        if en_memoria and en_memoria[0] == mtime:
+            return en_memoria[1]
+        
+        try:
+            with open(ruta, 'r') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        with self._lock:
+            self._memoria[warehouse_id] = (mtime, snapshot)
+        return snapshot
+    
+    def guardar(self, warehouse_id: str, stock: Dict[str, Any]) -> Dict[str, Any]:
+        """Guarda el snapshot de forma atómica (fichero temporal + rename)."""
+        snapshot = {'warehouse_id': warehouse_id, 'timestamp': time.time(), 'stock': stock}
+        ruta = self._ruta(warehouse_id)
+        ruta_tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(ruta_tmp, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(ruta_tmp, ruta)
+        
+        with self._lock:
+            self._memoria[warehouse_id] = (os.stat(ruta).st_mtime_ns, snapshot)
+        return snapshot
+    
+    def refrescar(self, warehouse_id: str) -> Dict[str, Any]:
+        """Consulta Holded y, si la respuesta es correcta, actualiza el snapshot."""
+        resultado = self.cliente.obtener_stock(warehouse_id)
+        if resultado['ok']:
+            snapshot = self.guardar(warehouse_id, resultado['stock'])
+            resultado.update({'timestamp': snapshot['timestamp'], 'edad': 0.0, 'refrescando': False})
+        return resultado
+    
+    def _refrescar_en_segundo_plano(self, warehouse_id: str) -> bool:
+        """Lanza un refresco en segundo plano si no hay ya uno en curso para ese almacén."""
+        with self._lock:
+            if warehouse_id in self._refrescando:
+                return True
+            self._refrescando.add(warehouse_id)
+        
+        def _tarea():
+            try:
+                self.refrescar(warehouse_id)
+            finally:
+                with self._lock:
+                    self._refrescando.discard(warehouse_id)
+        
+        threading.Thread(target=_tarea, name=f"refresco-stock-{warehouse_id[-8:]}", daemon=True).start()
+        return True
+    
+    def version(self, warehouse_id: str) -> Optional[float]:
+        """Timestamp del snapshot que serviría obtener() sin consultar Holded (None si tendría que consultarlo)."""
+        snapshot = self.leer(warehouse_id)
+        if snapshot is None or time.time() - snapshot['timestamp'] >= self.max_edad:
+            return None
+        return snapshot['timestamp']
+    
+    def obtener(self, warehouse_id: str) -> Dict[str, Any]:
+        """Devuelve el stock de un almacén aplicando la política stale-while-revalidate."""
+        inicio = time.perf_counter()
+        snapshot = self.leer(warehouse_id)
+        
+        if snapshot is not None:
+            edad = max(0.0, time.time() - snapshot['timestamp'])
+            if edad < self.max_edad:
+                refrescando = edad >= self.ttl and self._refrescar_en_segundo_plano(warehouse_id)
+                resultado = _resultado_holded(warehouse_id, inicio, stock=snapshot['stock'])
+                resultado.update({'timestamp': snapshot['timestamp'], 'edad': edad, 'refrescando': refrescando})
+                return resultado
+        
+        # Sin snapshot o demasiado antiguo: refresco síncrono
+        return self.refrescar(warehouse_id)
+
+@st.cache_resource
+def obtener_almacen_snapshots() -> AlmacenSnapshotsStock:
+    """Devuelve el almacén de snapshots de stock compartido por todas las sesiones."""
+    return AlmacenSnapshotsStock(
+        SNAPSHOTS_DIR,
+        obtener_cliente_holded(),
+        ttl=HOLDED_CONFIG["snapshot_ttl"],
+        max_edad=HOLDED_CONFIG["snapshot_max_edad"]
+    )
+
+def consultar_stock_warehouse(warehouse_id: str) -> Dict[str, Any]:
+    """Consulta el stock de un almacén a través de los snapshots en disco (resultado estructurado)."""
+    if not HOLDED_CONFIG["api_key"]:
+        return _resultado_holded(warehouse_id, time.perf_counter(), error='configuracion',
+                                 mensaje="Falta la variable de entorno HOLDED_API_KEY")
+    return obtener_almacen_snapshots().obtener(warehouse_id)
+
+def versiones_stock_almacenes(warehouse_ids: List[str]) -> Optional[Dict[str, Optional[float]]]:
+    """Versión (timestamp del snapshot) del stock que se usaría de cada almacén, sin consultar Holded.
+    
+    Devuelve None si alguno tendría que consultarse a Holded. Sin API key no hay stock: la versión es None.
+    """
+    if not HOLDED_CONFIG["api_key"]:
+        return {warehouse_id: None for warehouse_id in warehouse_ids}
+    almacen = obtener_almacen_snapshots()
+    versiones = {warehouse_id: almacen.version(warehouse_id) for warehouse_id in warehouse_ids}
+    return None if None in versiones.values() else versiones
+
+def almacenes_holded() -> List[str]:
+    """Devuelve los IDs de todos los almacenes configurados: maletas de técnicos y oficina."""
+    ids = [config["warehouse_id"] for config in TECNICOS_CONFIG.values()]
+    ids.append(HOLDED_CONFIG["almacen_oficina"])
+    return list(dict.fromkeys(ids))
+
+def consultar_stock_almacenes(warehouse_ids: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Consulta en paralelo el stock de varios almacenes (por defecto, todos los configurados).
+    
+    Devuelve un resultado estructurado por almacén; el tiempo total es el de la consulta más lenta.
+    """
+    ids = list(dict.fromkeys(warehouse_ids if warehouse_ids is not None else almacenes_holded()))
+    if not ids:
+        return {}
+    if len(ids) == 1:
+        return {ids[0]: consultar_stock_warehouse(ids[0])}
+    
+    max_hilos = min(len(ids), HOLDED_CONFIG["pool_conexiones"])
+    with ThreadPoolExecutor(max_workers=max_hilos) as executor:
+        resultados = list(executor.map(consultar_stock_warehouse, ids))
+    
+    return dict(zip(ids, resultados))
+
+def formatear_edad(segundos: float) -> str:
+    """Formatea una antigüedad en segundos de forma legible."""
+    if segundos < 60:
+        return f"{int(segundos)} s"
+    if segundos < 3600:
+        return f"{int(segundos // 60)} min"
+    return f"{segundos / 3600:.1f} h"
+
+def mostrar_resultado_holded(resultado: Dict[str, Any]):
+    """Muestra en la interfaz el resultado de una consulta de stock a Holded."""
+    warehouse_id = resultado['warehouse_id']
+    error = resultado['error']
+    
+    if error is None:
+        if resultado['descartados']:
+            st.warning(f"⚠️ {resultado['descartados']} items con estructura inesperada ignorados")
+        st.success(f"✅ Stock obtenido del almacén: {len(resultado['stock'])} productos")
+        if resultado.get('timestamp') is not None:
+            aviso_refresco = " · actualizando en segundo plano" if resultado.get('refrescando') else ""
+            st.caption(f"🕒 Snapshot de stock de hace {formatear_edad(resultado['edad'])}{aviso_refresco}")
+    elif error == 'configuracion':
+        st.error(f"🔑 {resultado['mensaje']}: no se puede consultar el stock de Holded")
+    elif error == 'http':
+        st.error(f"❌ Error API Holded almacén {warehouse_id[-8:]}: {resultado['status']}")
+        if resultado['detalle']:
+            st.code(f"Detalle del error: {resultado['detalle']}...")
+    elif error == 'json':
+        st.error(f"❌ Error decodificando JSON de Holded: {resultado['mensaje']}")
+        st.code(f"Respuesta recibida: {resultado['detalle']}...")
+    elif error == 'formato':
+        st.error(f"❌ Formato de respuesta no soportado de Holded: {resultado['mensaje']}")
+        st.code(f"Muestra de datos: {resultado['detalle']}...")
+    elif error == 'timeout':
         st.error("⏰ Timeout conectando con Holded API")
-        return None
-    except requests.exceptions.RequestException as e:
-        st.error(f"🔗 Error de conexión con Holded: {str(e)}")
-        return None
-    except Exception as e:
-        st.error(f"❌ Error inesperado con Holded API: {str(e)}")
-        st.code(f"Tipo de error: {type(e).__name__}")
-        return None
+    elif error == 'conexion':
+        st.error(f"🔗 Error de conexión con Holded: {resultado['mensaje']}")
+    else:
+        st.error(f"❌ Error inesperado con Holded API: {resultado['mensaje']}")
+        st.code(f"Tipo de error: {resultado['detalle']}")
+
+def obtener_stock_warehouse(warehouse_id: str) -> Optional[Dict]:
+    """Obtiene el stock de un almacén específico desde Holded API."""
+    with st.spinner(f"🔗 Consultando stock almacén {warehouse_id[-8:]}..."):
+        resultado = consultar_stock_warehouse(warehouse_id)
+    
+    mostrar_resultado_holded(resultado)
+    return resultado['stock'] if resultado['ok'] else None
+
+def obtener_stock_almacenes(warehouse_ids: Optional[List[str]] = None) -> Tuple[Dict[str, Optional[Dict]], Dict[str, Optional[float]]]:
+    """Obtiene en paralelo el stock de varios almacenes desde Holded API (None si falla alguno).
+    
+    Devuelve también la versión (timestamp del snapshot) de cada stock, None si no se obtuvo.
+    """
+    with st.spinner("🔗 Consultando stock de almacenes en paralelo..."):
+        resultados = consultar_stock_almacenes(warehouse_ids)
+    
+    stocks = {}
+    versiones = {}
+    for warehouse_id, resultado in resultados.items():
+        mostrar_resultado_holded(resultado)
+        stocks[warehouse_id] = resultado['stock'] if resultado['ok'] else None
+        versiones[warehouse_id] = resultado.get('timestamp') if resultado['ok'] else None
+    return stocks, versiones
 
-@st.cache_data(ttl=300)
 def obtener_stock_oficina() -> Optional[Dict]:
     """Obtiene el stock del almacén oficina."""
     return obtener_stock_warehouse(HOLDED_CONFIG["almacen_oficina"])
@@ -196,6 +717,67 @@ def analizar_origen_consumo(sku: str, consumo: float, inventario_maleta: float,
         return ("⚠️ Stock insuficiente", disponible_maleta, stock_oficina_sku, 
                 f"Falta stock: {int(deficit)} uds")
 
+def _texto_entero(valores: np.ndarray) -> np.ndarray:
+    """Convierte un array numérico a texto truncando igual que int()."""
+    return valores.astype(np.int64).astype(str).astype(object)
+
+def analizar_origen_consumo_vectorizado(df: pd.DataFrame, stock_oficina: Dict) -> pd.DataFrame:
+    """Analiza el origen del consumo de todos los SKUs a la vez (misma lógica que analizar_origen_consumo)."""
+    
+    n = len(df)
+    consumo = df['Usada'].fillna(0).to_numpy(dtype=float)
+    inventario_maleta = df['Contada'].fillna(0).to_numpy(dtype=float)
+    
+    # Reutilizar la columna de stock oficina si ya está calculada
+    if 'Stock Oficina' in df.columns:
+        stock_oficina_sku = df['Stock Oficina'].fillna(0).to_numpy(dtype=float)
+    elif stock_oficina and isinstance(stock_oficina, dict):
+        stock_oficina_sku = df['SKU'].map(stock_oficina).fillna(0).to_numpy(dtype=float)
+    else:
+        stock_oficina_sku = np.zeros(n)
+    
+    # Valores por defecto: sin consumo (códigos sobre ORIGENES_CONSUMO)
+    origen = np.full(n, ORIGENES_CONSUMO.index(ORIGEN_SIN_CONSUMO), dtype=np.int8)
+    desde_maleta = np.zeros(n)
+    desde_oficina = np.zeros(n)
+    descripcion = np.full(n, 'No hay consumo registrado', dtype=object)
+    
+    con_consumo = consumo > 0
+    solo_maleta = con_consumo & (consumo <= inventario_maleta)
+    mixto = con_consumo & ~solo_maleta & (consumo <= inventario_maleta + stock_oficina_sku)
+    insuficiente = con_consumo & ~solo_maleta & ~mixto
+    
+    # Cubierto por maleta
+    origen[solo_maleta] = ORIGENES_CONSUMO.index(ORIGEN_SOLO_MALETA)
+    desde_maleta[solo_maleta] = consumo[solo_maleta]
+    descripcion[solo_maleta] = 'Cubierto por maleta (' + _texto_entero(consumo[solo_maleta]) + ' uds)'
+    
+    # Consumo mixto maleta + oficina
+    if mixto.any():
+        maleta_m = inventario_maleta[mixto]
+        oficina_m = consumo[mixto] - maleta_m
+        porcentaje_m = np.char.mod('%.1f', (oficina_m / consumo[mixto]) * 100).astype(object)
+        origen[mixto] = ORIGENES_CONSUMO.index(ORIGEN_MIXTO)
+        desde_maleta[mixto] = maleta_m
+        desde_oficina[mixto] = oficina_m
+        descripcion[mixto] = ('Maleta: ' + _texto_entero(maleta_m) + ', Oficina: ' + _texto_entero(oficina_m)
+                              + ' (' + porcentaje_m + '%)')
+    
+    # Stock insuficiente total
+    if insuficiente.any():
+        deficit = consumo[insuficiente] - (inventario_maleta[insuficiente] + stock_oficina_sku[insuficiente])
+        origen[insuficiente] = ORIGENES_CONSUMO.index(ORIGEN_INSUFICIENTE)
+        desde_maleta[insuficiente] = inventario_maleta[insuficiente]
+        desde_oficina[insuficiente] = stock_oficina_sku[insuficiente]
+        descripcion[insuficiente] = 'Falta stock: ' + _texto_entero(deficit) + ' uds'
+    
+    return pd.DataFrame({
+        'Origen Consumo': pd.Categorical.from_codes(origen, categories=ORIGENES_CONSUMO),
+        'Desde Maleta': desde_maleta,
+        'Desde Oficina': desde_oficina,
+        'Descripción Origen': descripcion
+    }, index=df.index)
+
 def generar_alertas_dotacion(df_analisis: pd.DataFrame, consumo_df: pd.DataFrame) -> list:
     """Genera alertas para SKUs candidatos a añadir a dotación fija."""
     
@@ -236,32 +818,168 @@ def generar_alertas_dotacion(df_analisis: pd.DataFrame, consumo_df: pd.DataFrame
 # FUNCIONES ORIGINALES (MEJORADAS)
 # ============================================================================
 
-@st.cache_data
-def cargar_dotacion() -> Optional[pd.DataFrame]:
-    """Carga el archivo de dotación fija con manejo de errores mejorado."""
-    try:
-        if not os.path.exists("dotacion_fija.xlsx"):
-            st.error("❌ No se encontró el archivo 'dotacion_fija.xlsx'. Asegúrate de que esté en el directorio raíz.")
-            return None
+def normalizar_skus(serie: pd.Series) -> pd.Series:
+    """Normalización única de SKUs de todas las fuentes: texto sin espacios y en mayúsculas.
+    
+    Los SKUs que faltan siguen faltando (astype(str) los convertiría en 'nan' con pandas 2).
+    """
+    return serie.astype(str).str.strip().str.upper().where(serie.notna())
+
+class DiccionarioSKU:
+    """Asigna a cada SKU normalizado un código entero estable (por orden de aparición).
+    
+    Dotación, conteo, consumo y stocks de Holded se codifican con el mismo diccionario, de modo
+    que se cruzan alineando arrays por código en lugar de con merges y map sobre textos.
+    """
+    
+    def __init__(self):
+        self._codigos: Dict[str, int] = {}
+        self._skus: List[str] = []
+    
+    def __len__(self) -> int:
+        return len(self._skus)
+    
+    @property
+    def skus(self) -> np.ndarray:
+        """SKUs indexados por su código."""
+        return np.array(self._skus, dtype=object)
+    
+    def codificar(self, skus: pd.Series) -> np.ndarray:
+        """Códigos de una columna de SKUs ya normalizados (-1 si falta el SKU); los nuevos se añaden al diccionario."""
+        codigos_locales, valores = pd.factorize(skus)
+        valores = np.asarray(valores, dtype=object)
         
-        df = pd.read_excel("dotacion_fija.xlsx")
+        # Una posición más al final para el -1 de los SKUs que faltan (NaN), que se queda en -1
+        globales = np.full(len(valores) + 1, -1, dtype=np.int64)
+        globales[:-1] = np.fromiter((self._codigos.get(sku, -1) for sku in valores), dtype=np.int64, count=len(valores))
         
-        # Validar columnas requeridas
-        columnas_faltantes = [col for col in COLUMNAS_ESPERADAS['dotacion'] if col not in df.columns]
-        if columnas_faltantes:
-            st.error(f"❌ El archivo dotacion_fija.xlsx no tiene las columnas: {', '.join(columnas_faltantes)}")
+        nuevos = np.flatnonzero(globales[:-1] < 0)
+        if len(nuevos):
+            globales[nuevos] = np.arange(len(self._skus), len(self._skus) + len(nuevos))
+            self._skus.extend(valores[nuevos].tolist())
+            self._codigos.update(zip(valores[nuevos].tolist(), globales[nuevos].tolist()))
+        return globales[codigos_locales]
+    
+    def alinear_stock(self, stock: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Stock SKU -> cantidad como array indexado por código (0 para SKUs sin stock o fuera del diccionario)."""
+        alineado = np.zeros(len(self._skus))
+        if not stock:
+            return alineado
+        codigos = np.fromiter((self._codigos.get(sku, -1) for sku in stock), dtype=np.int64, count=len(stock))
+        cantidades = pd.to_numeric(pd.Series(list(stock.values()), dtype=object), errors='coerce').fillna(0).to_numpy(dtype=float)
+        conocidos = codigos >= 0
+        alineado[codigos[conocidos]] = cantidades[conocidos]
+        return alineado
+
+def _hash_archivo(ruta: str) -> str:
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def compilar_dotacion(ruta: str) -> Tuple[pd.DataFrame, Dict[str, Dict[str, Any]]]:
+    """Lee el Excel de dotación y devuelve el DataFrame limpio y tipado junto con su índice por SKU."""
+    df = pd.read_excel(ruta)
+    
+    # Validar columnas requeridas
+    columnas_faltantes = [col for col in COLUMNAS_ESPERADAS['dotacion'] if col not in df.columns]
+    if columnas_faltantes:
+        raise ValueError(f"El archivo {os.path.basename(ruta)} no tiene las columnas: {', '.join(columnas_faltantes)}")
+    
+    # Limpiar SKUs y tipar las columnas numéricas ('Nº ORDEN' se deja tal cual: mezcla textos y fechas)
+    df['SKU'] = normalizar_skus(df['SKU'])
+    for columna in ('DOTACIÓN', 'CAJA', 'SECCION'):
+        df[columna] = pd.to_numeric(df[columna], errors='coerce')
+    
+    return df, construir_indice_dotacion(df)
+
+def _cargar_dotacion_compilada(ruta: str, mtime_ns: int, tamano: int) -> Dict[str, Any]:
+    """Devuelve la dotación compilada desde la caché de disco, recompilándola si el Excel cambió.
+    
+    La caché se valida por mtime y tamaño; si solo cambió el mtime se compara el hash del
+    contenido antes de recompilar. Se comparte entre procesos (escritura atómica).
+    """
+    ruta_cache = os.path.join(CACHE_DIR, "dotacion.pkl")
+    fuente = os.path.abspath(ruta)
+    
+    try:
+        with open(ruta_cache, 'rb') as f:
+            cache = pickle.load(f)
+        if cache['version'] == VERSION_CACHE_DOTACION and cache['fuente'] == fuente:
+            if (cache['mtime_ns'], cache['tamano']) == (mtime_ns, tamano):
+                return cache
+            if cache['tamano'] == tamano and cache['hash'] == _hash_archivo(ruta):
+                cache['mtime_ns'] = mtime_ns
+                _escribir_cache_dotacion(ruta_cache, cache)
+                return cache
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError, AttributeError):
+        pass
+    
+    df, indice = compilar_dotacion(ruta)
+    cache = {
+        'version': VERSION_CACHE_DOTACION,
+        'fuente': fuente,
+        'mtime_ns': mtime_ns,
+        'tamano': tamano,
+        'hash': _hash_archivo(ruta),
+        'df': df,
+        'indice': indice
+    }
+    _escribir_cache_dotacion(ruta_cache, cache)
+    return cache
+
+def _escribir_cache_dotacion(ruta_cache: str, cache: Dict[str, Any]):
+    try:
+        os.makedirs(os.path.dirname(ruta_cache) or ".", exist_ok=True)
+        ruta_tmp = f"{ruta_cache}.{os.getpid()}.tmp"
+        with open(ruta_tmp, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(ruta_tmp, ruta_cache)
+    except OSError:
+        # Sin caché en disco se sigue funcionando: solo se pierde el arranque rápido
+        pass
+
+@st.cache_data(show_spinner=False)
+def _dotacion_en_memoria(ruta: str, mtime_ns: int, tamano: int) -> Tuple[pd.DataFrame, Dict[str, Dict[str, Any]]]:
+    # La clave incluye mtime y tamaño: editar el Excel invalida la entrada sin reiniciar
+    cache = _cargar_dotacion_compilada(ruta, mtime_ns, tamano)
+    return cache['df'], cache['indice']
+
+def cargar_dotacion_compilada() -> Optional[Tuple[pd.DataFrame, Dict[str, Dict[str, Any]]]]:
+    """Carga la dotación fija y su índice por SKU con manejo de errores mejorado."""
+    try:
+        if not os.path.exists(DOTACION_ARCHIVO):
+            st.error(f"❌ No se encontró el archivo '{DOTACION_ARCHIVO}'. Asegúrate de que esté en el directorio raíz.")
             return None
-            
-        # Limpiar SKUs
-        df['SKU'] = df['SKU'].astype(str).str.strip().str.upper()
+        
+        info = os.stat(DOTACION_ARCHIVO)
+        df, indice = _dotacion_en_memoria(DOTACION_ARCHIVO, info.st_mtime_ns, info.st_size)
         
         st.success(f"✅ Dotación fija cargada: {len(df)} elementos")
-        return df
+        return df, indice
         
+    except ValueError as e:
+        st.error(f"❌ {str(e)}")
+        return None
     except Exception as e:
         st.error(f"❌ Error cargando dotación fija: {str(e)}")
         return None
 
+def cargar_dotacion() -> Optional[pd.DataFrame]:
+    """Carga el archivo de dotación fija con manejo de errores mejorado."""
+    compilada = cargar_dotacion_compilada()
+    return compilada[0] if compilada is not None else None
+
+def construir_indice_dotacion(dotacion_df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """Construye un índice hash SKU -> registro de dotación para búsquedas O(1)."""
+    if dotacion_df is None or dotacion_df.empty:
+        return {}
+    
+    # Si un SKU aparece repetido, prevalece la primera fila (como en los filtros originales)
+    registros = dotacion_df.drop_duplicates(subset='SKU', keep='first').set_index('SKU')
+    return registros[['DOTACIÓN', 'CAJA', 'SECCION', 'Nº ORDEN']].to_dict('index')
+
 def determinar_estado_completo(dotacion: float, inventariado: float, usada: float, 
                              stock_maleta: Optional[float] = None, desde_oficina: float = 0,
                              origen_consumo: str = "") -> str:
@@ -331,6 +1049,460 @@ def determinar_estado_completo(dotacion: float, inventariado: float, usada: floa
     # Caso edge
     return "🔍 Revisión - Datos inconsistentes"
 
+def determinar_estado_vectorizado(df: pd.DataFrame) -> pd.DataFrame:
+    """Calcula 'Diagnóstico' y 'Código Estado' para todos los SKUs a la vez (misma lógica que determinar_estado_completo)."""
+    
+    n = len(df)
+    
+    def _columna(nombre: str) -> np.ndarray:
+        if nombre in df.columns:
+            return df[nombre].fillna(0).to_numpy(dtype=float)
+        return np.zeros(n)
+    
+    dotacion = _columna('DOTACIÓN')
+    inventariado = _columna('Contada')
+    usada = _columna('Usada')
+    stock_maleta = _columna('Stock Maleta Holded')
+    desde_oficina = _columna('Desde Oficina')
+    
+    reposicion_necesaria = dotacion - inventariado
+    consumo_esperado_maleta = usada - desde_oficina
+    faltante = reposicion_necesaria - consumo_esperado_maleta
+    diferencia_holded = inventariado - stock_maleta
+    
+    justificado = np.abs(faltante) <= 0.01
+    maleta_vacia = (inventariado == 0) & (dotacion > 0)
+    con_oficina = desde_oficina > 0
+    
+    # Mismo orden de prioridad que la cadena if/elif de determinar_estado_completo
+    codigo = np.select(
+        [
+            (dotacion == 0) & (inventariado > 0),
+            (dotacion == inventariado) & (usada == 0),
+            justificado & con_oficina,
+            justificado,
+            maleta_vacia & con_oficina,
+            maleta_vacia,
+            (faltante > 0) & con_oficina,
+            faltante > 0,
+            inventariado > dotacion,
+            consumo_esperado_maleta < 0,
+            np.abs(diferencia_holded) > 0.01,
+            (dotacion == 0) & (inventariado == 0) & (usada == 0),
+        ],
+        [
+            ESTADO_NO_REGISTRADO, ESTADO_PERFECTO, ESTADO_OK_PARTE_OFICINA, ESTADO_OK_JUSTIFICADO,
+            ESTADO_MALETA_VACIA, ESTADO_FALTAN_NO_ESCANEADO, ESTADO_FALTAN_CON_OFICINA,
+            ESTADO_FALTAN_SIN_JUSTIFICAR, ESTADO_EXCESO, ESTADO_CONSUMO_EXCESIVO,
+            ESTADO_DIFERENCIA_HOLDED, ESTADO_SIN_DATOS,
+        ],
+        default=ESTADO_REVISION
+    ).astype(np.int8)
+    
+    # Textos por código, formateados solo sobre las filas afectadas
+    etiquetas = {
+        ESTADO_NO_REGISTRADO: lambda m: '🆕 SKU escaneado no registrado (' + _texto_entero(inventariado[m]) + ' unidades)',
+        ESTADO_PERFECTO: lambda m: '✅ Perfecto - Sin consumo',
+        ESTADO_OK_PARTE_OFICINA: lambda m: '✅ OK - Parte desde oficina (' + _texto_entero(desde_oficina[m]) + ' uds)',
+        ESTADO_OK_JUSTIFICADO: lambda m: '✅ OK - Consumo justificado',
+        ESTADO_MALETA_VACIA: lambda m: '❌ Maleta vacía - Consumo desde oficina (' + _texto_entero(desde_oficina[m]) + ' uds)',
+        ESTADO_FALTAN_NO_ESCANEADO: lambda m: '❌ Faltan ' + _texto_entero(dotacion[m]) + ' - No escaneado',
+        ESTADO_FALTAN_CON_OFICINA: lambda m: ('❌ Faltan ' + _texto_entero(faltante[m]) + ' + '
+                                              + _texto_entero(desde_oficina[m]) + ' desde oficina'),
+        ESTADO_FALTAN_SIN_JUSTIFICAR: lambda m: '❌ Faltan ' + _texto_entero(faltante[m]) + ' - Sin justificar',
+        ESTADO_EXCESO: lambda m: '⚠️ Exceso de ' + _texto_entero(inventariado[m] - dotacion[m]) + ' unidades',
+        ESTADO_CONSUMO_EXCESIVO: lambda m: '⚠️ Consumo excesivo maleta +' + _texto_entero(np.abs(consumo_esperado_maleta[m])),
+        ESTADO_DIFERENCIA_HOLDED: lambda m: (np.where(diferencia_holded[m] > 0, '🏢 +', '🏢 ').astype(object)
+                                             + _texto_entero(diferencia_holded[m]) + ' vs Holded'),
+        ESTADO_SIN_DATOS: lambda m: '❓ Sin datos de inventario',
+    }
+    
+    diagnostico = np.full(n, '🔍 Revisión - Datos inconsistentes', dtype=object)
+    for codigo_estado, etiqueta in etiquetas.items():
+        mascara = codigo == codigo_estado
+        if mascara.any():
+            diagnostico[mascara] = etiqueta(mascara)
+    
+    return pd.DataFrame({
+        'Diagnóstico': pd.Categorical(diagnostico),
+        'Código Estado': codigo
+    }, index=df.index)
+
+# ============================================================================
+# BASE DE DATOS (SQLite)
+# ============================================================================
+
+ESQUEMA_BD = """
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor TEXT
+);
+CREATE TABLE IF NOT EXISTS inventarios (
+    id INTEGER PRIMARY KEY,
+    archivo TEXT UNIQUE NOT NULL,
+    tecnico TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    timestamp TEXT,
+    estado TEXT NOT NULL,
+    warehouse_id TEXT,
+    total_skus INTEGER NOT NULL DEFAULT 0,
+    total_unidades INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_inventarios_tecnico ON inventarios (tecnico, fecha);
+CREATE INDEX IF NOT EXISTS idx_inventarios_fecha ON inventarios (fecha);
+CREATE INDEX IF NOT EXISTS idx_inventarios_estado ON inventarios (estado, fecha);
+CREATE TABLE IF NOT EXISTS lineas_inventario (
+    inventario_id INTEGER NOT NULL REFERENCES inventarios (id) ON DELETE CASCADE,
+    sku TEXT NOT NULL,
+    cantidad INTEGER NOT NULL,
+    PRIMARY KEY (inventario_id, sku)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS analisis (
+    id INTEGER PRIMARY KEY,
+    archivo TEXT UNIQUE NOT NULL,
+    tecnico TEXT NOT NULL,
+    fecha_inicio TEXT,
+    fecha_fin TEXT,
+    creado TEXT NOT NULL,
+    total_skus INTEGER NOT NULL DEFAULT 0,
+    total_alertas INTEGER NOT NULL DEFAULT 0,
+    columnas TEXT NOT NULL,
+    tipos TEXT,
+    resumen TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_analisis_tecnico ON analisis (tecnico, creado);
+CREATE INDEX IF NOT EXISTS idx_analisis_creado ON analisis (creado);
+CREATE TABLE IF NOT EXISTS lineas_analisis (
+    analisis_id INTEGER NOT NULL REFERENCES analisis (id) ON DELETE CASCADE,
+    fila INTEGER NOT NULL,
+    sku TEXT,
+    codigo_estado INTEGER,
+    datos TEXT NOT NULL,
+    PRIMARY KEY (analisis_id, fila)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_lineas_analisis_estado ON lineas_analisis (codigo_estado, analisis_id);
+"""
+
+# Columnas añadidas después de crear el esquema: se añaden con ALTER TABLE a las bases de datos existentes
+COLUMNAS_NUEVAS_BD = {
+    'analisis': {'tipos': 'TEXT', 'resumen': 'TEXT'}
+}
+
+def _valor_a_json(valor: Any) -> Any:
+    """Convierte a JSON los valores que json no sabe escribir; las fechas se marcan para recuperarlas al leer."""
+    if valor is pd.NaT:
+        return None
+    if isinstance(valor, datetime):
+        return {'$fecha': valor.isoformat()}
+    if isinstance(valor, date):
+        return {'$dia': valor.isoformat()}
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if isinstance(valor, np.ndarray):
+        return valor.tolist()
+    raise TypeError(f"Valor no serializable: {type(valor).__name__}")
+
+def _valor_desde_json(objeto: Dict[str, Any]) -> Any:
+    if len(objeto) == 1:
+        if '$fecha' in objeto:
+            return datetime.fromisoformat(objeto['$fecha'])
+        if '$dia' in objeto:
+            return date.fromisoformat(objeto['$dia'])
+    return objeto
+
+def _tipos_columnas(df: pd.DataFrame) -> Dict[str, Any]:
+    """dtype de cada columna (y categorías de las categóricas) para reconstruir el DataFrame tal cual."""
+    tipos = {}
+    for columna, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            tipos[str(columna)] = {'dtype': 'category', 'categorias': dtype.categories.tolist()}
+        else:
+            tipos[str(columna)] = {'dtype': str(dtype)}
+    return tipos
+
+def _restaurar_tipos(df: pd.DataFrame, tipos: Dict[str, Any]) -> pd.DataFrame:
+    for columna, tipo in tipos.items():
+        if columna not in df.columns:
+            continue
+        if tipo['dtype'] == 'category':
+            df[columna] = pd.Categorical(df[columna], categories=tipo['categorias'])
+        elif tipo['dtype'] == 'object':
+            df[columna] = df[columna].astype(object)
+        else:
+            df[columna] = df[columna].astype(pd.api.types.pandas_dtype(tipo['dtype']))
+    return df
+
+class BaseDatosMaleta:
+    """Almacén SQLite de inventarios y análisis, indexado por técnico, fecha y estado.
+    
+    Los JSON de inventarios/ y los Excel de historial/ se siguen escribiendo para descargas y
+    copias; los listados, filtros y cargas se resuelven con consultas indexadas. Los archivos que
+    no llegaron a registrarse aquí se recogen con sincronizar_archivos.
+    """
+    
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._no_importables = set()  # (archivo, mtime) que no se pudieron leer: no se reintentan hasta que cambien
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(ESQUEMA_BD)
+            for tabla, columnas in COLUMNAS_NUEVAS_BD.items():
+                existentes = {fila['name'] for fila in conn.execute(f"PRAGMA table_info({tabla})")}
+                for columna, tipo in columnas.items():
+                    if columna not in existentes:
+                        conn.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {tipo}")
+    
+    @contextmanager
+    def _conectar(self):
+        # Una conexión por operación: Streamlit ejecuta cada sesión en su propio hilo
+        conn = sqlite3.connect(self.ruta, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys=ON")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    # --- Inventarios ---
+    
+    def guardar_inventario(self, archivo: str, datos: Dict[str, Any]):
+        """Inserta o reemplaza un inventario y sus líneas de escaneo."""
+        inventario = datos.get('inventario', {})
+        with self._conectar() as conn:
+            conn.execute(
+                """INSERT INTO inventarios (archivo, tecnico, fecha, timestamp, estado, warehouse_id, total_skus, total_unidades)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (archivo) DO UPDATE SET
+                       tecnico = excluded.tecnico, fecha = excluded.fecha, timestamp = excluded.timestamp,
+                       estado = excluded.estado, warehouse_id = excluded.warehouse_id,
+                       total_skus = excluded.total_skus, total_unidades = excluded.total_unidades""",
+                (archivo, datos.get('tecnico'), datos.get('fecha'), datos.get('timestamp'), datos.get('estado'),
+                 datos.get('warehouse_id'), datos.get('total_skus', len(inventario)),
+                 datos.get('total_unidades', sum(inventario.values())))
+            )
+            inventario_id = conn.execute("SELECT id FROM inventarios WHERE archivo = ?", (archivo,)).fetchone()[0]
+            conn.execute("DELETE FROM lineas_inventario WHERE inventario_id = ?", (inventario_id,))
+            conn.executemany(
+                "INSERT INTO lineas_inventario (inventario_id, sku, cantidad) VALUES (?, ?, ?)",
+                ((inventario_id, sku, int(cantidad)) for sku, cantidad in inventario.items())
+            )
+    
+    def listar_inventarios(self, tecnico: Optional[str] = None, estado: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Lista los metadatos de inventarios (más recientes primero), filtrando por técnico/estado."""
+        condiciones, parametros = [], []
+        if tecnico:
+            condiciones.append("tecnico = ?")
+            parametros.append(tecnico)
+        if estado:
+            condiciones.append("estado = ?")
+            parametros.append(estado)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        with self._conectar() as conn:
+            filas = conn.execute(
+                f"""SELECT archivo, tecnico, fecha, estado, total_skus, total_unidades
+                    FROM inventarios {where} ORDER BY fecha DESC, timestamp DESC""",
+                parametros
+            ).fetchall()
+        return [dict(fila) for fila in filas]
+    
+    def valores_inventarios(self, campo: str) -> List[str]:
+        """Valores distintos de 'tecnico' o 'estado' (para los filtros)."""
+        if campo not in ('tecnico', 'estado'):
+            raise ValueError(f"Campo no filtrable: {campo}")
+        with self._conectar() as conn:
+            return [fila[0] for fila in conn.execute(f"SELECT DISTINCT {campo} FROM inventarios ORDER BY {campo}")]
+    
+    def cargar_inventario(self, archivo: str) -> Optional[Dict[str, Any]]:
+        """Devuelve el inventario con la misma forma que su JSON (None si no existe)."""
+        with self._conectar() as conn:
+            cabecera = conn.execute("SELECT * FROM inventarios WHERE archivo = ?", (archivo,)).fetchone()
+            if cabecera is None:
+                return None
+            lineas = conn.execute(
+                "SELECT sku, cantidad FROM lineas_inventario WHERE inventario_id = ?", (cabecera['id'],)
+            ).fetchall()
+        datos = dict(cabecera)
+        datos.pop('id')
+        datos['inventario'] = {sku: cantidad for sku, cantidad in lineas}
+        return datos
+    
+    def eliminar_inventario(self, archivo: str):
+        with self._conectar() as conn:
+            conn.execute("DELETE FROM inventarios WHERE archivo = ?", (archivo,))
+    
+    # --- Análisis ---
+    
+    def guardar_analisis(self, archivo: str, df: pd.DataFrame, tecnico: str, fecha_inicio, fecha_fin,
+                         total_alertas: int = 0, creado: Optional[datetime] = None,
+                         resumen: Optional[Dict[str, Any]] = None):
+        """Inserta o reemplaza un análisis con una fila por SKU (con sus tipos, para recargarlo igual).
+        
+        Las métricas de resumen se guardan con él: el historial las muestra sin leer las filas.
+        """
+        creado = (creado or datetime.now()).isoformat(timespec='seconds')
+        if resumen is None:
+            resumen = calcular_resumen_analisis(df)
+        # Columnas como listas de Python: iterar por filas las columnas de texto de Arrow es mucho más lento
+        nombres = [str(columna) for columna in df.columns]
+        valores = [df[columna].tolist() for columna in df.columns]
+        filas = [
+            json.dumps(dict(zip(nombres, fila)), default=_valor_a_json, ensure_ascii=False)
+            for fila in zip(*valores)
+        ]
+        skus = df['SKU'].astype(str).tolist() if 'SKU' in df.columns else [None] * len(df)
+        if 'Código Estado' in df.columns:
+            codigos = [int(c) for c in df['Código Estado'].fillna(0)]
+        else:
+            codigos = [None] * len(df)
+        
+        with self._conectar() as conn:
+            conn.execute(
+                """INSERT INTO analisis (archivo, tecnico, fecha_inicio, fecha_fin, creado, total_skus, total_alertas,
+                                        columnas, tipos, resumen)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (archivo) DO UPDATE SET
+                       tecnico = excluded.tecnico, fecha_inicio = excluded.fecha_inicio, fecha_fin = excluded.fecha_fin,
+                       creado = excluded.creado, total_skus = excluded.total_skus,
+                       total_alertas = excluded.total_alertas, columnas = excluded.columnas, tipos = excluded.tipos,
+                       resumen = excluded.resumen""",
+                (archivo, tecnico, str(fecha_inicio), str(fecha_fin), creado, len(df), total_alertas,
+                 json.dumps([str(c) for c in df.columns], ensure_ascii=False),
+                 json.dumps(_tipos_columnas(df), ensure_ascii=False),
+                 json.dumps(resumen, ensure_ascii=False))
+            )
+            analisis_id = conn.execute("SELECT id FROM analisis WHERE archivo = ?", (archivo,)).fetchone()[0]
+            conn.execute("DELETE FROM lineas_analisis WHERE analisis_id = ?", (analisis_id,))
+            conn.executemany(
+                "INSERT INTO lineas_analisis (analisis_id, fila, sku, codigo_estado, datos) VALUES (?, ?, ?, ?, ?)",
+                ((analisis_id, i, skus[i], codigos[i], fila) for i, fila in enumerate(filas))
+            )
+    
+    def listar_analisis(self, tecnico: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Lista los metadatos de análisis (más recientes primero)."""
+        where, parametros = ("WHERE tecnico = ?", (tecnico,)) if tecnico else ("", ())
+        with self._conectar() as conn:
+            filas = conn.execute(
+                f"""SELECT archivo, tecnico, fecha_inicio, fecha_fin, creado, total_skus, total_alertas
+                    FROM analisis {where} ORDER BY creado DESC""",
+                parametros
+            ).fetchall()
+        return [dict(fila) for fila in filas]
+    
+    def tecnicos_analisis(self) -> List[str]:
+        with self._conectar() as conn:
+            return [fila[0] for fila in conn.execute("SELECT DISTINCT tecnico FROM analisis ORDER BY tecnico")]
+    
+    def cargar_resumen_analisis(self, archivo: str) -> Optional[Dict[str, Any]]:
+        """Métricas de resumen guardadas con el análisis (None si no está o se guardó sin ellas)."""
+        with self._conectar() as conn:
+            fila = conn.execute("SELECT resumen, tipos FROM analisis WHERE archivo = ?", (archivo,)).fetchone()
+        if fila is None or fila['resumen'] is None or fila['tipos'] is None:
+            return None
+        return json.loads(fila['resumen'])
+    
+    def cargar_analisis(self, archivo: str, codigos_estado: Optional[List[int]] = None,
+                        limite: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """Reconstruye el DataFrame de un análisis, opcionalmente solo con ciertos códigos de estado
+        y con las `limite` primeras filas.
+        
+        Devuelve None si no está registrado o si se guardó sin tipos (versiones anteriores): en ese
+        caso se lee de su Excel.
+        """
+        with self._conectar() as conn:
+            cabecera = conn.execute("SELECT id, columnas, tipos FROM analisis WHERE archivo = ?", (archivo,)).fetchone()
+            if cabecera is None or cabecera['tipos'] is None:
+                return None
+            consulta = "SELECT datos FROM lineas_analisis WHERE analisis_id = ?"
+            parametros = [cabecera['id']]
+            if codigos_estado:
+                consulta += f" AND codigo_estado IN ({', '.join('?' * len(codigos_estado))})"
+                parametros.extend(codigos_estado)
+            consulta += " ORDER BY fila"
+            if limite is not None:
+                consulta += " LIMIT ?"
+                parametros.append(limite)
+            filas = [fila[0] for fila in conn.execute(consulta, parametros)]
+        
+        columnas = json.loads(cabecera['columnas'])
+        df = pd.DataFrame.from_records([json.loads(fila, object_hook=_valor_desde_json) for fila in filas],
+                                       columns=columnas)
+        return _restaurar_tipos(df, json.loads(cabecera['tipos']))
+    
+    def eliminar_analisis(self, archivo: str):
+        with self._conectar() as conn:
+            conn.execute("DELETE FROM analisis WHERE archivo = ?", (archivo,))
+    
+    # --- Sincronización con los archivos ---
+    
+    def sincronizar_archivos(self, inventarios_dir: str, historial_dir: str) -> Tuple[int, int]:
+        """Registra los JSON de inventarios y los Excel de historial que aún no están en la base de datos.
+        
+        Recoge los archivos anteriores a la base de datos y los que se guardaron mientras no estaba disponible.
+        """
+        with self._conectar() as conn:
+            inventarios_registrados = {fila[0] for fila in conn.execute("SELECT archivo FROM inventarios")}
+            analisis_registrados = {fila[0] for fila in conn.execute("SELECT archivo FROM analisis")}
+        
+        importados_inv = importados_an = 0
+        
+        for archivo in sorted(os.listdir(inventarios_dir)):
+            if not archivo.endswith('.json') or archivo in inventarios_registrados:
+                continue
+            ruta = os.path.join(inventarios_dir, archivo)
+            try:
+                clave = (ruta, os.path.getmtime(ruta))
+                if clave in self._no_importables:
+                    continue
+                with open(ruta, 'r') as f:
+                    self.guardar_inventario(archivo, json.load(f))
+                importados_inv += 1
+            except sqlite3.Error:
+                continue
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError, TypeError):
+                self._no_importables.add(clave)
+        
+        for archivo in sorted(os.listdir(historial_dir)):
+            if not archivo.endswith('.xlsx') or archivo in analisis_registrados:
+                continue
+            ruta = os.path.join(historial_dir, archivo)
+            try:
+                clave = (ruta, os.path.getmtime(ruta))
+                if clave in self._no_importables:
+                    continue
+                hojas = pd.read_excel(ruta, sheet_name=None)
+                df = hojas['Análisis Detallado']
+                metadatos = {}
+                if 'Metadatos' in hojas:
+                    metadatos = dict(zip(hojas['Metadatos']['Campo'], hojas['Metadatos']['Valor']))
+                creado = datetime.fromtimestamp(os.path.getmtime(ruta))
+                self.guardar_analisis(
+                    archivo, df,
+                    tecnico=str(metadatos.get('Técnico', archivo.split('_')[0])),
+                    fecha_inicio=metadatos.get('Fecha Inicio', ''),
+                    fecha_fin=metadatos.get('Fecha Fin', ''),
+                    total_alertas=int(metadatos.get('Alertas Generadas', 0) or 0),
+                    creado=creado
+                )
+                importados_an += 1
+            except sqlite3.Error:
+                continue
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError, TypeError):
+                self._no_importables.add(clave)
+        
+        return importados_inv, importados_an
+
+@st.cache_resource
+def obtener_base_datos() -> BaseDatosMaleta:
+    """Base de datos compartida por todas las sesiones (registra los archivos existentes al crearla)."""
+    bd = BaseDatosMaleta(BD_RUTA)
+    bd.sincronizar_archivos(INVENTARIOS_DIR, HISTORIAL_DIR)
+    return bd
+
 # ============================================================================
 # FUNCIONES DE INVENTARIO
 # ============================================================================
@@ -343,8 +1515,15 @@ def inicializar_inventario_session():
         st.session_state.tecnico_actual = None
     if 'dotacion_df' not in st.session_state:
         st.session_state.dotacion_df = None
+    if 'indice_dotacion' not in st.session_state:
+        st.session_state.indice_dotacion = None
     if 'stock_holded' not in st.session_state:
         st.session_state.stock_holded = None
+    if 'inventario_vista' not in st.session_state:
+        st.session_state.inventario_vista = None
+        st.session_state.inventario_contadores = None
+    if 'diario_escaneos' not in st.session_state:
+        st.session_state.diario_escaneos = None
 
 def guardar_inventario(tecnico: str, inventario_data: Dict, completado: bool = False):
     """Guarda el inventario del técnico."""
@@ -368,6 +1547,11 @@ def guardar_inventario(tecnico: str, inventario_data: Dict, completado: bool = F
     try:
         with open(path_archivo, 'w') as f:
             json.dump(datos_completos, f, indent=2)
+        try:
+            obtener_base_datos().guardar_inventario(nombre_archivo, datos_completos)
+        except sqlite3.Error as e:
+            # El JSON es el dato: se conserva y se registra en la siguiente sincronización
+            st.warning(f"⚠️ Inventario sin registrar en la base de datos: {str(e)}")
         
         if completado:
             st.success(f"✅ Inventario completado y guardado: {nombre_archivo}")
@@ -379,30 +1563,302 @@ def guardar_inventario(tecnico: str, inventario_data: Dict, completado: bool = F
         st.error(f"❌ Error guardando inventario: {str(e)}")
         return None
 
-def cargar_inventarios_disponibles():
-    """Carga la lista de inventarios disponibles."""
+def _listar_inventarios_archivos(tecnico: Optional[str] = None, estado: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Lista los inventarios leyendo sus JSON, con los mismos campos y orden que la base de datos."""
+    inventarios = []
+    for archivo in os.listdir(INVENTARIOS_DIR):
+        if not archivo.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(INVENTARIOS_DIR, archivo), 'r') as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if (tecnico and datos.get('tecnico') != tecnico) or (estado and datos.get('estado') != estado):
+            continue
+        inventario = datos.get('inventario', {})
+        inventarios.append(((datos.get('fecha') or '', datos.get('timestamp') or ''), {
+            'archivo': archivo,
+            'tecnico': datos.get('tecnico'),
+            'fecha': datos.get('fecha'),
+            'estado': datos.get('estado'),
+            'total_skus': datos.get('total_skus', len(inventario)),
+            'total_unidades': datos.get('total_unidades', sum(inventario.values()))
+        }))
+    inventarios.sort(key=lambda inv: inv[0], reverse=True)
+    return [inv for _, inv in inventarios]
+
+def cargar_inventarios_disponibles(tecnico: Optional[str] = None, estado: Optional[str] = None):
+    """Carga la lista de inventarios disponibles (consulta indexada, filtrable por técnico/estado).
+    
+    Sin base de datos se listan los JSON de inventarios/ directamente.
+    """
+    try:
+        bd = obtener_base_datos()
+        bd.sincronizar_archivos(INVENTARIOS_DIR, HISTORIAL_DIR)
+        return bd.listar_inventarios(tecnico, estado)
+    except sqlite3.Error as e:
+        st.warning(f"⚠️ Base de datos no disponible, inventarios leídos de sus archivos: {str(e)}")
+        return _listar_inventarios_archivos(tecnico, estado)
+
+class DiarioEnUso(Exception):
+    """El diario de escaneos está abierto en otra sesión."""
+
+def _bloquear_diario(ruta: str):
+    """Toma sin esperar el cerrojo exclusivo del diario; lanza DiarioEnUso si otra sesión lo tiene."""
+    if fcntl is None:
+        return None
+    cerrojo = open(f"{ruta}.lock", 'a')
+    try:
+        fcntl.flock(cerrojo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        cerrojo.close()
+        raise DiarioEnUso(f"El diario {os.path.basename(ruta)} está abierto en otra sesión")
+    except OSError:
+        cerrojo.close()
+        raise
+    return cerrojo
+
+def _liberar_diario(cerrojo):
+    # Cerrar el descriptor libera el flock
+    if cerrojo is not None and not cerrojo.closed:
+        cerrojo.close()
+
+def diario_en_uso(ruta: str) -> bool:
+    """Indica si otra sesión tiene abierto el diario."""
     try:
-        archivos = [f for f in os.listdir(INVENTARIOS_DIR) if f.endswith('.json')]
-        inventarios = []
+        _liberar_diario(_bloquear_diario(ruta))
+    except DiarioEnUso:
+        return True
+    return False
+
+class DiarioEscaneos:
+    """Diario append-only (JSON lines) de los escaneos de un inventario en curso.
+    
+    Cada cambio se añade como una línea y se vuelca al sistema operativo al momento, por lo que
+    sobrevive a recargas del navegador y reinicios de la app. El fsync a disco se agrupa cada
+    DIARIO_LOTE_FSYNC escrituras o DIARIO_INTERVALO_FSYNC segundos para que escanear siga siendo barato.
+    
+    Mientras está abierto mantiene un cerrojo exclusivo sobre `<diario>.lock`, así otra sesión no lo
+    ofrece como interrumpido ni lo abre a la vez. El cerrojo va en un archivo aparte porque compactar
+    sustituye el diario por otro archivo; si el proceso muere, el sistema lo libera.
+    """
+    
+    def __init__(self, ruta: str, cabecera: Dict[str, Any]):
+        self.ruta = ruta
+        self.cabecera = cabecera
+        self._cerrojo = _bloquear_diario(ruta)
+        self._f = open(ruta, 'a', encoding='utf-8')
+        self._pendientes = 0
+        self._ultimo_fsync = time.monotonic()
+    
+    @classmethod
+    def crear(cls, tecnico: str) -> 'DiarioEscaneos':
+        """Crea un diario nuevo para un inventario del técnico."""
+        os.makedirs(DIARIOS_DIR, exist_ok=True)
+        nombre = f"{tecnico.lower().replace(' ', '_')}_{date.today()}_{uuid.uuid4().hex[:8]}.jsonl"
+        cabecera = {
+            "op": "inicio",
+            "tecnico": tecnico,
+            "warehouse_id": TECNICOS_CONFIG[tecnico]["warehouse_id"],
+            "inicio": datetime.now().isoformat(timespec='seconds')
+        }
+        diario = cls(os.path.join(DIARIOS_DIR, nombre), cabecera)
+        diario._escribir(cabecera)
+        diario.sincronizar()
+        return diario
+    
+    @classmethod
+    def abrir(cls, ruta: str) -> Tuple['DiarioEscaneos', Dict[str, int]]:
+        """Abre un diario existente para seguir escribiendo y devuelve el inventario reconstruido.
         
-        for archivo in archivos:
-            try:
-                with open(os.path.join(INVENTARIOS_DIR, archivo), 'r') as f:
-                    data = json.load(f)
-                    inventarios.append({
-                        'archivo': archivo,
-                        'tecnico': data.get('tecnico'),
-                        'fecha': data.get('fecha'),
-                        'estado': data.get('estado'),
-                        'total_skus': data.get('total_skus', 0),
-                        'total_unidades': data.get('total_unidades', 0)
-                    })
-            except:
-                continue
-                
-        return sorted(inventarios, key=lambda x: x['fecha'], reverse=True)
-    except:
+        Lanza DiarioEnUso si otra sesión lo tiene abierto.
+        """
+        if not os.path.exists(ruta):
+            raise FileNotFoundError(f"No existe el diario {ruta}")
+        diario = cls(ruta, {})
+        try:
+            diario.cabecera, inventario = cls.reconstruir(ruta)
+        except Exception:
+            diario.cerrar()
+            raise
+        return diario, inventario
+    
+    @staticmethod
+    def reconstruir(ruta: str) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        """Reproduce el diario y devuelve (cabecera, inventario SKU -> cantidad)."""
+        cabecera = {}
+        inventario = {}
+        with open(ruta, 'r', encoding='utf-8') as f:
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    # Línea a medio escribir en una caída: se ignora
+                    continue
+                if registro.get('op') == 'inicio':
+                    cabecera = registro
+                    continue
+                sku, delta = registro.get('sku'), registro.get('d', 0)
+                if not sku or not delta:
+                    continue
+                # Misma semántica que la interfaz: al llegar a 0 el SKU desaparece
+                cantidad = inventario.get(sku, 0) + delta
+                if cantidad > 0:
+                    inventario[sku] = cantidad
+                else:
+                    inventario.pop(sku, None)
+        return cabecera, inventario
+    
+    def _escribir(self, registro: Dict[str, Any]):
+        self._f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        self._f.flush()
+        self._pendientes += 1
+        if (self._pendientes >= DIARIO_LOTE_FSYNC
+                or time.monotonic() - self._ultimo_fsync >= DIARIO_INTERVALO_FSYNC):
+            self.sincronizar()
+    
+    def registrar(self, sku: str, delta: int):
+        """Anota que la cantidad de un SKU cambió en `delta` unidades."""
+        self._escribir({"sku": sku, "d": delta})
+    
+    def sincronizar(self):
+        """Fuerza el volcado a disco de las escrituras pendientes."""
+        if self._pendientes:
+            os.fsync(self._f.fileno())
+            self._pendientes = 0
+        self._ultimo_fsync = time.monotonic()
+    
+    def compactar(self, inventario: Dict[str, int]):
+        """Reescribe el diario como cabecera + una línea por SKU con su cantidad actual."""
+        ruta_tmp = f"{self.ruta}.tmp"
+        with open(ruta_tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.cabecera, ensure_ascii=False) + '\n')
+            for sku, cantidad in inventario.items():
+                f.write(json.dumps({"sku": sku, "d": cantidad}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._f.close()
+        os.replace(ruta_tmp, self.ruta)
+        self._f = open(self.ruta, 'a', encoding='utf-8')
+        self._pendientes = 0
+        self._ultimo_fsync = time.monotonic()
+    
+    def cerrar(self):
+        if not self._f.closed:
+            self.sincronizar()
+            self._f.close()
+        _liberar_diario(self._cerrojo)
+    
+    def eliminar(self):
+        """Cierra y borra el diario (inventario completado o descartado)."""
+        if not self._f.closed:
+            self._f.close()
+        if os.path.exists(self.ruta):
+            os.remove(self.ruta)
+        # El .lock se borra con el cerrojo aún tomado: nadie puede abrir un diario a medio borrar
+        if self._cerrojo is not None and os.path.exists(f"{self.ruta}.lock"):
+            os.remove(f"{self.ruta}.lock")
+        _liberar_diario(self._cerrojo)
+
+def registrar_en_diario(sku: str, delta: int):
+    """Anota un cambio del inventario activo en el diario de la sesión, creándolo si hace falta."""
+    try:
+        if st.session_state.get('diario_escaneos') is None:
+            st.session_state.diario_escaneos = DiarioEscaneos.crear(st.session_state.tecnico_actual)
+        st.session_state.diario_escaneos.registrar(sku, delta)
+    except Exception as e:
+        st.warning(f"⚠️ No se pudo anotar el escaneo en el diario: {str(e)}")
+
+def descartar_diario_sesion():
+    """Elimina el diario de la sesión (inventario completado, limpiado o reiniciado)."""
+    diario = st.session_state.get('diario_escaneos')
+    if diario is not None:
+        try:
+            diario.eliminar()
+        except OSError as e:
+            st.warning(f"⚠️ No se pudo eliminar el diario de escaneos: {str(e)}")
+        st.session_state.diario_escaneos = None
+
+def rotar_diario_sesion():
+    """Cierra el diario de la sesión sin borrarlo: queda como inventario interrumpido recuperable."""
+    diario = st.session_state.get('diario_escaneos')
+    if diario is not None:
+        try:
+            diario.cerrar()
+        except OSError as e:
+            st.warning(f"⚠️ No se pudo cerrar el diario de escaneos: {str(e)}")
+        st.session_state.diario_escaneos = None
+
+def listar_diarios_pendientes(tecnico: str) -> List[Dict[str, Any]]:
+    """Lista los diarios de inventarios interrumpidos del técnico.
+    
+    Se excluyen el de esta sesión y los que otra sesión viva mantiene abiertos.
+    """
+    propio = st.session_state.get('diario_escaneos')
+    prefijo = f"{tecnico.lower().replace(' ', '_')}_"
+    pendientes = []
+    
+    try:
+        archivos = [f for f in os.listdir(DIARIOS_DIR) if f.startswith(prefijo) and f.endswith('.jsonl')]
+    except OSError:
         return []
+    
+    for archivo in archivos:
+        ruta = os.path.join(DIARIOS_DIR, archivo)
+        if propio is not None and os.path.abspath(propio.ruta) == os.path.abspath(ruta):
+            continue
+        try:
+            if diario_en_uso(ruta):
+                continue
+            cabecera, inventario = DiarioEscaneos.reconstruir(ruta)
+        except OSError:
+            continue
+        if cabecera.get('tecnico') != tecnico:
+            continue
+        pendientes.append({
+            'ruta': ruta,
+            'archivo': archivo,
+            'inicio': cabecera.get('inicio', ''),
+            'modificado': datetime.fromtimestamp(os.path.getmtime(ruta)),
+            'inventario': inventario,
+            'total_skus': len(inventario),
+            'total_unidades': sum(inventario.values())
+        })
+    
+    return sorted(pendientes, key=lambda x: x['modificado'], reverse=True)
+
+def mostrar_recuperacion_diarios(tecnico: str):
+    """Ofrece recuperar los inventarios interrumpidos del técnico a partir de su diario."""
+    for pendiente in listar_diarios_pendientes(tecnico):
+        st.warning(
+            f"♻️ Inventario interrumpido de {tecnico} (iniciado {pendiente['inicio']}, "
+            f"último escaneo {pendiente['modificado'].strftime('%Y-%m-%d %H:%M')}): "
+            f"{pendiente['total_skus']} SKUs, {pendiente['total_unidades']} unidades"
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("♻️ Recuperar inventario", key=f"recuperar_{pendiente['archivo']}", use_container_width=True):
+                try:
+                    diario, inventario = DiarioEscaneos.abrir(pendiente['ruta'])
+                except (DiarioEnUso, OSError) as e:
+                    st.error(f"❌ No se pudo recuperar el diario: {str(e)}")
+                else:
+                    st.session_state.diario_escaneos = diario
+                    st.session_state.inventario_activo = inventario
+                    st.session_state.inventario_vista = None
+                    st.session_state.ultimo_feedback = None
+                    st.rerun()
+        with col2:
+            if st.button("🗑️ Descartar", key=f"descartar_{pendiente['archivo']}", use_container_width=True):
+                try:
+                    # Abrirlo toma el cerrojo: no se borra un diario que otra sesión acaba de recuperar
+                    diario, _ = DiarioEscaneos.abrir(pendiente['ruta'])
+                    diario.eliminar()
+                except (DiarioEnUso, OSError) as e:
+                    st.error(f"❌ Error eliminando diario: {str(e)}")
+                else:
+                    st.rerun()
 
 def mostrar_interface_inventario():
     """Muestra la interface principal de inventario."""
@@ -422,25 +1878,46 @@ def mostrar_interface_inventario():
     
     with col2:
         if st.button("🔄 Nuevo Inventario", type="primary"):
+            descartar_diario_sesion()
             st.session_state.inventario_activo = {}
+            st.session_state.inventario_vista = None
             st.session_state.tecnico_actual = tecnico_seleccionado
             st.session_state.dotacion_df = None
+            st.session_state.indice_dotacion = None
             st.session_state.stock_holded = None
             st.rerun()
     
     # Cargar datos si cambió el técnico
     if st.session_state.tecnico_actual != tecnico_seleccionado:
+        # Los escaneos del técnico anterior se quedan en su diario (recuperable) y no pasan al nuevo
+        if st.session_state.inventario_activo or st.session_state.diario_escaneos is not None:
+            rotar_diario_sesion()
+            st.session_state.inventario_activo = {}
+            st.session_state.inventario_vista = None
+            st.session_state.ultimo_feedback = None
+            st.info(f"♻️ El inventario en curso de {st.session_state.tecnico_actual} se puede recuperar al volver a seleccionarlo")
         st.session_state.tecnico_actual = tecnico_seleccionado
         st.session_state.dotacion_df = None
+        st.session_state.indice_dotacion = None
         st.session_state.stock_holded = None
     
     # Cargar dotación y stock de Holded
     if st.session_state.dotacion_df is None:
-        st.session_state.dotacion_df = cargar_dotacion()
+        # La dotación compilada trae ya el índice SKU -> dotación
+        compilada = cargar_dotacion_compilada()
+        if compilada is not None:
+            st.session_state.dotacion_df, st.session_state.indice_dotacion = compilada
+        else:
+            st.session_state.indice_dotacion = None
+        st.session_state.inventario_vista = None
+    
+    if st.session_state.indice_dotacion is None and st.session_state.dotacion_df is not None:
+        st.session_state.indice_dotacion = construir_indice_dotacion(st.session_state.dotacion_df)
     
     if st.session_state.stock_holded is None and st.session_state.dotacion_df is not None:
         warehouse_id = TECNICOS_CONFIG[tecnico_seleccionado]["warehouse_id"]
         st.session_state.stock_holded = obtener_stock_warehouse(warehouse_id)
+        st.session_state.inventario_vista = None
     
     if st.session_state.dotacion_df is None:
         st.error("❌ No se puede continuar sin la dotación fija")
@@ -450,6 +1927,10 @@ def mostrar_interface_inventario():
     almacen_info = TECNICOS_CONFIG[tecnico_seleccionado]
     st.info(f"🏢 Almacén: {almacen_info['nombre_almacen']} (ID: {almacen_info['warehouse_id']})")
     
+    # Inventarios interrumpidos (recarga del navegador, reinicio de la app...)
+    if not st.session_state.inventario_activo and st.session_state.diario_escaneos is None:
+        mostrar_recuperacion_diarios(tecnico_seleccionado)
+    
     # Interface de escaneo optimizada para pistolas
     st.divider()
     st.subheader("🔍 Escaneo Rápido de Códigos")
@@ -494,10 +1975,9 @@ def mostrar_interface_inventario():
     with col2:
         st.markdown("### Estadísticas")
         if st.session_state.inventario_activo:
-            total_items = len(st.session_state.inventario_activo)
-            total_unidades = sum(st.session_state.inventario_activo.values())
-            st.metric("🏷️ SKUs", total_items)
-            st.metric("📦 Unidades", total_unidades)
+            _, contadores = obtener_vista_inventario()
+            st.metric("🏷️ SKUs", len(st.session_state.inventario_activo))
+            st.metric("📦 Unidades", contadores['unidades'])
         else:
             st.metric("🏷️ SKUs", 0)
             st.metric("📦 Unidades", 0)
@@ -561,6 +2041,8 @@ def mostrar_interface_inventario():
                         st.session_state.inventario_activo[sku] -= 1
                     else:
                         del st.session_state.inventario_activo[sku]
+                    registrar_en_diario(sku, -1)
+                    actualizar_vista_inventario(sku)
                     st.rerun()
     
     # Mostrar inventario actual
@@ -573,7 +2055,10 @@ def mostrar_interface_inventario():
     with col1:
         if st.button("💾 Guardar Parcial", use_container_width=True):
             if st.session_state.inventario_activo:
-                guardar_inventario(tecnico_seleccionado, st.session_state.inventario_activo, False)
+                if guardar_inventario(tecnico_seleccionado, st.session_state.inventario_activo, False):
+                    # El snapshot parcial permite compactar el diario a una línea por SKU
+                    if st.session_state.diario_escaneos is not None:
+                        st.session_state.diario_escaneos.compactar(st.session_state.inventario_activo)
             else:
                 st.warning("⚠️ No hay datos para guardar")
     
@@ -583,8 +2068,11 @@ def mostrar_interface_inventario():
                 nombre_archivo = guardar_inventario(tecnico_seleccionado, st.session_state.inventario_activo, True)
                 if nombre_archivo:
                     st.balloons()
+                    # El snapshot final sustituye al diario
+                    descartar_diario_sesion()
                     # Limpiar sesión
                     st.session_state.inventario_activo = {}
+                    st.session_state.inventario_vista = None
                     st.session_state.ultimo_feedback = None
                     st.success("🎉 ¡Inventario completado exitosamente!")
             else:
@@ -594,7 +2082,9 @@ def mostrar_interface_inventario():
         if st.button("🗑️ Limpiar Todo", use_container_width=True):
             if st.session_state.inventario_activo:
                 if st.button("⚠️ Confirmar Limpieza", key="confirm_clear"):
+                    descartar_diario_sesion()
                     st.session_state.inventario_activo = {}
+                    st.session_state.inventario_vista = None
                     st.session_state.ultimo_feedback = None
                     st.success("🧹 Inventario limpiado")
                     st.rerun()
@@ -644,9 +2134,9 @@ def procesar_codigo_escaneado_rapido():
         st.session_state.input_scanner = ""
         return
     
-    # Validar contra dotación
-    dotacion_df = st.session_state.dotacion_df
-    sku_existe = codigo_limpio in dotacion_df['SKU'].values
+    # Validar contra dotación (búsqueda O(1) en el índice)
+    indice_dotacion = st.session_state.get('indice_dotacion') or {}
+    registro_dotacion = indice_dotacion.get(codigo_limpio)
     
     # Validar contra Holded maleta
     stock_maleta = st.session_state.stock_holded
@@ -658,6 +2148,10 @@ def procesar_codigo_escaneado_rapido():
     else:
         st.session_state.inventario_activo[codigo_limpio] = 1
     
+    # Anotar en el diario y actualizar solo la fila afectada de la vista materializada
+    registrar_en_diario(codigo_limpio, 1)
+    actualizar_vista_inventario(codigo_limpio)
+    
     # Limpiar el input inmediatamente
     st.session_state.input_scanner = ""
     
@@ -665,8 +2159,8 @@ def procesar_codigo_escaneado_rapido():
     cantidad_actual = st.session_state.inventario_activo[codigo_limpio]
     
     # Almacenar mensaje de feedback en session state para mostrarlo
-    if sku_existe:
-        dotacion_esperada = dotacion_df[dotacion_df['SKU'] == codigo_limpio]['DOTACIÓN'].iloc[0]
+    if registro_dotacion is not None:
+        dotacion_esperada = registro_dotacion['DOTACIÓN']
         st.session_state.ultimo_feedback = {
             'tipo': 'success',
             'mensaje': f"✅ {codigo_limpio} → Cantidad: {cantidad_actual} | Dotación: {dotacion_esperada} | Holded: {stock_en_maleta}"
@@ -677,6 +2171,92 @@ def procesar_codigo_escaneado_rapido():
             'mensaje': f"⚠️ {codigo_limpio} → Cantidad: {cantidad_actual} | ❌ No está en dotación | Holded: {stock_en_maleta}"
         }
 
+def _calcular_fila_inventario(sku: str, cantidad: int, indice_dotacion: Dict, stock_maleta: Dict) -> Dict[str, Any]:
+    """Calcula la fila de la vista de inventario para un SKU."""
+    # Buscar en dotación
+    registro_dotacion = indice_dotacion.get(sku)
+    if registro_dotacion is not None:
+        dotacion = registro_dotacion['DOTACIÓN']
+        seccion = registro_dotacion['SECCION']
+        caja = registro_dotacion['CAJA']
+    else:
+        dotacion = 0
+        seccion = "NO REGISTRADO"
+        caja = "NO REGISTRADO"
+    
+    # Stock en Holded maleta
+    stock_h = stock_maleta.get(sku, 0)
+    
+    # Estado (sin análisis de consumo aún); la marca OK se fija aquí para no buscar emojis al pintar
+    estado = determinar_estado_completo(dotacion, cantidad, 0, stock_h, 0, "")
+    
+    return {
+        'SKU': sku,
+        'Cantidad Escaneada': cantidad,
+        'Dotación': dotacion,
+        'Stock Holded Maleta': stock_h,
+        'Diferencia vs Dotación': cantidad - dotacion,
+        'Diferencia vs Holded': cantidad - stock_h,
+        'Estado': estado,
+        'Estado OK': estado.startswith('✅'),
+        'Sección': seccion,
+        'Caja': caja
+    }
+
+def _sumar_fila_contadores(contadores: Dict[str, int], fila: Dict[str, Any], signo: int):
+    """Suma (signo=1) o resta (signo=-1) la contribución de una fila a los contadores."""
+    contadores['unidades'] += signo * fila['Cantidad Escaneada']
+    if fila['Estado OK']:
+        contadores['ok'] += signo
+
+def reconstruir_vista_inventario():
+    """Recalcula la vista materializada completa (al cambiar dotación, stock o inventario)."""
+    indice_dotacion = st.session_state.get('indice_dotacion') or {}
+    stock_maleta = st.session_state.get('stock_holded') or {}
+    
+    vista = {}
+    contadores = {'unidades': 0, 'ok': 0}
+    for sku, cantidad in st.session_state.inventario_activo.items():
+        fila = _calcular_fila_inventario(sku, cantidad, indice_dotacion, stock_maleta)
+        vista[sku] = fila
+        _sumar_fila_contadores(contadores, fila, 1)
+    
+    st.session_state.inventario_vista = vista
+    st.session_state.inventario_contadores = contadores
+
+def obtener_vista_inventario() -> Tuple[Dict[str, Dict[str, Any]], Dict[str, int]]:
+    """Devuelve la vista materializada del inventario y sus contadores, reconstruyéndola si hace falta."""
+    vista = st.session_state.get('inventario_vista')
+    if vista is None or len(vista) != len(st.session_state.inventario_activo):
+        reconstruir_vista_inventario()
+    return st.session_state.inventario_vista, st.session_state.inventario_contadores
+
+def actualizar_vista_inventario(sku: str):
+    """Actualiza en la vista materializada solo la fila del SKU modificado y los contadores."""
+    vista = st.session_state.get('inventario_vista')
+    if vista is None:
+        # Se reconstruirá completa en el próximo render
+        return
+    
+    contadores = st.session_state.inventario_contadores
+    fila_anterior = vista.get(sku)
+    if fila_anterior is not None:
+        _sumar_fila_contadores(contadores, fila_anterior, -1)
+    
+    if sku not in st.session_state.inventario_activo:
+        vista.pop(sku, None)
+        return
+    
+    # Reasignar la clave existente conserva el orden de escaneo
+    fila = _calcular_fila_inventario(
+        sku,
+        st.session_state.inventario_activo[sku],
+        st.session_state.get('indice_dotacion') or {},
+        st.session_state.get('stock_holded') or {}
+    )
+    vista[sku] = fila
+    _sumar_fila_contadores(contadores, fila, 1)
+
 def mostrar_inventario_actual():
     """Muestra el inventario actual en tiempo real."""
     if not st.session_state.inventario_activo:
@@ -685,51 +2265,18 @@ def mostrar_inventario_actual():
     
     st.subheader("📋 Inventario Actual")
     
-    # Crear DataFrame con el inventario actual
-    inventario_data = []
-    dotacion_df = st.session_state.dotacion_df
-    stock_maleta = st.session_state.stock_holded or {}
-    
-    for sku, cantidad in st.session_state.inventario_activo.items():
-        # Buscar en dotación
-        dotacion_row = dotacion_df[dotacion_df['SKU'] == sku]
-        if not dotacion_row.empty:
-            dotacion = dotacion_row.iloc[0]['DOTACIÓN']
-            seccion = dotacion_row.iloc[0]['SECCION']
-            caja = dotacion_row.iloc[0]['CAJA']
-        else:
-            dotacion = 0
-            seccion = "NO REGISTRADO"
-            caja = "NO REGISTRADO"
-        
-        # Stock en Holded maleta
-        stock_h = stock_maleta.get(sku, 0)
-        
-        # Estado (sin análisis de consumo aún)
-        estado = determinar_estado_completo(dotacion, cantidad, 0, stock_h, 0, "")
-        
-        inventario_data.append({
-            'SKU': sku,
-            'Cantidad Escaneada': cantidad,
-            'Dotación': dotacion,
-            'Stock Holded Maleta': stock_h,
-            'Diferencia vs Dotación': cantidad - dotacion,
-            'Diferencia vs Holded': cantidad - stock_h,
-            'Estado': estado,
-            'Sección': seccion,
-            'Caja': caja
-        })
-    
-    df_inventario = pd.DataFrame(inventario_data)
+    # Vista materializada: solo se recalcula la fila escaneada en cada escaneo
+    vista, contadores = obtener_vista_inventario()
+    df_inventario = pd.DataFrame(list(vista.values()))
     
     # Métricas rápidas
     col1, col2, col3, col4 = st.columns(4)
     with col1:
         st.metric("📊 SKUs Escaneados", len(df_inventario))
     with col2:
-        st.metric("📦 Total Unidades", df_inventario['Cantidad Escaneada'].sum())
+        st.metric("📦 Total Unidades", contadores['unidades'])
     with col3:
-        perfectos = len(df_inventario[df_inventario['Estado'].str.contains('✅')])
+        perfectos = contadores['ok']
         st.metric("✅ Estados OK", perfectos)
     with col4:
         problemas = len(df_inventario) - perfectos
@@ -751,7 +2298,7 @@ def mostrar_inventario_actual():
     if filtro_estado != "Todos":
         df_filtrado = df_filtrado[df_filtrado['Estado'] == filtro_estado]
     if solo_problemas:
-        df_filtrado = df_filtrado[~df_filtrado['Estado'].str.contains('✅')]
+        df_filtrado = df_filtrado[~df_filtrado['Estado OK']]
     
     # Mostrar tabla
     st.dataframe(
@@ -760,6 +2307,7 @@ def mostrar_inventario_actual():
         hide_index=True,
         column_config={
             "Estado": st.column_config.TextColumn("Estado", help="Estado del SKU según análisis"),
+            "Estado OK": None,
             "Diferencia vs Dotación": st.column_config.NumberColumn("Diff. Dotación", format="%d"),
             "Diferencia vs Holded": st.column_config.NumberColumn("Diff. Holded", format="%d")
         }
@@ -769,28 +2317,32 @@ def mostrar_historial_inventarios():
     """Muestra el historial de inventarios realizados."""
     st.header("📂 Historial de Inventarios")
     
-    inventarios = cargar_inventarios_disponibles()
+    try:
+        bd = obtener_base_datos()
+        tecnicos = bd.valores_inventarios('tecnico')
+        estados = bd.valores_inventarios('estado')
+    except sqlite3.Error:
+        inventarios = cargar_inventarios_disponibles()
+        tecnicos = sorted(set(inv['tecnico'] for inv in inventarios))
+        estados = sorted(set(inv['estado'] for inv in inventarios))
     
-    if not inventarios:
+    if not tecnicos:
         st.info("📭 No hay inventarios guardados")
         return
     
     # Filtros
     col1, col2 = st.columns(2)
     with col1:
-        tecnicos_disponibles = ["Todos"] + list(set([inv['tecnico'] for inv in inventarios]))
-        filtro_tecnico = st.selectbox("👨‍🔧 Filtrar por técnico:", tecnicos_disponibles)
+        filtro_tecnico = st.selectbox("👨‍🔧 Filtrar por técnico:", ["Todos"] + tecnicos)
     
     with col2:
-        estados_disponibles = ["Todos"] + list(set([inv['estado'] for inv in inventarios]))
-        filtro_estado = st.selectbox("📊 Filtrar por estado:", estados_disponibles)
+        filtro_estado = st.selectbox("📊 Filtrar por estado:", ["Todos"] + estados)
     
-    # Aplicar filtros
-    inventarios_filtrados = inventarios
-    if filtro_tecnico != "Todos":
-        inventarios_filtrados = [inv for inv in inventarios_filtrados if inv['tecnico'] == filtro_tecnico]
-    if filtro_estado != "Todos":
-        inventarios_filtrados = [inv for inv in inventarios_filtrados if inv['estado'] == filtro_estado]
+    # Aplicar filtros en la consulta
+    inventarios_filtrados = cargar_inventarios_disponibles(
+        None if filtro_tecnico == "Todos" else filtro_tecnico,
+        None if filtro_estado == "Todos" else filtro_estado
+    )
     
     # Mostrar lista
     for inv in inventarios_filtrados:
@@ -821,17 +2373,30 @@ def mostrar_historial_inventarios():
                 if st.button(f"🗑️ Eliminar", key=f"eliminar_{inv['archivo']}"):
                     if st.checkbox(f"Confirmar eliminación", key=f"confirm_{inv['archivo']}"):
                         try:
-                            os.remove(os.path.join(INVENTARIOS_DIR, inv['archivo']))
+                            obtener_base_datos().eliminar_inventario(inv['archivo'])
+                            path_inventario = os.path.join(INVENTARIOS_DIR, inv['archivo'])
+                            if os.path.exists(path_inventario):
+                                os.remove(path_inventario)
                             st.success("✅ Inventario eliminado")
                             st.rerun()
                         except Exception as e:
                             st.error(f"❌ Error eliminando: {str(e)}")
 
+def cargar_inventario_guardado(nombre_archivo: str) -> Dict[str, Any]:
+    """Carga un inventario guardado desde la base de datos (o su JSON si no está registrado)."""
+    try:
+        data = obtener_base_datos().cargar_inventario(nombre_archivo)
+        if data is not None:
+            return data
+    except sqlite3.Error:
+        pass
+    with open(os.path.join(INVENTARIOS_DIR, nombre_archivo), 'r') as f:
+        return json.load(f)
+
 def mostrar_detalle_inventario(nombre_archivo: str):
     """Muestra el detalle completo de un inventario."""
     try:
-        with open(os.path.join(INVENTARIOS_DIR, nombre_archivo), 'r') as f:
-            data = json.load(f)
+        data = cargar_inventario_guardado(nombre_archivo)
         
         st.subheader(f"📋 Detalle: {data['tecnico']} - {data['fecha']}")
         
@@ -864,32 +2429,105 @@ def mostrar_detalle_inventario(nombre_archivo: str):
 # FUNCIONES ORIGINALES ACTUALIZADAS
 # ============================================================================
 
-def validar_archivo_conteo(df: pd.DataFrame) -> bool:
-    """Valida que el archivo de conteo tenga la estructura correcta."""
-    if df is None or df.empty:
-        return False
+class CacheLRU:
+    """Caché LRU en memoria limitada por bytes, segura entre hilos (se comparte entre sesiones).
+    
+    Las subclases guardan cada entrada como diccionario junto con su tamaño estimado; al superar
+    `max_bytes` se descartan las entradas usadas hace más tiempo.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def _obtener(self, clave: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada
+    
+    def _guardar(self, clave: str, entrada: Dict[str, Any], tamano: int):
+        if tamano > self.max_bytes:
+            return
+        entrada['tamano'] = tamano
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior['tamano']
+            self._entradas[clave] = entrada
+            self._bytes += tamano
+            while self._bytes > self.max_bytes and len(self._entradas) > 1:
+                _, descartada = self._entradas.popitem(last=False)
+                self._bytes -= descartada['tamano']
+    
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entradas': len(self._entradas),
+                'mb': self._bytes / (1024 * 1024),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos
+            }
+
+class CacheArchivosSubidos(CacheLRU):
+    """Archivos subidos ya leídos y validados, direccionados por el hash de su contenido.
     
-    # Verificar que tenga al menos 3 filas y 4 columnas
-    if df.shape[0] < 3 or df.shape[1] < 4:
-        st.error("❌ El archivo de conteo debe tener al menos 3 filas y 4 columnas (A, B, C, D)")
-        return False
+    Evita volver a leer el Excel en cada rerun de Streamlit y comparte la lectura entre sesiones:
+    el mismo export subido por dos coordinadores se lee una sola vez.
+    """
     
-    return True
+    def obtener(self, clave: str) -> Optional[Dict[str, Any]]:
+        """Devuelve una copia del DataFrame leído y las filas leídas por bloques (None si no está)."""
+        entrada = self._obtener(clave)
+        if entrada is None:
+            return None
+        return {'df': entrada['df'].copy(), 'filas_leidas': entrada['filas_leidas']}
+    
+    def guardar(self, clave: str, df: pd.DataFrame, filas_leidas: Optional[int] = None):
+        self._guardar(
+            clave,
+            {'df': df.copy(), 'filas_leidas': filas_leidas},
+            int(df.memory_usage(deep=True).sum())
+        )
+
+@st.cache_resource
+def obtener_cache_archivos() -> CacheArchivosSubidos:
+    """Caché de archivos subidos compartida por todas las sesiones."""
+    return CacheArchivosSubidos(CACHE_ARCHIVOS_MAX_MB * 1024 * 1024)
+
+def clave_archivo_subido(tipo: str, nombre_archivo: str, contenido: bytes) -> str:
+    """Clave de un archivo subido: tipo, formato y hash de su contenido (el nombre no cuenta)."""
+    extension = os.path.splitext(nombre_archivo)[1].lower()
+    return f"{tipo}{extension}:{hashlib.sha256(contenido).hexdigest()}"
 
-def validar_archivo_consumo(df: pd.DataFrame) -> bool:
-    """Valida que el archivo de consumo tenga las columnas necesarias."""
-    if df is None or df.empty:
-        return False
+def leer_archivo_subido(archivo, tipo: str) -> Tuple[pd.DataFrame, Optional[int]]:
+    """Lee un archivo subido según su tipo; devuelve el DataFrame y las filas leídas si fue por bloques."""
+    # Consumo grande: leer por bloques y quedarse solo con los agregados por SKU y parte
+    if tipo == 'consumo' and consumo_por_bloques(archivo.size):
+        return cargar_consumo_agregado(archivo, archivo.name)
     
-    columnas_faltantes = [col for col in COLUMNAS_ESPERADAS['consumo'] if col not in df.columns]
-    if columnas_faltantes:
-        st.error(f"❌ El archivo de consumo no tiene las columnas: {', '.join(columnas_faltantes)}")
-        return False
-    
-    return True
+    # Leer solo las columnas y filas que usa el análisis, validando durante la lectura
+    if tipo == 'conteo':
+        return leer_conteo(archivo, archivo.name), None
+    if tipo == 'consumo':
+        return leer_consumo(archivo, archivo.name), None
+    if archivo.name.endswith(".csv"):
+        return pd.read_csv(archivo, encoding='utf-8'), None
+    return pd.read_excel(archivo), None
 
-def cargar_archivo(nombre: str, tipo: str) -> Optional[pd.DataFrame]:
-    """Carga y valida archivos con mejor manejo de errores."""
+def cargar_archivo(nombre: str, tipo: str) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """Carga y valida archivos con mejor manejo de errores.
+    
+    Devuelve el DataFrame y la clave del contenido subido (la usa también la caché de análisis).
+    """
     archivo = st.file_uploader(
         f"📁 Sube el archivo de {nombre}", 
         type=["xlsx", "csv"],
@@ -897,20 +2535,24 @@ def cargar_archivo(nombre: str, tipo: str) -> Optional[pd.DataFrame]:
     )
     
     if archivo is None:
-        return None
+        return None, None
     
     try:
-        # Leer archivo
-        if archivo.name.endswith(".csv"):
-            df = pd.read_csv(archivo, encoding='utf-8')
+        # Cada rerun vuelve a entregar el mismo archivo: solo se lee si su contenido no está en caché
+        cache_archivos = obtener_cache_archivos()
+        clave = clave_archivo_subido(tipo, archivo.name, archivo.getvalue())
+        en_cache = cache_archivos.obtener(clave)
+        if en_cache is not None:
+            df, filas_leidas = en_cache['df'], en_cache['filas_leidas']
         else:
-            df = pd.read_excel(archivo)
+            df, filas_leidas = leer_archivo_subido(archivo, tipo)
+            cache_archivos.guardar(clave, df, filas_leidas)
         
-        # Validar según el tipo
-        if tipo == 'conteo' and not validar_archivo_conteo(df):
-            return None
-        elif tipo == 'consumo' and not validar_archivo_consumo(df):
-            return None
+        if filas_leidas is not None:
+            st.success(
+                f"✅ Archivo {nombre} leído por bloques: {filas_leidas} filas agregadas en {len(df)} combinaciones SKU/parte"
+            )
+            return df, clave
         
         st.success(f"✅ Archivo {nombre} cargado correctamente: {df.shape[0]} filas, {df.shape[1]} columnas")
         
@@ -918,12 +2560,159 @@ def cargar_archivo(nombre: str, tipo: str) -> Optional[pd.DataFrame]:
         if st.checkbox(f"👁️ Vista previa de {nombre}", key=f"preview_{tipo}"):
             st.dataframe(df.head(10), use_container_width=True)
         
-        return df
+        return df, clave
         
+    except ValueError as e:
+        st.error(f"❌ {str(e)}")
+        return None, None
     except Exception as e:
         st.error(f"❌ Error cargando {nombre}: {str(e)}")
         st.code(traceback.format_exc())
-        return None
+        return None, None
+
+def consumo_por_bloques(tamano_bytes: Optional[int]) -> bool:
+    """Indica si un archivo de consumo es lo bastante grande para leerlo por bloques."""
+    return bool(tamano_bytes) and tamano_bytes > CONSUMO_BLOQUES_MB * 1024 * 1024
+
+def _leer_bloques_xlsx(fuente, columnas: List[str], filas_bloque: int) -> Iterator[pd.DataFrame]:
+    """Recorre la primera hoja de un xlsx en modo read-only devolviendo bloques con las columnas pedidas."""
+    libro = load_workbook(fuente, read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        cabecera = [str(c).strip() if c is not None else '' for c in next(hoja.iter_rows(max_row=1, values_only=True), ())]
+        faltantes = [col for col in columnas if col not in cabecera]
+        if faltantes:
+            raise ValueError(f"El archivo de consumo no tiene las columnas: {', '.join(faltantes)}")
+        posiciones = [cabecera.index(col) for col in columnas]
+        
+        # Las columnas de texto se convierten al leer la celda, como hace dtype en read_csv
+        texto = [col in COLUMNAS_TEXTO_CONSUMO for col in columnas]
+        
+        # Solo hasta la última columna pedida: el resto de cada fila no se convierte
+        bloque = []
+        for fila in hoja.iter_rows(min_row=2, max_col=max(posiciones) + 1, values_only=True):
+            valores = [fila[i] if i < len(fila) else None for i in posiciones]
+            bloque.append([str(v) if es_texto and v is not None else v for v, es_texto in zip(valores, texto)])
+            if len(bloque) >= filas_bloque:
+                # dtype object: los valores se quedan como en la celda, sin inferir tipos por bloque
+                yield pd.DataFrame(bloque, columns=columnas, dtype=object)
+                bloque = []
+        if bloque:
+            yield pd.DataFrame(bloque, columns=columnas, dtype=object)
+    finally:
+        libro.close()
+
+def leer_bloques_consumo(fuente, nombre_archivo: str,
+                         filas_bloque: int = CONSUMO_FILAS_BLOQUE) -> Iterator[pd.DataFrame]:
+    """Lee un archivo de consumo (CSV o xlsx) por bloques, solo con las columnas que usa el análisis."""
+    columnas = COLUMNAS_ESPERADAS['consumo']
+    if nombre_archivo.endswith(".csv"):
+        cabecera = pd.read_csv(fuente, encoding='utf-8', nrows=0).columns
+        faltantes = [col for col in columnas if col not in cabecera]
+        if faltantes:
+            raise ValueError(f"El archivo de consumo no tiene las columnas: {', '.join(faltantes)}")
+        if hasattr(fuente, 'seek'):
+            fuente.seek(0)
+        yield from pd.read_csv(
+            fuente, encoding='utf-8', usecols=columnas, chunksize=filas_bloque,
+            dtype={col: str for col in COLUMNAS_TEXTO_CONSUMO}
+        )
+    else:
+        yield from _leer_bloques_xlsx(fuente, columnas, filas_bloque)
+
+def leer_consumo(fuente, nombre_archivo: str) -> pd.DataFrame:
+    """Lee un archivo de consumo completo, pero solo con las columnas 'ID Parte', 'Cantidad' y 'Articulo'."""
+    return pd.concat(list(leer_bloques_consumo(fuente, nombre_archivo)), ignore_index=True)
+
+def _ancho_fila(fila: tuple) -> int:
+    """Número de columnas de una fila de openpyxl hasta su última celda con valor."""
+    for posicion in range(len(fila), 0, -1):
+        if fila[posicion - 1] is not None:
+            return posicion
+    return 0
+
+def leer_conteo(fuente, nombre_archivo: str) -> pd.DataFrame:
+    """Lee del conteo solo la columna B (SKU) y la D (cantidad), desde la tercera fila de datos.
+    
+    Equivale a `iloc[2:, [1, 3]]` sobre el archivo leído entero con cabecera, validando durante la
+    lectura que tenga al menos 3 filas y 4 columnas. Los SKUs se leen tal cual (sin inferir números).
+    """
+    error = "El archivo de conteo debe tener al menos 3 filas y 4 columnas (A, B, C, D)"
+    
+    if nombre_archivo.endswith(".csv"):
+        if len(pd.read_csv(fuente, encoding='utf-8', nrows=0).columns) < 4:
+            raise ValueError(error)
+        if hasattr(fuente, 'seek'):
+            fuente.seek(0)
+        conteo = pd.read_csv(fuente, encoding='utf-8', header=None, skiprows=1, usecols=[1, 3], dtype={1: str})
+        if len(conteo) < 3:
+            raise ValueError(error)
+        conteo = conteo.iloc[2:]
+    else:
+        libro = load_workbook(fuente, read_only=True, data_only=True)
+        try:
+            hoja = libro.worksheets[0]
+            # Ancho real (hasta la última celda con valor): en read-only iter_rows rellena las filas hasta max_col
+            ancho = _ancho_fila(next(hoja.iter_rows(max_row=1, values_only=True), ()))
+            datos = []
+            total_filas = 0
+            for fila in hoja.iter_rows(min_row=2, max_col=4, values_only=True):
+                total_filas += 1
+                if ancho < 4:
+                    ancho = max(ancho, _ancho_fila(fila))
+                if total_filas > 2:
+                    fila = fila + (None,) * (4 - len(fila))
+                    datos.append((fila[1], fila[3]))
+        finally:
+            libro.close()
+        if total_filas < 3 or ancho < 4:
+            raise ValueError(error)
+        conteo = pd.DataFrame(datos, columns=['SKU', 'Cantidad'], dtype=object)
+    
+    conteo.columns = COLUMNAS_ESPERADAS['conteo']
+    return conteo.reset_index(drop=True)
+
+def limpiar_consumo(consumo_df: pd.DataFrame) -> pd.DataFrame:
+    """Deja el consumo en columnas SKU, Cantidad e ID Parte (SKU extraído del artículo)."""
+    consumo = consumo_df[COLUMNAS_ESPERADAS['consumo']].copy()
+    consumo = consumo.dropna(subset=['Articulo'])
+    
+    # Extraer SKU del artículo con mejor regex
+    consumo['SKU'] = consumo['Articulo'].str.extract(r'(^\S+)', expand=False)
+    consumo = consumo[['SKU', 'Cantidad', 'ID Parte']].copy()
+    consumo['SKU'] = normalizar_skus(consumo['SKU'])
+    consumo['Cantidad'] = pd.to_numeric(consumo['Cantidad'], errors='coerce').fillna(0)
+    return consumo
+
+def agregar_consumo(bloques: Iterable[pd.DataFrame]) -> Tuple[pd.DataFrame, int]:
+    """Limpia cada bloque de consumo y lo acumula en cantidades por (SKU, ID Parte).
+    
+    La memoria depende de las combinaciones distintas, no de las filas del archivo. El resultado
+    mantiene las columnas del archivo original ('Articulo' lleva ya solo el SKU), así que pasa por
+    limpiar_datos igual que un consumo leído entero.
+    """
+    claves = ['SKU', 'ID Parte']
+    acumulado = None
+    filas_leidas = 0
+    
+    for bloque in bloques:
+        filas_leidas += len(bloque)
+        parcial = limpiar_consumo(bloque).groupby(claves, dropna=False, sort=False)['Cantidad'].sum()
+        if acumulado is None:
+            acumulado = parcial
+        else:
+            acumulado = pd.concat([acumulado, parcial]).groupby(level=claves, dropna=False, sort=False).sum()
+    
+    if acumulado is None:
+        return pd.DataFrame(columns=COLUMNAS_ESPERADAS['consumo']), 0
+    
+    agregado = acumulado.reset_index().rename(columns={'SKU': 'Articulo'})
+    return agregado[COLUMNAS_ESPERADAS['consumo']], filas_leidas
+
+def cargar_consumo_agregado(fuente, nombre_archivo: str,
+                            filas_bloque: int = CONSUMO_FILAS_BLOQUE) -> Tuple[pd.DataFrame, int]:
+    """Lee un consumo por bloques y devuelve sus agregados por (SKU, ID Parte) y las filas leídas."""
+    return agregar_consumo(leer_bloques_consumo(fuente, nombre_archivo, filas_bloque))
 
 def limpiar_datos(dotacion_df: pd.DataFrame, conteo_df: pd.DataFrame, consumo_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """Limpia y procesa los datos con mejor manejo de errores."""
@@ -933,14 +2722,17 @@ def limpiar_datos(dotacion_df: pd.DataFrame, conteo_df: pd.DataFrame, consumo_df
             # Limpiar dotación
             dotacion = dotacion_df[COLUMNAS_ESPERADAS['dotacion']].copy()
             dotacion = dotacion.dropna(subset=["SKU"])
-            dotacion['SKU'] = dotacion['SKU'].astype(str).str.strip().str.upper()
-            
-            # Limpiar conteo (desde fila 3, columnas B y D)
-            if conteo_df.shape[0] < 3:
-                raise ValueError("El archivo de conteo debe tener al menos 3 filas")
+            dotacion['SKU'] = normalizar_skus(dotacion['SKU'])
             
-            conteo = conteo_df.iloc[2:, [1, 3]].copy()
-            conteo.columns = ['SKU', 'Cantidad']
+            # Limpiar conteo (desde fila 3, columnas B y D); leer_conteo ya entrega solo esas columnas
+            if list(conteo_df.columns) == COLUMNAS_ESPERADAS['conteo']:
+                conteo = conteo_df.copy()
+            else:
+                if conteo_df.shape[0] < 3:
+                    raise ValueError("El archivo de conteo debe tener al menos 3 filas")
+                
+                conteo = conteo_df.iloc[2:, [1, 3]].copy()
+                conteo.columns = ['SKU', 'Cantidad']
             
             # Convertir cantidad con mejor manejo de errores
             conteo['Cantidad'] = pd.to_numeric(conteo['Cantidad'], errors='coerce')
@@ -950,17 +2742,10 @@ def limpiar_datos(dotacion_df: pd.DataFrame, conteo_df: pd.DataFrame, consumo_df
             
             conteo['Cantidad'] = conteo['Cantidad'].fillna(0)
             conteo = conteo.dropna(subset=['SKU'])
-            conteo['SKU'] = conteo['SKU'].astype(str).str.strip().str.upper()
+            conteo['SKU'] = normalizar_skus(conteo['SKU'])
             
             # Limpiar consumo
-            consumo = consumo_df[COLUMNAS_ESPERADAS['consumo']].copy()
-            consumo = consumo.dropna(subset=['Articulo'])
-            
-            # Extraer SKU del artículo con mejor regex
-            consumo['SKU'] = consumo['Articulo'].str.extract(r'(^\S+)', expand=False)
-            consumo = consumo[['SKU', 'Cantidad', 'ID Parte']].copy()
-            consumo['SKU'] = consumo['SKU'].astype(str).str.strip().str.upper()
-            consumo['Cantidad'] = pd.to_numeric(consumo['Cantidad'], errors='coerce').fillna(0)
+            consumo = limpiar_consumo(consumo_df)
             
             # Mostrar estadísticas de limpieza
             col1, col2, col3 = st.columns(3)
@@ -978,15 +2763,80 @@ def limpiar_datos(dotacion_df: pd.DataFrame, conteo_df: pd.DataFrame, consumo_df
             st.code(traceback.format_exc())
             raise e
 
+def preparar_datos_inventario(dotacion_df: pd.DataFrame, conteo_df: pd.DataFrame,
+                              consumo_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Prepara los datos cuando el conteo viene de un inventario guardado (ya limpio)."""
+    dotacion = dotacion_df[COLUMNAS_ESPERADAS['dotacion']].copy()
+    dotacion = dotacion.dropna(subset=["SKU"])
+    dotacion['SKU'] = normalizar_skus(dotacion['SKU'])
+    
+    conteo = conteo_df.copy()
+    consumo = limpiar_consumo(consumo_df)
+    
+    return dotacion, conteo, consumo
+
+def _sumar_por_codigo(codigos: np.ndarray, cantidades: pd.Series, total: int) -> np.ndarray:
+    """Suma las cantidades por código de SKU (los códigos -1 de SKUs que faltan se descartan)."""
+    validos = codigos >= 0
+    pesos = np.nan_to_num(pd.to_numeric(cantidades, errors='coerce').to_numpy(dtype=float))
+    # Sin filas bincount devuelve enteros: se fuerza float como la suma de un groupby
+    return np.bincount(codigos[validos], weights=pesos[validos], minlength=total).astype(float)
+
+def agregar_ordenes_por_sku(consumo: pd.DataFrame, formato: str = 'texto',
+                            codificacion: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> pd.Series:
+    """Trabajos/órdenes distintos de cada SKU del consumo, indexados por SKU y ordenados como texto.
+    
+    Cada par (SKU, orden) se codifica como un entero que se deduplica y ordena de una vez, en
+    lugar de construir un set y ordenarlo grupo a grupo. Según `formato` devuelve el texto
+    "101, 102", la lista de IDs o el número de órdenes; los SKUs cuyo consumo no tiene ninguna
+    orden quedan como '', [] o 0. Con `codificacion` (códigos del consumo en un DiccionarioSKU y sus
+    SKUs) el resultado se indexa por todos los SKUs del diccionario, estén o no en el consumo.
+    """
+    if codificacion is None:
+        codigos_sku, skus = pd.factorize(consumo['SKU'])
+    else:
+        codigos_sku, skus = codificacion
+    codigos_orden, ordenes = pd.factorize(consumo['ID Parte'])
+    
+    # Solo se pasan a texto los IDs distintos; IDs que coinciden como texto (101 y '101') son la misma orden
+    codigos_texto, textos = pd.factorize(ordenes.astype(str))
+    textos = np.asarray(textos, dtype=object)
+    rango = np.empty(len(textos), dtype=np.int64)
+    rango[np.argsort(textos, kind='stable')] = np.arange(len(textos))
+    textos_ordenados = np.sort(textos, kind='stable')
+    base = max(len(textos), 1)
+    
+    validos = (codigos_sku >= 0) & (codigos_orden >= 0)
+    pares = np.sort(pd.unique(
+        codigos_sku[validos].astype(np.int64) * base + rango[codigos_texto[codigos_orden[validos]]]
+    ))
+    por_sku = np.bincount(pares // base, minlength=len(skus))
+    
+    if formato == 'conteo':
+        return pd.Series(por_sku, index=skus)
+    # Los pares salen ordenados por SKU y luego por texto: se cortan por el número de órdenes de cada SKU
+    textos_pares = textos_ordenados[pares % base].tolist()
+    fines = np.cumsum(por_sku).tolist()
+    grupos = [textos_pares[inicio:fin] for inicio, fin in zip([0] + fines[:-1], fines)]
+    if formato == 'lista':
+        return pd.Series(grupos, index=skus, dtype=object)
+    return pd.Series([', '.join(grupo) for grupo in grupos], index=skus, dtype=object)
+
 def procesar_analisis(dotacion: pd.DataFrame, conteo: pd.DataFrame, consumo: pd.DataFrame, 
-                     stock_maleta: Dict = None, tecnico_seleccionado: str = None) -> Tuple[pd.DataFrame, list]:
-    """Procesa el análisis principal con lógica completa incluyendo origen del consumo."""
+                     stock_maleta: Dict = None, tecnico_seleccionado: str = None,
+                     stock_oficina: Optional[Dict] = None, formato_ordenes: str = 'texto') -> Tuple[pd.DataFrame, list]:
+    """Procesa el análisis principal con lógica completa incluyendo origen del consumo.
+    
+    Si stock_oficina no se pasa (None), se consulta aquí; si ya se obtuvo en paralelo con la maleta, se reutiliza.
+    `formato_ordenes` ('texto', 'lista' o 'conteo') decide cómo se guarda 'Trabajos/Órdenes'.
+    """
     
     with st.spinner("⚙️ Procesando análisis avanzado..."):
         try:
             # Obtener stock del almacén oficina (con manejo de errores)
             try:
-                stock_oficina = obtener_stock_oficina()
+                if stock_oficina is None:
+                    stock_oficina = obtener_stock_oficina()
                 if stock_oficina:
                     st.success(f"✅ Stock oficina obtenido: {len(stock_oficina)} productos")
                 else:
@@ -996,115 +2846,80 @@ def procesar_analisis(dotacion: pd.DataFrame, conteo: pd.DataFrame, consumo: pd.
                 st.warning(f"⚠️ Error obteniendo stock oficina: {str(e)}")
                 stock_oficina = {}
             
-            # Agregar conteo por SKU
-            conteo_agg = conteo.groupby('SKU', as_index=False).agg({
-                'Cantidad': 'sum'
-            }).rename(columns={'Cantidad': 'Contada'})
+            # Un mismo diccionario de SKUs para todas las fuentes: los cruces alinean arrays por código
+            diccionario = DiccionarioSKU()
+            codigos_dotacion = diccionario.codificar(dotacion['SKU'])
+            codigos_conteo = diccionario.codificar(conteo['SKU'])
+            codigos_consumo = diccionario.codificar(consumo['SKU'])
+            skus = diccionario.skus
             
-            # Agregar consumo por SKU
-            consumo_agg = consumo.groupby('SKU', as_index=False).agg({
-                'Cantidad': 'sum'
-            }).rename(columns={'Cantidad': 'Usada'})
+            # Agregar conteo y consumo por SKU
+            contada = _sumar_por_codigo(codigos_conteo, conteo['Cantidad'], len(skus))
+            usada = _sumar_por_codigo(codigos_consumo, consumo['Cantidad'], len(skus))
+            con_consumo = np.bincount(codigos_consumo[codigos_consumo >= 0], minlength=len(skus)) > 0
             
-            # Merge de todos los dataframes
-            df = pd.merge(dotacion, conteo_agg, on='SKU', how='outer')
-            df = pd.merge(df, consumo_agg, on='SKU', how='outer')
+            # Filas: las de dotación en su orden y después los SKUs que solo están en conteo o consumo
+            en_dotacion = np.zeros(len(skus), dtype=bool)
+            en_dotacion[codigos_dotacion] = True
+            solo_fuera = np.flatnonzero(~en_dotacion)
+            df = dotacion.reset_index(drop=True)
+            if len(solo_fuera):
+                df = pd.concat(
+                    [df, pd.DataFrame({'SKU': pd.Series(skus[solo_fuera], dtype=dotacion['SKU'].dtype)})],
+                    ignore_index=True
+                )
+            codigos = np.concatenate([codigos_dotacion, solo_fuera])
             
             # Rellenar valores nulos
-            df[['DOTACIÓN', 'Contada', 'Usada']] = df[['DOTACIÓN', 'Contada', 'Usada']].fillna(0)
+            df['DOTACIÓN'] = df['DOTACIÓN'].fillna(0)
+            df['Contada'] = contada[codigos]
+            df['Usada'] = usada[codigos]
             
             # Calcular reposición (SIEMPRE Dotación - Inventario, independiente del origen)
             df['Reposición'] = df['DOTACIÓN'] - df['Contada']
             
             # Agregar stock de maleta Holded si está disponible
             if stock_maleta and isinstance(stock_maleta, dict):
-                df['Stock Maleta Holded'] = df['SKU'].map(stock_maleta).fillna(0)
+                df['Stock Maleta Holded'] = diccionario.alinear_stock(stock_maleta)[codigos]
             else:
                 df['Stock Maleta Holded'] = 0
             
             # Agregar stock de oficina para todos los SKUs
             if stock_oficina and isinstance(stock_oficina, dict):
-                df['Stock Oficina'] = df['SKU'].map(stock_oficina).fillna(0)
+                df['Stock Oficina'] = diccionario.alinear_stock(stock_oficina)[codigos]
             else:
                 df['Stock Oficina'] = 0
             
-            # Analizar origen del consumo para cada SKU
-            origen_data = []
-            for _, row in df.iterrows():
-                sku = row['SKU']
-                consumo_total = row['Usada']
-                inventario_maleta = row['Contada']
-                
-                try:
-                    if consumo_total > 0:
-                        origen, desde_maleta, desde_oficina, descripcion = analizar_origen_consumo(
-                            sku, consumo_total, inventario_maleta, stock_oficina
-                        )
-                        origen_data.append({
-                            'SKU': sku,
-                            'Origen Consumo': origen,
-                            'Desde Maleta': desde_maleta,
-                            'Desde Oficina': desde_oficina,
-                            'Descripción Origen': descripcion
-                        })
-                    else:
-                        origen_data.append({
-                            'SKU': sku,
-                            'Origen Consumo': '⚪ Sin consumo',
-                            'Desde Maleta': 0,
-                            'Desde Oficina': 0,
-                            'Descripción Origen': 'No hay consumo registrado'
-                        })
-                except Exception as e:
-                    st.warning(f"⚠️ Error analizando origen para SKU {sku}: {str(e)}")
-                    origen_data.append({
-                        'SKU': sku,
-                        'Origen Consumo': '🔍 Error en análisis',
-                        'Desde Maleta': 0,
-                        'Desde Oficina': 0,
-                        'Descripción Origen': f'Error: {str(e)}'
-                    })
-            
-            # Merge con datos de origen
-            df_origen = pd.DataFrame(origen_data)
-            df = pd.merge(df, df_origen, on='SKU', how='left')
+            # Analizar origen del consumo de todos los SKUs a la vez
+            df_origen = analizar_origen_consumo_vectorizado(df, stock_oficina)
+            df[df_origen.columns] = df_origen
             
-            # Obtener IDs de origen de consumo
-            consumo_ids = consumo.groupby('SKU')['ID Parte'].apply(
-                lambda x: ', '.join(sorted(set(str(id_parte) for id_parte in x if pd.notna(id_parte))))
-            ).reset_index()
-            consumo_ids.rename(columns={'ID Parte': 'Trabajos/Órdenes'}, inplace=True)
-            df = pd.merge(df, consumo_ids, on='SKU', how='left')
+            # Obtener IDs de origen de consumo por código de SKU
+            ordenes = agregar_ordenes_por_sku(consumo, formato_ordenes, (codigos_consumo, skus)).to_numpy()[codigos]
             
-            # Rellenar valores nulos en 'Trabajos/Órdenes'
-            df['Trabajos/Órdenes'] = df['Trabajos/Órdenes'].fillna('Sin órdenes registradas')
+            # Los SKUs sin consumo se quedan sin órdenes registradas
+            if formato_ordenes == 'texto':
+                ordenes = np.where(con_consumo[codigos], ordenes, 'Sin órdenes registradas')
+            df['Trabajos/Órdenes'] = ordenes
             
-            # Aplicar lógica de diagnóstico mejorada
-            def diagnostico_completo(row):
-                try:
-                    return determinar_estado_completo(
-                        row['DOTACIÓN'], 
-                        row['Contada'], 
-                        row['Usada'],
-                        row['Stock Maleta Holded'] if stock_maleta else None,
-                        row['Desde Oficina'],
-                        row['Origen Consumo']
-                    )
-                except Exception as e:
-                    return f"🔍 Error en diagnóstico: {str(e)}"
-            
-            df['Diagnóstico'] = df.apply(diagnostico_completo, axis=1)
+            # Aplicar lógica de diagnóstico a todos los SKUs a la vez
+            df_estado = determinar_estado_vectorizado(df)
+            df[df_estado.columns] = df_estado
             
-            # Extraer ubicación del SKU
-            df['Ubicación'] = df['SKU'].str.extract(r'^\d{3}-(\w+)-\d+', expand=False)
-            df['Ubicación'] = df['Ubicación'].fillna('SIN_UBICACION')
+            # Extraer ubicación de cada SKU distinto
+            ubicaciones = pd.Series(skus, dtype=object).str.extract(r'^\d{3}-(\w+)-\d+', expand=False)
+            ubicaciones = ubicaciones.fillna('SIN_UBICACION').to_numpy(dtype=object)
+            df['Ubicación'] = ubicaciones[codigos]
             
             # Calcular diferencias adicionales
             if stock_maleta and isinstance(stock_maleta, dict):
                 df['Diff. vs Holded Maleta'] = df['Contada'] - df['Stock Maleta Holded']
             
-            # Ordenar por ubicación y SKU
-            df = df.sort_values(['Ubicación', 'SKU']).reset_index(drop=True)
+            # Ordenar por ubicación y SKU: se ordenan los SKUs distintos y las filas por su posición
+            orden_skus = pd.DataFrame({'Ubicación': ubicaciones, 'SKU': skus}).sort_values(['Ubicación', 'SKU']).index
+            posicion = np.empty(len(skus), dtype=np.int64)
+            posicion[orden_skus] = np.arange(len(skus))
+            df = df.iloc[np.argsort(posicion[codigos], kind='stable')].reset_index(drop=True)
             
             # Seleccionar y reordenar columnas finales
             columnas_finales = [
@@ -1122,7 +2937,7 @@ def procesar_analisis(dotacion: pd.DataFrame, conteo: pd.DataFrame, consumo: pd.
             # Agregar columnas de origen del consumo
             columnas_finales.extend([
                 'Desde Maleta', 'Desde Oficina', 'Origen Consumo',
-                'Diagnóstico', 'Descripción Origen', 'Trabajos/Órdenes'
+                'Diagnóstico', 'Descripción Origen', 'Trabajos/Órdenes', 'Código Estado'
             ])
             
             # Filtrar columnas que realmente existen en el DataFrame
@@ -1145,12 +2960,134 @@ def procesar_analisis(dotacion: pd.DataFrame, conteo: pd.DataFrame, consumo: pd.
             df_error = pd.DataFrame()
             return df_error, []
 
-def mostrar_metricas_resumen(df: pd.DataFrame, alertas: list = None):
-    """Muestra métricas de resumen del análisis incluyendo origen del consumo."""
+def clave_analisis(entradas: Dict[str, str], versiones_stock: Dict[str, Optional[float]], tecnico: Optional[str],
+                   fecha_inicio=None, fecha_fin=None) -> str:
+    """Hash de todo lo que determina el resultado de procesar_analisis, sin leer ni limpiar los datos.
     
-    if df.empty:
-        st.warning("⚠️ No hay datos para mostrar métricas")
-        return
+    `entradas` identifica el origen de dotación, conteo y consumo (hash del archivo subido o versión
+    del archivo en disco) y `versiones_stock` el snapshot de stock de cada almacén, de modo que la
+    caché se consulta antes de limpiar los datos y de pedir el stock a Holded. Las fechas no cambian
+    el resultado pero sí el Excel que se guarda en el historial.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(
+        [VERSION_ANALISIS, ALERTA_CONSUMO_OFICINA_UMBRAL, tecnico, str(fecha_inicio), str(fecha_fin),
+         entradas, versiones_stock],
+        sort_keys=True
+    ).encode())
+    return h.hexdigest()
+
+class CacheAnalisis(CacheLRU):
+    """Caché LRU en memoria de resultados de análisis, direccionada por el hash de sus entradas.
+    
+    El tamaño se mide con memory_usage(deep=True) del resultado.
+    """
+    
+    def obtener(self, clave: str) -> Optional[Dict[str, Any]]:
+        """Devuelve una copia del análisis cacheado (None si no está) y cuenta acierto/fallo."""
+        entrada = self._obtener(clave)
+        if entrada is None:
+            return None
+        return {
+            'resultado': entrada['resultado'].copy(),
+            'alertas': [dict(alerta) for alerta in entrada['alertas']],
+            'archivo': entrada['archivo']
+        }
+    
+    def guardar(self, clave: str, resultado: pd.DataFrame, alertas: list, archivo: Optional[str] = None):
+        self._guardar(
+            clave,
+            {
+                'resultado': resultado.copy(),
+                'alertas': [dict(alerta) for alerta in alertas],
+                'archivo': archivo
+            },
+            int(resultado.memory_usage(deep=True).sum())
+        )
+    
+    def marcar_archivo(self, clave: str, archivo: str):
+        """Recuerda el Excel del historial en el que se guardó el análisis."""
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas[clave]['archivo'] = archivo
+
+@st.cache_resource
+def obtener_cache_analisis() -> CacheAnalisis:
+    """Caché de análisis compartida por todas las sesiones."""
+    return CacheAnalisis(CACHE_ANALISIS_MAX_MB * 1024 * 1024)
+
+def _contar_categorias(serie: pd.Series) -> Dict[str, int]:
+    """Cuenta cada valor de una columna (categórica o de texto), omitiendo las categorías sin filas."""
+    return {str(k): int(v) for k, v in serie.value_counts().items() if v > 0}
+
+def calcular_resumen_analisis(df: pd.DataFrame) -> Dict[str, Any]:
+    """Calcula las métricas de resumen de un análisis (serializables a JSON).
+    
+    Es el único agregador de métricas: lo usan la pantalla de resultados, la hoja 'Resumen' del
+    Excel y el historial. Los grupos OK/Faltan/Excesos salen de 'Código Estado' con un bincount;
+    los análisis antiguos sin esa columna se clasifican por las etiquetas distintas del diagnóstico.
+    """
+    resumen = {'total': int(len(df))}
+    
+    if 'Diagnóstico' in df.columns:
+        resumen['diagnosticos'] = _contar_categorias(df['Diagnóstico'])
+        
+        codigos = df['Código Estado'] if 'Código Estado' in df.columns else None
+        if codigos is not None and not codigos.isna().any():
+            por_codigo = np.bincount(codigos.to_numpy(dtype=np.int64), minlength=ESTADO_REVISION + 1)
+            resumen['ok'] = int(por_codigo[list(CODIGOS_ESTADO_OK)].sum())
+            resumen['faltan'] = int(por_codigo[list(CODIGOS_ESTADO_FALTAN)].sum())
+            resumen['excesos'] = int(por_codigo[list(CODIGOS_ESTADO_EXCESO)].sum())
+        else:
+            diagnosticos = resumen['diagnosticos']
+            resumen['ok'] = sum(v for k, v in diagnosticos.items() if '✅' in k)
+            resumen['faltan'] = sum(v for k, v in diagnosticos.items() if '❌' in k)
+            resumen['excesos'] = sum(v for k, v in diagnosticos.items() if '⚠️' in k)
+    else:
+        resumen.update({'ok': 0, 'faltan': 0, 'excesos': 0, 'diagnosticos': None})
+    
+    resumen['reposicion'] = int(df.loc[df['Reposición'] > 0, 'Reposición'].sum()) if 'Reposición' in df.columns else None
+    
+    resumen['origen'] = None
+    if 'Desde Oficina' in df.columns and 'Origen Consumo' in df.columns:
+        origenes = _contar_categorias(df['Origen Consumo'])
+        resumen['origen'] = {
+            'solo_maleta': origenes.get(ORIGEN_SOLO_MALETA, 0),
+            'mixto': origenes.get(ORIGEN_MIXTO, 0),
+            'desde_oficina': int(df['Desde Oficina'].sum()),
+            'usada': float(df['Usada'].sum()) if 'Usada' in df.columns else None
+        }
+    
+    resumen['holded'] = None
+    if 'Stock Maleta Holded' in df.columns and 'Diff. vs Holded Maleta' in df.columns:
+        diferencia = df['Diff. vs Holded Maleta']
+        resumen['holded'] = {
+            'coinciden': int((diferencia == 0).sum()),
+            'mayor': int((diferencia > 0).sum()),
+            'menor': int((diferencia < 0).sum())
+        }
+    
+    resumen['origenes'] = None
+    if 'Origen Consumo' in df.columns and 'Usada' in df.columns:
+        con_consumo = df['Usada'] > 0
+        resumen['con_consumo'] = int(con_consumo.sum())
+        resumen['origenes'] = _contar_categorias(df.loc[con_consumo, 'Origen Consumo'])
+    
+    return resumen
+
+def mostrar_metricas_resumen(df: Optional[pd.DataFrame], alertas: list = None,
+                             resumen: Optional[Dict[str, Any]] = None):
+    """Muestra métricas de resumen del análisis incluyendo origen del consumo.
+    
+    `resumen` permite pintar métricas ya calculadas (al procesar el análisis o guardadas en el
+    historial); en ese caso `df` no se usa.
+    """
+    
+    if resumen is None:
+        if df.empty:
+            st.warning("⚠️ No hay datos para mostrar métricas")
+            return
+        resumen = calcular_resumen_analisis(df)
     
     st.subheader("📊 Resumen del Análisis")
     
@@ -1158,54 +3095,46 @@ def mostrar_metricas_resumen(df: pd.DataFrame, alertas: list = None):
     col1, col2, col3, col4, col5 = st.columns(5)
     
     with col1:
-        st.metric("📋 SKUs Total", len(df))
+        st.metric("📋 SKUs Total", resumen['total'])
     
     with col2:
-        ok_count = len(df[df['Diagnóstico'].str.contains('✅', na=False)])
-        st.metric("✅ Estado OK", ok_count)
+        st.metric("✅ Estado OK", resumen['ok'])
     
     with col3:
-        faltan_count = len(df[df['Diagnóstico'].str.contains('❌', na=False)])
-        st.metric("❌ Faltan Piezas", faltan_count)
+        st.metric("❌ Faltan Piezas", resumen['faltan'])
     
     with col4:
-        exceso_count = len(df[df['Diagnóstico'].str.contains('⚠️', na=False)])
-        st.metric("⚠️ Excesos/Problemas", exceso_count)
+        st.metric("⚠️ Excesos/Problemas", resumen['excesos'])
     
     with col5:
-        if 'Reposición' in df.columns:
-            reposicion_total = df[df['Reposición'] > 0]['Reposición'].sum()
-            st.metric("🔧 Total a Reponer", int(reposicion_total))
+        if resumen['reposicion'] is not None:
+            st.metric("🔧 Total a Reponer", resumen['reposicion'])
         else:
             st.metric("🔧 Total a Reponer", "N/A")
     
     # Métricas de origen del consumo
-    if 'Desde Oficina' in df.columns and 'Origen Consumo' in df.columns:
+    origen = resumen['origen']
+    if origen is not None:
         st.subheader("🏢 Análisis de Origen del Consumo")
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            solo_maleta = len(df[df['Origen Consumo'].str.contains('✅ Solo desde maleta', na=False)])
-            st.metric("✅ Solo desde Maleta", solo_maleta)
+            st.metric("✅ Solo desde Maleta", origen['solo_maleta'])
         
         with col2:
-            mixto = len(df[df['Origen Consumo'].str.contains('📦 Consumo mixto', na=False)])
-            st.metric("📦 Consumo Mixto", mixto)
+            st.metric("📦 Consumo Mixto", origen['mixto'])
         
         with col3:
-            total_desde_oficina = df['Desde Oficina'].sum()
-            st.metric("🏢 Total desde Oficina", int(total_desde_oficina))
+            st.metric("🏢 Total desde Oficina", origen['desde_oficina'])
         
         with col4:
-            if 'Usada' in df.columns:
-                skus_con_consumo = len(df[df['Usada'] > 0])
-                if skus_con_consumo > 0 and df['Usada'].sum() > 0:
-                    porcentaje_oficina = (df['Desde Oficina'].sum() / df['Usada'].sum()) * 100
-                    st.metric("📊 % Consumo Oficina", f"{porcentaje_oficina:.1f}%")
-                else:
-                    st.metric("📊 % Consumo Oficina", "0%")
-            else:
+            if origen['usada'] is None:
                 st.metric("📊 % Consumo Oficina", "N/A")
+            elif origen['usada'] > 0:
+                porcentaje_oficina = (origen['desde_oficina'] / origen['usada']) * 100
+                st.metric("📊 % Consumo Oficina", f"{porcentaje_oficina:.1f}%")
+            else:
+                st.metric("📊 % Consumo Oficina", "0%")
     
     # Mostrar alertas de dotación
     if alertas and len(alertas) > 0:
@@ -1233,27 +3162,25 @@ def mostrar_metricas_resumen(df: pd.DataFrame, alertas: list = None):
                         st.warning("🟡 ALTO: Más del 50% desde oficina")
     
     # Métricas adicionales si hay datos de Holded
-    if 'Stock Maleta Holded' in df.columns and 'Diff. vs Holded Maleta' in df.columns:
+    holded = resumen['holded']
+    if holded is not None:
         st.subheader("🏢 Comparación con Holded")
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            coinciden_holded = len(df[df['Diff. vs Holded Maleta'] == 0])
-            st.metric("🎯 Coinciden con Holded", coinciden_holded)
+            st.metric("🎯 Coinciden con Holded", holded['coinciden'])
         
         with col2:
-            mayor_holded = len(df[df['Diff. vs Holded Maleta'] > 0])
-            st.metric("📈 Mayor que Holded", mayor_holded)
+            st.metric("📈 Mayor que Holded", holded['mayor'])
         
         with col3:
-            menor_holded = len(df[df['Diff. vs Holded Maleta'] < 0])
-            st.metric("📉 Menor que Holded", menor_holded)
+            st.metric("📉 Menor que Holded", holded['menor'])
     
     # Gráfico de diagnósticos
-    if len(df) > 0 and 'Diagnóstico' in df.columns:
+    if resumen['total'] > 0 and resumen['diagnosticos'] is not None:
         st.subheader("📈 Distribución de Diagnósticos")
         try:
-            diagnosticos = df['Diagnóstico'].value_counts()
+            diagnosticos = pd.Series(resumen['diagnosticos'], name='count', dtype='int64')
             if len(diagnosticos) > 0:
                 st.bar_chart(diagnosticos)
             else:
@@ -1262,12 +3189,11 @@ def mostrar_metricas_resumen(df: pd.DataFrame, alertas: list = None):
             st.warning(f"⚠️ Error creando gráfico de diagnósticos: {str(e)}")
         
         # Gráfico de origen del consumo si está disponible
-        if 'Origen Consumo' in df.columns and 'Usada' in df.columns:
+        if resumen['origenes'] is not None:
             st.subheader("🔄 Distribución de Origen del Consumo")
             try:
-                df_con_consumo = df[df['Usada'] > 0]
-                if len(df_con_consumo) > 0:
-                    origen_consumo = df_con_consumo['Origen Consumo'].value_counts()
+                if resumen['con_consumo'] > 0:
+                    origen_consumo = pd.Series(resumen['origenes'], name='count', dtype='int64')
                     if len(origen_consumo) > 0:
                         st.bar_chart(origen_consumo)
                     else:
@@ -1277,132 +3203,412 @@ def mostrar_metricas_resumen(df: pd.DataFrame, alertas: list = None):
             except Exception as e:
                 st.warning(f"⚠️ Error creando gráfico de origen: {str(e)}")
 
+def nombre_tecnico_archivo(tecnico: str) -> str:
+    """Nombre del técnico tal y como aparece en los archivos de análisis."""
+    return tecnico.lower().replace(' ', '_').replace('ñ', 'n')
+
 def generar_nombre_archivo(tecnico: str, fecha_inicio: date, fecha_fin: date) -> str:
     """Genera nombre de archivo estandarizado."""
-    tecnico_clean = tecnico.lower().replace(' ', '_').replace('ñ', 'n')
+    tecnico_clean = nombre_tecnico_archivo(tecnico)
     timestamp = datetime.now().strftime("%H%M")
     return f"{tecnico_clean}_{fecha_inicio}_a_{fecha_fin}_{timestamp}.xlsx"
 
-def exportar_a_excel(df: pd.DataFrame, nombre_archivo: str, tecnico: str, fecha_inicio: date, fecha_fin: date, alertas: list = None) -> BytesIO:
-    """Exporta los resultados a Excel con formato mejorado incluyendo análisis de origen."""
+def cargar_analisis_historial(nombre_archivo: str, path_excel: str, limite: Optional[int] = None) -> pd.DataFrame:
+    """Carga un análisis del historial (solo las `limite` primeras filas si se indica) desde la base
+    de datos o, si no está, desde su Excel."""
+    try:
+        df = obtener_base_datos().cargar_analisis(nombre_archivo, limite=limite)
+        if df is not None:
+            return df
+    except sqlite3.Error:
+        pass
+    return pd.read_excel(path_excel, sheet_name='Análisis Detallado', nrows=limite)
+
+def cargar_resumen_historial(nombre_archivo: str) -> Optional[Dict[str, Any]]:
+    """Métricas guardadas de un análisis del historial (None si hay que calcularlas)."""
+    try:
+        return obtener_base_datos().cargar_resumen_analisis(nombre_archivo)
+    except sqlite3.Error:
+        return None
+
+FILAS_BLOQUE_EXCEL = 10000  # filas que se convierten a la vez al escribir el Excel en streaming
+
+def _hoja_streaming(libro: Workbook, nombre: str, df: pd.DataFrame):
+    """Añade una hoja al libro write-only escribiendo el DataFrame por bloques de filas."""
+    hoja = libro.create_sheet(nombre)
     
-    output = BytesIO()
+    # Cabecera con el mismo estilo que usa pandas
+    cabecera = []
+    for columna in df.columns:
+        celda = WriteOnlyCell(hoja, value=str(columna))
+        celda.font = ESTILO_CABECERA_EXCEL['font']
+        celda.border = ESTILO_CABECERA_EXCEL['border']
+        celda.alignment = ESTILO_CABECERA_EXCEL['alignment']
+        cabecera.append(celda)
+    hoja.append(cabecera)
     
-    try:
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Hoja principal con resultados
-            df.to_excel(writer, sheet_name='Análisis Detallado', index=False)
-            
-            # Hoja de resumen
-            resumen_data = {
-                'Métrica': ['SKUs Total', 'Estado OK', 'Faltan Piezas', 'Excesos/Problemas', 'Total a Reponer'],
-                'Valor': [
-                    len(df),
-                    len(df[df['Diagnóstico'].str.contains('✅', na=False)]) if 'Diagnóstico' in df.columns else 0,
-                    len(df[df['Diagnóstico'].str.contains('❌', na=False)]) if 'Diagnóstico' in df.columns else 0,
-                    len(df[df['Diagnóstico'].str.contains('⚠️', na=False)]) if 'Diagnóstico' in df.columns else 0,
-                    int(df[df['Reposición'] > 0]['Reposición'].sum()) if 'Reposición' in df.columns else 0
-                ]
-            }
-            
-            # Agregar métricas de origen del consumo
-            if 'Desde Oficina' in df.columns and 'Origen Consumo' in df.columns:
-                resumen_data['Métrica'].extend([
-                    'Solo desde Maleta', 'Consumo Mixto', 'Total desde Oficina', '% Consumo Oficina'
-                ])
-                
-                solo_maleta = len(df[df['Origen Consumo'].str.contains('✅ Solo desde maleta', na=False)])
-                mixto = len(df[df['Origen Consumo'].str.contains('📦 Consumo mixto', na=False)])
-                total_oficina = df['Desde Oficina'].sum()
-                
-                if 'Usada' in df.columns and df['Usada'].sum() > 0:
-                    porcentaje_oficina = (df['Desde Oficina'].sum() / df['Usada'].sum()) * 100
-                else:
-                    porcentaje_oficina = 0
-                
-                resumen_data['Valor'].extend([
-                    solo_maleta, mixto, int(total_oficina), f"{porcentaje_oficina:.1f}%"
-                ])
-            
-            # Agregar métricas de Holded si están disponibles
-            if 'Stock Maleta Holded' in df.columns and 'Diff. vs Holded Maleta' in df.columns:
-                resumen_data['Métrica'].extend(['Coinciden con Holded', 'Mayor que Holded', 'Menor que Holded'])
-                resumen_data['Valor'].extend([
-                    len(df[df['Diff. vs Holded Maleta'] == 0]),
-                    len(df[df['Diff. vs Holded Maleta'] > 0]),
-                    len(df[df['Diff. vs Holded Maleta'] < 0])
-                ])
-            
-            resumen_df = pd.DataFrame(resumen_data)
-            resumen_df.to_excel(writer, sheet_name='Resumen', index=False)
-            
-            # Hoja de alertas si existen
-            if alertas and len(alertas) > 0:
-                try:
-                    alertas_df = pd.DataFrame(alertas)
-                    alertas_df.to_excel(writer, sheet_name='Alertas Dotación', index=False)
-                except Exception as e:
-                    st.warning(f"⚠️ Error exportando alertas: {str(e)}")
-            
-            # Hoja de metadatos
-            metadata = pd.DataFrame({
-                'Campo': [
-                    'Técnico', 'Fecha Inicio', 'Fecha Fin', 'Fecha Análisis', 
-                    'Total SKUs', 'Integración Holded', 'Análisis Oficina', 'Alertas Generadas'
-                ],
-                'Valor': [
-                    tecnico, 
-                    fecha_inicio, 
-                    fecha_fin, 
-                    datetime.now().strftime("%Y-%m-%d %H:%M"), 
-                    len(df),
-                    'Sí' if 'Stock Maleta Holded' in df.columns else 'No',
-                    'Sí' if 'Desde Oficina' in df.columns else 'No',
-                    len(alertas) if alertas else 0
-                ]
-            })
-            metadata.to_excel(writer, sheet_name='Metadatos', index=False)
+    # Columnas de listas ('Trabajos/Órdenes' en formato lista): en Excel se escriben como texto
+    listas = {
+        columna for columna in df.columns
+        if df[columna].dtype == object and len(df) and isinstance(df[columna].iloc[0], list)
+    }
+    
+    for inicio in range(0, len(df), FILAS_BLOQUE_EXCEL):
+        bloque = df.iloc[inicio:inicio + FILAS_BLOQUE_EXCEL]
+        columnas = []
+        for columna in bloque.columns:
+            valores = bloque[columna].tolist()
+            if columna in listas:
+                valores = [', '.join(map(str, valor)) for valor in valores]
+            else:
+                for posicion in np.flatnonzero(bloque[columna].isna().to_numpy()):
+                    valores[posicion] = None
+            columnas.append(valores)
+        for fila in zip(*columnas):
+            hoja.append(fila)
+
+def _escribir_libro_analisis(destino, df: pd.DataFrame, tecnico: str, fecha_inicio: date, fecha_fin: date,
+                             alertas: list = None):
+    """Escribe el libro del análisis en `destino` (ruta o archivo binario) con openpyxl en modo write-only."""
+    libro = Workbook(write_only=True)
+    
+    # Hoja principal con resultados
+    _hoja_streaming(libro, 'Análisis Detallado', df)
+    
+    # Hoja de resumen (mismas métricas que la pantalla de resultados)
+    resumen = calcular_resumen_analisis(df)
+    resumen_data = {
+        'Métrica': ['SKUs Total', 'Estado OK', 'Faltan Piezas', 'Excesos/Problemas', 'Total a Reponer'],
+        'Valor': [
+            resumen['total'],
+            resumen['ok'],
+            resumen['faltan'],
+            resumen['excesos'],
+            resumen['reposicion'] or 0
+        ]
+    }
+    
+    # Agregar métricas de origen del consumo
+    origen = resumen['origen']
+    if origen is not None:
+        resumen_data['Métrica'].extend([
+            'Solo desde Maleta', 'Consumo Mixto', 'Total desde Oficina', '% Consumo Oficina'
+        ])
         
-        output.seek(0)
-        return output
+        if origen['usada'] is not None and origen['usada'] > 0:
+            porcentaje_oficina = (origen['desde_oficina'] / origen['usada']) * 100
+        else:
+            porcentaje_oficina = 0
         
-    except Exception as e:
-        st.error(f"❌ Error exportando a Excel: {str(e)}")
-        # Devolver un archivo vacío en caso de error
-        output_error = BytesIO()
-        with pd.ExcelWriter(output_error, engine='openpyxl') as writer:
-            pd.DataFrame({'Error': [f'Error exportando: {str(e)}']}).to_excel(writer, index=False)
-        output_error.seek(0)
-        return output_error
+        resumen_data['Valor'].extend([
+            origen['solo_maleta'], origen['mixto'], origen['desde_oficina'], f"{porcentaje_oficina:.1f}%"
+        ])
+    
+    # Agregar métricas de Holded si están disponibles
+    holded = resumen['holded']
+    if holded is not None:
+        resumen_data['Métrica'].extend(['Coinciden con Holded', 'Mayor que Holded', 'Menor que Holded'])
+        resumen_data['Valor'].extend([holded['coinciden'], holded['mayor'], holded['menor']])
+    
+    _hoja_streaming(libro, 'Resumen', pd.DataFrame(resumen_data))
+    
+    # Hoja de alertas si existen
+    if alertas and len(alertas) > 0:
+        try:
+            _hoja_streaming(libro, 'Alertas Dotación', pd.DataFrame(alertas))
+        except Exception as e:
+            st.warning(f"⚠️ Error exportando alertas: {str(e)}")
+    
+    # Hoja de metadatos
+    metadata = pd.DataFrame({
+        'Campo': [
+            'Técnico', 'Fecha Inicio', 'Fecha Fin', 'Fecha Análisis', 
+            'Total SKUs', 'Integración Holded', 'Análisis Oficina', 'Alertas Generadas'
+        ],
+        'Valor': [
+            tecnico, 
+            fecha_inicio, 
+            fecha_fin, 
+            datetime.now().strftime("%Y-%m-%d %H:%M"), 
+            len(df),
+            'Sí' if 'Stock Maleta Holded' in df.columns else 'No',
+            'Sí' if 'Desde Oficina' in df.columns else 'No',
+            len(alertas) if alertas else 0
+        ]
+    })
+    _hoja_streaming(libro, 'Metadatos', metadata)
+    
+    libro.save(destino)
+
+def guardar_excel_analisis(path_archivo: str, df: pd.DataFrame, tecnico: str, fecha_inicio: date, fecha_fin: date,
+                           alertas: list = None):
+    """Escribe el análisis directamente en su archivo del historial, fila a fila y sin copia en memoria."""
+    ruta_tmp = f"{path_archivo}.tmp"
+    try:
+        _escribir_libro_analisis(ruta_tmp, df, tecnico, fecha_inicio, fecha_fin, alertas)
+        os.replace(ruta_tmp, path_archivo)
+    finally:
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+
+def guardar_analisis_en_historial(nombre_archivo: str, df: pd.DataFrame, tecnico: str, fecha_inicio: date,
+                                  fecha_fin: date, alertas: list = None) -> str:
+    """Escribe el Excel en el historial y registra el análisis en la base de datos.
+    
+    Si la base de datos falla el Excel se conserva (sigue disponible para descargar) y se registra
+    en la siguiente sincronización del historial.
+    """
+    path_archivo = os.path.join(HISTORIAL_DIR, nombre_archivo)
+    guardar_excel_analisis(path_archivo, df, tecnico, fecha_inicio, fecha_fin, alertas)
+    try:
+        obtener_base_datos().guardar_analisis(
+            nombre_archivo, df, tecnico, fecha_inicio, fecha_fin, len(alertas) if alertas else 0
+        )
+    except sqlite3.Error as e:
+        st.warning(f"⚠️ Análisis guardado en {nombre_archivo} sin registrar en la base de datos: {str(e)}")
+    return path_archivo
+
+def conteo_desde_inventario(inventario: Dict[str, Any]) -> pd.DataFrame:
+    """Convierte el diccionario SKU -> cantidad de un inventario en formato de conteo para análisis."""
+    conteo_data = []
+    for sku, cantidad in inventario.items():
+        conteo_data.append({
+            'SKU': sku,
+            'Cantidad': cantidad
+        })
+    
+    df_conteo = pd.DataFrame(conteo_data)
+    df_conteo['SKU'] = normalizar_skus(df_conteo['SKU'])
+    
+    return df_conteo
 
 def cargar_inventario_como_conteo(nombre_archivo: str) -> Optional[pd.DataFrame]:
     """Convierte un inventario guardado en formato de conteo para análisis."""
     try:
-        with open(os.path.join(INVENTARIOS_DIR, nombre_archivo), 'r') as f:
-            data = json.load(f)
-        
-        # Convertir inventario a formato de conteo
-        conteo_data = []
-        for sku, cantidad in data['inventario'].items():
-            conteo_data.append({
-                'SKU': sku,
-                'Cantidad': cantidad
-            })
-        
-        df_conteo = pd.DataFrame(conteo_data)
-        df_conteo['SKU'] = df_conteo['SKU'].astype(str).str.strip().str.upper()
-        
-        return df_conteo
+        data = cargar_inventario_guardado(nombre_archivo)
+        return conteo_desde_inventario(data['inventario'])
         
     except Exception as e:
         st.error(f"❌ Error cargando inventario: {str(e)}")
         return None
 
+def construir_indice_filtros(resultado: pd.DataFrame, alertas: list) -> Dict[str, Any]:
+    """Precalcula los filtros de la tabla de resultados: códigos por faceta y máscaras booleanas.
+    
+    Cualquier combinación de filtros se resuelve después como intersección de máscaras.
+    """
+    facetas = {}
+    for columna in ('Ubicación', 'Diagnóstico', 'Origen Consumo'):
+        if columna not in resultado.columns:
+            continue
+        codigos, valores = pd.factorize(resultado[columna], sort=True)
+        facetas[columna] = {
+            'codigos': codigos,
+            'valores': valores.tolist(),
+            'posicion': {valor: i for i, valor in enumerate(valores.tolist())},
+            'conteos': np.bincount(codigos[codigos >= 0], minlength=len(valores))
+        }
+    
+    marcas = {'reposicion': (resultado['Reposición'] > 0).to_numpy()}
+    if 'Diff. vs Holded Maleta' in resultado.columns:
+        marcas['diferencias_holded'] = (resultado['Diff. vs Holded Maleta'] != 0).to_numpy()
+    if 'Desde Oficina' in resultado.columns:
+        marcas['consumo_oficina'] = (resultado['Desde Oficina'] > 0).to_numpy()
+    if alertas:
+        skus_con_alerta = {alerta['sku'] for alerta in alertas}
+        marcas['alertas'] = resultado['SKU'].isin(skus_con_alerta).to_numpy()
+    
+    return {
+        'filas': len(resultado),
+        'facetas': facetas,
+        'marcas': marcas,
+        'conteos_marcas': {nombre: int(mascara.sum()) for nombre, mascara in marcas.items()}
+    }
+
+def aplicar_indice_filtros(indice: Dict[str, Any], seleccion: Dict[str, Optional[str]],
+                           marcas_activas: List[str]) -> np.ndarray:
+    """Devuelve las posiciones de las filas que cumplen todos los filtros seleccionados."""
+    mascara = np.ones(indice['filas'], dtype=bool)
+    
+    for columna, valor in seleccion.items():
+        if valor is None or columna not in indice['facetas']:
+            continue
+        faceta = indice['facetas'][columna]
+        codigo = faceta['posicion'].get(valor, -2)
+        mascara &= faceta['codigos'] == codigo
+    
+    for marca in marcas_activas:
+        mascara &= indice['marcas'][marca]
+    
+    return np.flatnonzero(mascara)
+
+def selector_faceta(indice: Dict[str, Any], etiqueta: str, columna: str, opcion_todas: str) -> Optional[str]:
+    """Selectbox de una faceta con el número de filas de cada opción; None si se eligen todas."""
+    faceta = indice['facetas'][columna]
+    conteos = dict(zip(faceta['valores'], faceta['conteos'].tolist()))
+    seleccion = st.selectbox(
+        etiqueta,
+        [opcion_todas] + faceta['valores'],
+        format_func=lambda valor: f"{valor} ({indice['filas'] if valor == opcion_todas else conteos[valor]})",
+        key=f"filtro_{columna}"
+    )
+    return None if seleccion == opcion_todas else seleccion
+
+def mostrar_resultados_analisis(analisis: Dict[str, Any]):
+    """Muestra métricas, filtros, tabla y descarga del análisis guardado en la sesión.
+    
+    Cambiar un filtro solo recorta el DataFrame ya calculado: el análisis no se repite.
+    """
+    resultado = analisis['resultado']
+    alertas = analisis['alertas']
+    
+    st.caption(
+        f"📌 Análisis de {analisis['tecnico']} ({analisis['fecha_inicio']} a {analisis['fecha_fin']}), "
+        f"procesado a las {analisis['procesado'].strftime('%H:%M:%S')}"
+    )
+    
+    # Mostrar métricas
+    mostrar_metricas_resumen(resultado, alertas, analisis['resumen'])
+    
+    # Mostrar tabla con filtros
+    st.subheader("📋 Resultados Detallados")
+    
+    # Índice de filtros construido una vez por análisis
+    if analisis.get('indice_filtros') is None:
+        analisis['indice_filtros'] = construir_indice_filtros(resultado, alertas)
+    indice = analisis['indice_filtros']
+    
+    # Filtros (cada opción muestra cuántas filas tiene; claves fijas para que sobrevivan a un nuevo análisis)
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        filtro_ubicacion = selector_faceta(indice, "🏷️ Filtrar por Ubicación", 'Ubicación', 'Todas')
+    
+    with col2:
+        filtro_diagnostico = selector_faceta(indice, "🔍 Filtrar por Diagnóstico", 'Diagnóstico', 'Todos')
+    
+    with col3:
+        solo_reposicion = st.checkbox("🔧 Solo items que requieren reposición", key="filtro_reposicion")
+        st.caption(f"{indice['conteos_marcas']['reposicion']} filas")
+    
+    with col4:
+        if 'Origen Consumo' in indice['facetas']:
+            filtro_origen = selector_faceta(indice, "🏢 Filtrar por Origen", 'Origen Consumo', 'Todos')
+        else:
+            filtro_origen = None
+    
+    # Filtros adicionales
+    marcas_activas = ['reposicion'] if solo_reposicion else []
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if 'diferencias_holded' in indice['marcas']:
+            if st.checkbox("🏢 Solo diferencias con Holded", key="filtro_diferencias_holded"):
+                marcas_activas.append('diferencias_holded')
+            st.caption(f"{indice['conteos_marcas']['diferencias_holded']} filas")
+    
+    with col2:
+        if 'consumo_oficina' in indice['marcas']:
+            if st.checkbox("🏭 Solo consumo desde oficina", key="filtro_consumo_oficina"):
+                marcas_activas.append('consumo_oficina')
+            st.caption(f"{indice['conteos_marcas']['consumo_oficina']} filas")
+    
+    with col3:
+        if 'alertas' in indice['marcas']:
+            if st.checkbox("🚨 Solo SKUs con alertas", key="filtro_alertas"):
+                marcas_activas.append('alertas')
+            st.caption(f"{indice['conteos_marcas']['alertas']} filas")
+    
+    # Aplicar filtros: intersección de máscaras y una única selección de filas
+    posiciones = aplicar_indice_filtros(
+        indice,
+        {'Ubicación': filtro_ubicacion, 'Diagnóstico': filtro_diagnostico, 'Origen Consumo': filtro_origen},
+        marcas_activas
+    )
+    df_filtrado = resultado.take(posiciones)
+    
+    # Configuración de columnas para display
+    column_config = {
+        "Código Estado": None,
+        "Diagnóstico": st.column_config.TextColumn(
+            "Diagnóstico",
+            help="Estado del item según el análisis completo"
+        ),
+        "Reposición": st.column_config.NumberColumn(
+            "Reposición",
+            help="Cantidad que debe reponerse en maleta",
+            format="%d"
+        ),
+        "Desde Maleta": st.column_config.NumberColumn(
+            "Desde Maleta",
+            help="Cantidad consumida desde la maleta",
+            format="%d"
+        ),
+        "Desde Oficina": st.column_config.NumberColumn(
+            "Desde Oficina", 
+            help="Cantidad consumida desde almacén oficina",
+            format="%d"
+        ),
+        "Origen Consumo": st.column_config.TextColumn(
+            "Origen Consumo",
+            help="Origen predominante del consumo"
+        )
+    }
+    
+    if 'Stock Maleta Holded' in df_filtrado.columns:
+        column_config["Stock Maleta Holded"] = st.column_config.NumberColumn(
+            "Stock Maleta Holded",
+            help="Stock actual en Holded para la maleta",
+            format="%d"
+        )
+        column_config["Diff. vs Holded Maleta"] = st.column_config.NumberColumn(
+            "Diff. vs Holded Maleta",
+            help="Diferencia respecto a Holded maleta",
+            format="%d"
+        )
+    
+    if 'Stock Oficina' in df_filtrado.columns:
+        column_config["Stock Oficina"] = st.column_config.NumberColumn(
+            "Stock Oficina",
+            help="Stock disponible en almacén oficina",
+            format="%d"
+        )
+    
+    # Mostrar tabla filtrada
+    st.dataframe(
+        df_filtrado, 
+        use_container_width=True,
+        hide_index=True,
+        column_config=column_config
+    )
+    
+    # Descarga servida desde el archivo del historial
+    if analisis['archivo']:
+        path_archivo = os.path.join(HISTORIAL_DIR, analisis['archivo'])
+        if os.path.exists(path_archivo):
+            st.divider()
+            with open(path_archivo, 'rb') as f:
+                st.download_button(
+                    "📥 Descargar Análisis Completo",
+                    data=f,
+                    file_name=analisis['archivo'],
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    type="primary",
+                    use_container_width=True
+                )
+
 # ============================================================================
 # INTERFAZ PRINCIPAL
 # ============================================================================
 
 def main():
+    # Configuración de la página
+    st.set_page_config(
+        page_title="Analizador de Maletas Técnicas",
+        page_icon="🔧",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    crear_directorios()
+    
     st.title("🔧 Analizador de Maletas Técnicas - Sistema Completo")
     st.markdown("### Sistema avanzado de inventario, control y análisis integrado con Holded")
     
@@ -1451,6 +3657,9 @@ def main():
     if menu == "📊 Nuevo análisis":
         st.header("📊 Nuevo Análisis de Reposición")
         
+        if 'analisis_actual' not in st.session_state:
+            st.session_state.analisis_actual = None
+        
         # Información del análisis
         with st.expander("📋 Información del análisis", expanded=True):
             col1, col2 = st.columns(2)
@@ -1490,12 +3699,12 @@ def main():
         )
         
         conteo_df = None
-        stock_holded_data = None
+        clave_conteo = None
+        warehouse_maleta = None
         
         if opcion_conteo == "📱 Usar inventario realizado":
             # Mostrar inventarios disponibles
-            inventarios = cargar_inventarios_disponibles()
-            inventarios_completados = [inv for inv in inventarios if inv['estado'] == 'completado']
+            inventarios_completados = cargar_inventarios_disponibles(estado='completado')
             
             if not inventarios_completados:
                 st.warning("⚠️ No hay inventarios completados disponibles")
@@ -1516,23 +3725,26 @@ def main():
                     
                     if conteo_df is not None:
                         st.success(f"✅ Inventario cargado: {len(conteo_df)} SKUs")
+                        # Un inventario son pocas filas: su clave se calcula sobre el propio conteo
+                        clave_conteo = f"inventario:{inventario_seleccionado['archivo']}:" + hashlib.sha256(
+                            pd.util.hash_pandas_object(conteo_df, index=False).to_numpy().tobytes()
+                        ).hexdigest()
                         
-                        # Obtener stock de Holded para este técnico
+                        # Almacén Holded de este técnico (se consulta junto con oficina al procesar)
                         tecnico_inventario = inventario_seleccionado['tecnico']
                         if tecnico_inventario in TECNICOS_CONFIG:
-                            warehouse_id = TECNICOS_CONFIG[tecnico_inventario]['warehouse_id']
-                            stock_holded_data = obtener_stock_warehouse(warehouse_id)
+                            warehouse_maleta = TECNICOS_CONFIG[tecnico_inventario]['warehouse_id']
         
         else:
             # Subir archivo tradicional
             with st.expander("📊 Conteo Físico Manual", expanded=True):
                 st.info("💡 El archivo debe tener SKUs en columna B y cantidades en columna D (las primeras 2 filas se ignoran)")
-                conteo_df = cargar_archivo("conteo físico", "conteo")
+                conteo_df, clave_conteo = cargar_archivo("conteo físico", "conteo")
         
         # Archivo de consumo
         with st.expander("🔧 Consumo Registrado", expanded=True):
             st.info("💡 Debe contener columnas: 'ID Parte', 'Cantidad', 'Articulo'")
-            consumo_df = cargar_archivo("consumo registrado", "consumo")
+            consumo_df, clave_consumo = cargar_archivo("consumo registrado", "consumo")
         
         # Procesar análisis
         if conteo_df is not None and consumo_df is not None and dotacion_df is not None:
@@ -1540,188 +3752,101 @@ def main():
             
             if st.button("🚀 Procesar Análisis", type="primary", use_container_width=True):
                 try:
-                    # Para archivos manuales, limpiar datos tradicional
-                    if opcion_conteo == "📁 Subir archivo de conteo":
-                        dotacion, conteo, consumo = limpiar_datos(dotacion_df, conteo_df, consumo_df)
+                    # Un análisis con las mismas entradas se reutiliza de la caché. La clave sale de los
+                    # archivos de origen y de la versión del snapshot de stock de cada almacén, así que
+                    # se consulta antes de limpiar los datos y de pedir el stock a Holded
+                    almacen_oficina = HOLDED_CONFIG["almacen_oficina"]
+                    almacenes = [almacen_oficina] + ([warehouse_maleta] if warehouse_maleta else [])
+                    info_dotacion = os.stat(DOTACION_ARCHIVO)
+                    entradas = {
+                        'dotacion': f"{info_dotacion.st_mtime_ns}:{info_dotacion.st_size}",
+                        'conteo': clave_conteo,
+                        'consumo': clave_consumo
+                    }
+                    cache_analisis = obtener_cache_analisis()
+                    versiones = versiones_stock_almacenes(almacenes)
+                    en_cache = None
+                    if versiones is not None:
+                        clave = clave_analisis(entradas, versiones, tecnico, fecha_inicio, fecha_fin)
+                        en_cache = cache_analisis.obtener(clave)
+                    
+                    if en_cache is not None:
+                        resultado, alertas = en_cache['resultado'], en_cache['alertas']
+                        st.success("⚡ Análisis idéntico recuperado de la caché")
                     else:
-                        # Para inventarios, ya están limpios
-                        dotacion = dotacion_df[COLUMNAS_ESPERADAS['dotacion']].copy()
-                        dotacion = dotacion.dropna(subset=["SKU"])
-                        dotacion['SKU'] = dotacion['SKU'].astype(str).str.strip().str.upper()
+                        # Para archivos manuales, limpiar datos tradicional
+                        if opcion_conteo == "📁 Subir archivo de conteo":
+                            dotacion, conteo, consumo = limpiar_datos(dotacion_df, conteo_df, consumo_df)
+                        else:
+                            dotacion, conteo, consumo = preparar_datos_inventario(dotacion_df, conteo_df, consumo_df)
                         
-                        conteo = conteo_df.copy()
+                        # Stock de maleta (si hay inventario) y de oficina, consultados en paralelo; la
+                        # clave se rehace con la versión del stock que realmente se usa
+                        stocks, versiones = obtener_stock_almacenes(almacenes)
+                        stock_holded_data = stocks.get(warehouse_maleta) if warehouse_maleta else None
+                        stock_oficina = stocks.get(almacen_oficina) or {}
+                        clave = clave_analisis(entradas, versiones, tecnico, fecha_inicio, fecha_fin)
                         
-                        consumo = consumo_df[COLUMNAS_ESPERADAS['consumo']].copy()
-                        consumo = consumo.dropna(subset=['Articulo'])
-                        consumo['SKU'] = consumo['Articulo'].str.extract(r'(^\S+)', expand=False)
-                        consumo = consumo[['SKU', 'Cantidad', 'ID Parte']].copy()
-                        consumo['SKU'] = consumo['SKU'].astype(str).str.strip().str.upper()
-                        consumo['Cantidad'] = pd.to_numeric(consumo['Cantidad'], errors='coerce').fillna(0)
-                    
-                    # Procesar análisis con datos de Holded si están disponibles
-                    resultado, alertas = procesar_analisis(dotacion, conteo, consumo, stock_holded_data, tecnico)
-                    
-                    st.success("✅ Análisis completado exitosamente")
-                    
-                    # Mostrar métricas
-                    mostrar_metricas_resumen(resultado, alertas)
-                    
-                    # Mostrar tabla con filtros
-                    st.subheader("📋 Resultados Detallados")
-                    
-                    # Filtros
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        ubicaciones = ['Todas'] + sorted(resultado['Ubicación'].unique().tolist())
-                        filtro_ubicacion = st.selectbox("🏷️ Filtrar por Ubicación", ubicaciones)
-                    
-                    with col2:
-                        diagnosticos = ['Todos'] + sorted(resultado['Diagnóstico'].unique().tolist())
-                        filtro_diagnostico = st.selectbox("🔍 Filtrar por Diagnóstico", diagnosticos)
-                    
-                    with col3:
-                        solo_reposicion = st.checkbox("🔧 Solo items que requieren reposición")
-                    
-                    with col4:
-                        if 'Origen Consumo' in resultado.columns:
-                            origenes = ['Todos'] + sorted(resultado['Origen Consumo'].unique().tolist())
-                            filtro_origen = st.selectbox("🏢 Filtrar por Origen", origenes)
-                        else:
-                            filtro_origen = 'Todos'
-                    
-                    # Filtros adicionales
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        if 'Stock Maleta Holded' in resultado.columns:
-                            solo_diferencias_holded = st.checkbox("🏢 Solo diferencias con Holded")
-                        else:
-                            solo_diferencias_holded = False
-                    
-                    with col2:
-                        if 'Desde Oficina' in resultado.columns:
-                            solo_consumo_oficina = st.checkbox("🏭 Solo consumo desde oficina")
-                        else:
-                            solo_consumo_oficina = False
-                    
-                    with col3:
-                        if alertas:
-                            solo_alertas = st.checkbox("🚨 Solo SKUs con alertas")
-                            skus_con_alerta = [a['sku'] for a in alertas]
-                        else:
-                            solo_alertas = False
-                            skus_con_alerta = []
-                    
-                    # Aplicar filtros
-                    df_filtrado = resultado.copy()
-                    
-                    if filtro_ubicacion != 'Todas':
-                        df_filtrado = df_filtrado[df_filtrado['Ubicación'] == filtro_ubicacion]
-                    
-                    if filtro_diagnostico != 'Todos':
-                        df_filtrado = df_filtrado[df_filtrado['Diagnóstico'] == filtro_diagnostico]
-                    
-                    if filtro_origen != 'Todos':
-                        df_filtrado = df_filtrado[df_filtrado['Origen Consumo'] == filtro_origen]
-                    
-                    if solo_reposicion:
-                        df_filtrado = df_filtrado[df_filtrado['Reposición'] > 0]
-                    
-                    if solo_diferencias_holded and 'Diff. vs Holded Maleta' in df_filtrado.columns:
-                        df_filtrado = df_filtrado[df_filtrado['Diff. vs Holded Maleta'] != 0]
-                    
-                    if solo_consumo_oficina and 'Desde Oficina' in df_filtrado.columns:
-                        df_filtrado = df_filtrado[df_filtrado['Desde Oficina'] > 0]
-                    
-                    if solo_alertas and skus_con_alerta:
-                        df_filtrado = df_filtrado[df_filtrado['SKU'].isin(skus_con_alerta)]
-                    
-                    # Configuración de columnas para display
-                    column_config = {
-                        "Diagnóstico": st.column_config.TextColumn(
-                            "Diagnóstico",
-                            help="Estado del item según el análisis completo"
-                        ),
-                        "Reposición": st.column_config.NumberColumn(
-                            "Reposición",
-                            help="Cantidad que debe reponerse en maleta",
-                            format="%d"
-                        ),
-                        "Desde Maleta": st.column_config.NumberColumn(
-                            "Desde Maleta",
-                            help="Cantidad consumida desde la maleta",
-                            format="%d"
-                        ),
-                        "Desde Oficina": st.column_config.NumberColumn(
-                            "Desde Oficina", 
-                            help="Cantidad consumida desde almacén oficina",
-                            format="%d"
-                        ),
-                        "Origen Consumo": st.column_config.TextColumn(
-                            "Origen Consumo",
-                            help="Origen predominante del consumo"
-                        )
-                    }
-                    
-                    if 'Stock Maleta Holded' in df_filtrado.columns:
-                        column_config["Stock Maleta Holded"] = st.column_config.NumberColumn(
-                            "Stock Maleta Holded",
-                            help="Stock actual en Holded para la maleta",
-                            format="%d"
-                        )
-                        column_config["Diff. vs Holded Maleta"] = st.column_config.NumberColumn(
-                            "Diff. vs Holded Maleta",
-                            help="Diferencia respecto a Holded maleta",
-                            format="%d"
+                        # Procesar análisis con datos de Holded si están disponibles
+                        resultado, alertas = procesar_analisis(
+                            dotacion, conteo, consumo, stock_holded_data, tecnico,
+                            stock_oficina=stock_oficina
                         )
+                        if not resultado.empty:
+                            cache_analisis.guardar(clave, resultado, alertas)
+                        st.success("✅ Análisis completado exitosamente")
                     
-                    if 'Stock Oficina' in df_filtrado.columns:
-                        column_config["Stock Oficina"] = st.column_config.NumberColumn(
-                            "Stock Oficina",
-                            help="Stock disponible en almacén oficina",
-                            format="%d"
+                    if MODO_DEBUG:
+                        estadisticas = cache_analisis.estadisticas()
+                        st.caption(
+                            f"🗄️ Caché de análisis: {'acierto' if en_cache is not None else 'fallo'} · "
+                            f"{estadisticas['aciertos']} aciertos / {estadisticas['fallos']} fallos · "
+                            f"{estadisticas['entradas']} análisis ({estadisticas['mb']:.1f} MB)"
                         )
                     
-                    # Mostrar tabla filtrada
-                    st.dataframe(
-                        df_filtrado, 
-                        use_container_width=True,
-                        hide_index=True,
-                        column_config=column_config
-                    )
-                    
-                    # Guardar y descargar
-                    st.divider()
+                    # Guardar en historial una sola vez por análisis; si el análisis cacheado
+                    # ya está en el historial no se vuelve a exportar
+                    archivo_previo = en_cache['archivo'] if en_cache is not None else None
+                    ya_guardado = bool(archivo_previo) and os.path.exists(os.path.join(HISTORIAL_DIR, archivo_previo))
+                    nombre_archivo = archivo_previo if ya_guardado else generar_nombre_archivo(tecnico, fecha_inicio, fecha_fin)
                     
-                    nombre_archivo = generar_nombre_archivo(tecnico, fecha_inicio, fecha_fin)
-                    path_archivo = os.path.join(HISTORIAL_DIR, nombre_archivo)
-                    
-                    # Guardar en historial
                     try:
-                        excel_data = exportar_a_excel(resultado, nombre_archivo, tecnico, fecha_inicio, fecha_fin, alertas)
-                        
-                        # Guardar archivo en historial
-                        with open(path_archivo, 'wb') as f:
-                            f.write(excel_data.getvalue())
-                        
-                        # Botón de descarga
-                        st.download_button(
-                            "📥 Descargar Análisis Completo",
-                            data=excel_data.getvalue(),
-                            file_name=nombre_archivo,
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            type="primary",
-                            use_container_width=True
-                        )
+                        if not ya_guardado:
+                            guardar_analisis_en_historial(nombre_archivo, resultado, tecnico, fecha_inicio, fecha_fin, alertas)
+                            cache_analisis.marcar_archivo(clave, nombre_archivo)
                         
                         st.success(f"💾 Análisis guardado en historial: {nombre_archivo}")
                         
                     except Exception as e:
                         st.error(f"❌ Error guardando archivo: {str(e)}")
+                        nombre_archivo = None
+                    
+                    # El análisis queda en la sesión: los filtros solo recortan este resultado
+                    st.session_state.analisis_actual = None if resultado.empty else {
+                        'resultado': resultado,
+                        'alertas': alertas,
+                        'resumen': calcular_resumen_analisis(resultado),
+                        'tecnico': tecnico,
+                        'fecha_inicio': fecha_inicio,
+                        'fecha_fin': fecha_fin,
+                        'archivo': nombre_archivo,
+                        'procesado': datetime.now(),
+                        'indice_filtros': construir_indice_filtros(resultado, alertas)
+                    }
                 
                 except Exception as e:
                     st.error(f"❌ Error durante el análisis: {str(e)}")
                     with st.expander("🔍 Detalles del error"):
                         st.code(traceback.format_exc())
+        
+        # Resultados del último análisis procesado (sobreviven a los reruns de los filtros)
+        if st.session_state.analisis_actual is not None:
+            try:
+                mostrar_resultados_analisis(st.session_state.analisis_actual)
+            except Exception as e:
+                st.error(f"❌ Error mostrando el análisis: {str(e)}")
+                with st.expander("🔍 Detalles del error"):
+                    st.code(traceback.format_exc())
     
     elif menu == "📱 Inventario":
         mostrar_interface_inventario()
@@ -1730,13 +3855,18 @@ def main():
         st.header("📁 Historial de Análisis")
         
         try:
-            archivos = [f for f in os.listdir(HISTORIAL_DIR) if f.endswith('.xlsx')]
-            archivos = sorted(archivos, reverse=True)  # Más recientes primero
+            bd = obtener_base_datos()
+            bd.sincronizar_archivos(INVENTARIOS_DIR, HISTORIAL_DIR)
+            tecnicos_historial = bd.tecnicos_analisis()
             
-            if not archivos:
+            if not tecnicos_historial:
                 st.info("📭 No hay análisis previos guardados")
                 return
             
+            filtro_tecnico = st.selectbox("👨‍🔧 Filtrar por técnico:", ["Todos"] + tecnicos_historial)
+            analisis_guardados = bd.listar_analisis(None if filtro_tecnico == "Todos" else filtro_tecnico)
+            archivos = [a['archivo'] for a in analisis_guardados]
+            
             # Selección de archivo
             seleccion = st.selectbox(
                 "📋 Selecciona un análisis:", 
@@ -1746,41 +3876,65 @@ def main():
             
             if seleccion:
                 path_completo = os.path.join(HISTORIAL_DIR, seleccion)
+                registro = analisis_guardados[archivos.index(seleccion)]
                 
                 try:
-                    # Mostrar información del archivo
-                    info_archivo = os.stat(path_completo)
-                    fecha_creacion = datetime.fromtimestamp(info_archivo.st_mtime)
+                    # Mostrar información del análisis
+                    fecha_creacion = datetime.fromisoformat(registro['creado'])
                     
                     col1, col2 = st.columns(2)
                     with col1:
                         st.info(f"📅 Creado: {fecha_creacion.strftime('%Y-%m-%d %H:%M')}")
                     with col2:
-                        st.info(f"📏 Tamaño: {info_archivo.st_size / 1024:.1f} KB")
+                        if os.path.exists(path_completo):
+                            st.info(f"📏 Tamaño: {os.path.getsize(path_completo) / 1024:.1f} KB")
+                        else:
+                            st.info(f"📊 SKUs: {registro['total_skus']}")
                     
-                    # Leer y mostrar datos
-                    df_hist = pd.read_excel(path_completo, sheet_name='Análisis Detallado')
+                    # Métricas guardadas con el análisis; los antiguos sin ellas se leen enteros y se calculan
+                    resumen = cargar_resumen_historial(seleccion)
+                    df_completo = None
+                    if resumen is None:
+                        df_completo = cargar_analisis_historial(seleccion, path_completo)
+                        resumen = calcular_resumen_analisis(df_completo)
                     
                     # Mostrar métricas del historial (sin alertas ya que es histórico)
-                    mostrar_metricas_resumen(df_hist, [])
+                    mostrar_metricas_resumen(df_completo, [], resumen)
+                    
+                    # Vista previa: en análisis grandes solo se leen las primeras filas
+                    total_filas = resumen['total']
+                    mostrar_todas = total_filas <= VISTA_PREVIA_FILAS or st.checkbox(
+                        f"📄 Mostrar las {total_filas} filas", key=f"todas_{seleccion}"
+                    )
+                    limite = None if mostrar_todas else VISTA_PREVIA_FILAS
+                    if df_completo is None:
+                        df_hist = cargar_analisis_historial(seleccion, path_completo, limite)
+                    else:
+                        df_hist = df_completo.head(limite) if limite else df_completo
+                    df_hist = df_hist.drop(columns=['Código Estado'], errors='ignore')
                     
                     # Mostrar tabla
                     st.subheader(f"📋 Vista previa: {seleccion}")
+                    if not mostrar_todas:
+                        st.caption(f"Mostrando las primeras {VISTA_PREVIA_FILAS} de {total_filas} filas")
                     st.dataframe(df_hist, use_container_width=True, hide_index=True)
                     
                     # Botón de descarga
-                    with open(path_completo, 'rb') as f:
-                        st.download_button(
-                            "📥 Descargar este análisis",
-                            data=f.read(),
-                            file_name=seleccion,
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
+                    if os.path.exists(path_completo):
+                        with open(path_completo, 'rb') as f:
+                            st.download_button(
+                                "📥 Descargar este análisis",
+                                data=f.read(),
+                                file_name=seleccion,
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                            )
                     
                     # Opción para eliminar
                     if st.button("🗑️ Eliminar este análisis", type="secondary"):
                         if st.checkbox("⚠️ Confirmar eliminación"):
-                            os.remove(path_completo)
+                            bd.eliminar_analisis(seleccion)
+                            if os.path.exists(path_completo):
+                                os.remove(path_completo)
                             st.success("✅ Análisis eliminado")
                             st.rerun()
                 
@@ -1903,7 +4057,7 @@ def main():
             
             **APIs utilizadas:**
             - ✅ `/warehouses/{{warehouseId}}/stock` - Stock por almacén específico
-            - 🔄 Cache de 5 minutos para optimizar rendimiento
+            - 🔄 Snapshot de stock en disco: se sirve al instante y se refresca en segundo plano
             - 🔍 Validación en tiempo real durante inventario
             - 📊 Análisis de origen automático en análisis
             
@@ -1932,6 +4086,11 @@ def main():
             """)
         
         with st.expander("🏢 Integración con Holded"):
+            if HOLDED_CONFIG["api_key"]:
+                estado_api = "✅ Configurada (variable de entorno `HOLDED_API_KEY`)"
+            else:
+                estado_api = ("❌ Sin configurar: define la variable de entorno `HOLDED_API_KEY` al desplegar; "
+                              "sin ella no se consulta el stock de Holded")
             st.markdown(f"""
             ### Configuración actual:
             
@@ -1940,8 +4099,8 @@ def main():
             - **Rigoberto**: Almacén `{TECNICOS_CONFIG['Rigoberto']['warehouse_id']}`
             
             **API de Holded:**
-            - ✅ Configurada y activa
-            - 🔄 Cache de 5 minutos para optimizar rendimiento
+            - {estado_api}
+            - 🔄 Snapshot de stock en disco: se sirve al instante y se refresca en segundo plano
             - 🔍 Validación en tiempo real durante inventario
             - 📊 Comparación automática en análisis
             
@@ -1969,7 +4128,7 @@ def main():
             - **📊 Exportar siempre** resultados finales
             
             ### Solución de problemas:
-            - **🔗 Error Holded**: Verificar conexión a internet
+            - **🔗 Error Holded**: Verificar conexión a internet y que `HOLDED_API_KEY` esté definida
             - **❌ SKU no válido**: Verificar formato XXX-XXXXX-XXXX
             - **⚠️ Diferencias grandes**: Revisar manualmente
             - **💾 Error guardando**: Verificar permisos de carpeta
@@ -0,0 +1,276 @@
+"""Servidor local que imita el endpoint de stock de Holded para pruebas y benchmarks.
+
+Sirve `GET .../warehouses/{id}/stock` con payloads sintéticos de tamaño configurable o con
+fixtures grabados de la API real, y permite inyectar latencia, errores 5xx y límites de
+peticiones (429). La app se apunta a él con variables de entorno:
+
+    python holded_fake.py --productos 20000 --latencia 150 --tasa-429 0.05
+    HOLDED_BASE_URL=http://127.0.0.1:8765 MALETA_SNAPSHOTS_DIR=/tmp/snapshots streamlit run app.py
+
+Modos:
+    sintetico  Genera un stock determinista por almacén (por defecto).
+    replay     Sirve los fixtures guardados en --fixtures ({warehouse_id}.json).
+    record     Consulta la API real (--upstream, HOLDED_API_KEY), guarda el fixture y lo sirve.
+
+`GET /__stats` devuelve contadores de peticiones para medir el rendimiento del cliente.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+import requests
+
+RUTA_STOCK = re.compile(r"/warehouses/([^/?]+)/stock/?$")
+FORMATOS = ("lista", "data", "products", "items", "plano")
+
+
+def generar_payload_stock(warehouse_id: str, productos: int, formato: str = "lista", semilla: int = 0) -> Any:
+    """Genera un stock sintético determinista para un almacén en cualquiera de los formatos de Holded."""
+    rng = random.Random(f"{semilla}-{warehouse_id}")
+    items = [
+        {"sku": f"SKU-{i:06d}", "name": f"Producto {i}", "stock": rng.randint(0, 50)}
+        for i in range(productos)
+    ]
+
+    if formato == "lista":
+        return items
+    if formato == "plano":
+        return {item["sku"]: item["stock"] for item in items}
+    if formato == "data":
+        return {"data": items, "meta": {"total": productos}}
+    return {formato: items}
+
+
+class LimitadorPeticiones:
+    """Token bucket: permite `rps` peticiones por segundo con ráfagas de hasta `rafaga`."""
+
+    def __init__(self, rps: float, rafaga: Optional[int] = None):
+        self.rps = rps
+        self.capacidad = rafaga or max(1, int(rps))
+        self.tokens = float(self.capacidad)
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        with self.lock:
+            ahora = time.monotonic()
+            self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.rps)
+            self.ultimo = ahora
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class EstadoServidor:
+    """Configuración y contadores compartidos por todos los hilos del servidor."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.semilla)
+        self.limitador = LimitadorPeticiones(args.limite_rps) if args.limite_rps else None
+        self.payloads: Dict[str, bytes] = {}
+        self.payloads_gzip: Dict[str, bytes] = {}
+        self.lock = threading.Lock()
+        self.stats = {"peticiones": 0, "ok": 0, "errores_5xx": 0, "rate_limit": 0, "no_encontrado": 0,
+                      "errores_upstream": 0, "bytes": 0}
+
+    def contar(self, clave: str, bytes_enviados: int = 0):
+        with self.lock:
+            self.stats["peticiones"] += 1
+            self.stats[clave] += 1
+            self.stats["bytes"] += bytes_enviados
+
+    def azar(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def payload_gzip(self, warehouse_id: str, cuerpo: bytes) -> bytes:
+        """Devuelve el cuerpo comprimido con gzip, comprimiéndolo solo la primera vez."""
+        with self.lock:
+            comprimido = self.payloads_gzip.get(warehouse_id)
+        if comprimido is None:
+            comprimido = gzip.compress(cuerpo, compresslevel=5)
+            with self.lock:
+                self.payloads_gzip[warehouse_id] = comprimido
+        return comprimido
+
+    def payload(self, warehouse_id: str) -> Optional[bytes]:
+        """Devuelve el cuerpo JSON del almacén según el modo (cacheado en memoria)."""
+        with self.lock:
+            if warehouse_id in self.payloads:
+                return self.payloads[warehouse_id]
+
+        args = self.args
+        ruta_fixture = os.path.join(args.fixtures, f"{warehouse_id}.json")
+
+        if args.modo == "sintetico":
+            cuerpo = json.dumps(
+                generar_payload_stock(warehouse_id, args.productos, args.formato, args.semilla),
+                separators=(",", ":")
+            ).encode()
+        elif args.modo == "replay":
+            if not os.path.exists(ruta_fixture):
+                return None
+            with open(ruta_fixture, "rb") as f:
+                cuerpo = f.read()
+        else:
+            cuerpo = grabar_fixture(args.upstream, args.api_key, warehouse_id, ruta_fixture)
+            if cuerpo is None:
+                return None
+
+        with self.lock:
+            self.payloads[warehouse_id] = cuerpo
+        return cuerpo
+
+
+class ErrorUpstream(Exception):
+    """La API real de Holded no respondió en el modo record."""
+
+
+def grabar_fixture(upstream: str, api_key: str, warehouse_id: str, ruta_fixture: str) -> Optional[bytes]:
+    """Consulta la API real de Holded y guarda la respuesta como fixture.
+
+    Lanza ErrorUpstream si no se puede contactar con la API real.
+    """
+    try:
+        response = requests.get(
+            f"{upstream.rstrip('/')}/warehouses/{warehouse_id}/stock",
+            headers={"key": api_key, "Accept": "application/json"},
+            timeout=30
+        )
+    except requests.RequestException as e:
+        print(f"❌ Upstream no disponible para {warehouse_id}: {e}")
+        raise ErrorUpstream(str(e)) from e
+    if response.status_code != 200:
+        print(f"❌ Upstream respondió {response.status_code} para {warehouse_id}")
+        return None
+
+    os.makedirs(os.path.dirname(ruta_fixture) or ".", exist_ok=True)
+    with open(ruta_fixture, "wb") as f:
+        f.write(response.content)
+    print(f"💾 Fixture grabado: {ruta_fixture} ({len(response.content) / 1024:.1f} KB)")
+    return response.content
+
+
+class ManejadorHolded(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    estado: EstadoServidor = None
+
+    def log_message(self, formato, *args):
+        if self.estado.args.verbose:
+            super().log_message(formato, *args)
+
+    def _acepta_gzip(self) -> bool:
+        return self.estado.args.gzip and "gzip" in self.headers.get("Accept-Encoding", "")
+
+    def _responder(self, codigo: int, cuerpo: bytes, cabeceras: Optional[Dict[str, str]] = None,
+                   comprimido: bool = False):
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        if comprimido:
+            self.send_header("Content-Encoding", "gzip")
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self):
+        estado = self.estado
+        args = estado.args
+
+        if self.path.rstrip("/") == "/__stats":
+            with estado.lock:
+                cuerpo = json.dumps(estado.stats).encode()
+            self._responder(200, cuerpo)
+            return
+
+        coincidencia = RUTA_STOCK.search(self.path)
+        if not coincidencia:
+            estado.contar("no_encontrado")
+            self._responder(404, b'{"error":"not found"}')
+            return
+
+        # Latencia simulada
+        if args.latencia:
+            espera = max(0.0, args.latencia + (estado.azar() * 2 - 1) * args.jitter) / 1000
+            time.sleep(espera)
+
+        # Límites de peticiones y errores inyectados
+        if (estado.limitador and not estado.limitador.permitir()) or estado.azar() < args.tasa_429:
+            estado.contar("rate_limit")
+            self._responder(429, b'{"error":"too many requests"}', {"Retry-After": str(args.retry_after)})
+            return
+        if estado.azar() < args.tasa_error:
+            estado.contar("errores_5xx")
+            self._responder(503, b'{"error":"service unavailable"}')
+            return
+
+        warehouse_id = coincidencia.group(1)
+        try:
+            cuerpo = estado.payload(warehouse_id)
+        except ErrorUpstream:
+            estado.contar("errores_upstream")
+            self._responder(502, b'{"error":"bad gateway"}')
+            return
+        if cuerpo is None:
+            estado.contar("no_encontrado")
+            self._responder(404, b'{"error":"warehouse not found"}')
+            return
+
+        comprimido = self._acepta_gzip()
+        if comprimido:
+            cuerpo = estado.payload_gzip(warehouse_id, cuerpo)
+        estado.contar("ok", len(cuerpo))
+        self._responder(200, cuerpo, comprimido=comprimido)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita el stock de almacenes de Holded")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--modo", choices=("sintetico", "replay", "record"), default="sintetico")
+    parser.add_argument("--fixtures", default="fixtures_holded", help="Directorio de fixtures para replay/record")
+    parser.add_argument("--productos", type=int, default=1000, help="Productos por almacén en modo sintético")
+    parser.add_argument("--formato", choices=FORMATOS, default="lista", help="Forma del payload sintético")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--latencia", type=float, default=0, help="Latencia media por petición (ms)")
+    parser.add_argument("--jitter", type=float, default=0, help="Variación máxima de la latencia (ms)")
+    parser.add_argument("--tasa-error", type=float, default=0, help="Probabilidad de responder 503")
+    parser.add_argument("--tasa-429", type=float, default=0, help="Probabilidad de responder 429")
+    parser.add_argument("--limite-rps", type=float, default=0, help="Peticiones por segundo antes de responder 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Valor de la cabecera Retry-After en los 429")
+    parser.add_argument("--sin-gzip", dest="gzip", action="store_false", help="No comprimir aunque el cliente lo acepte")
+    parser.add_argument("--upstream", default="https://api.holded.com/api/invoicing/v1", help="API real para record")
+    parser.add_argument("--api-key", default=os.environ.get("HOLDED_API_KEY", ""), help="Key de Holded para record")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.modo == "record" and not args.api_key:
+        parser.error("el modo record necesita --api-key o HOLDED_API_KEY")
+
+    ManejadorHolded.estado = EstadoServidor(args)
+    servidor = ThreadingHTTPServer((args.host, args.puerto), ManejadorHolded)
+    servidor.daemon_threads = True
+
+    print(f"🧪 Holded simulado ({args.modo}) en http://{args.host}:{args.puerto}")
+    print(f"   HOLDED_BASE_URL=http://{args.host}:{args.puerto}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Compara las versiones vectorizadas del análisis con la lógica fila a fila y con merges a la que sustituyen.
+
+Cada test cubre una petición distinta:
+    user-001  origen del consumo vectorizado (analizar_origen_consumo_vectorizado)
+    user-002  diagnóstico por columnas (determinar_estado_vectorizado)
+    user-024  trabajos/órdenes por SKU sin groupby.apply (agregar_ordenes_por_sku)
+    user-025  SKUs codificados como enteros en lugar de merges (procesar_analisis)
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+STOCK_OFICINA = {'001-A-1': 5, '002-B-2': 1, 'YY': 2, '003-C-9': 4}
+STOCK_MALETA = {'001-A-1': 2, 'ZZ': 3, '003-C-9': 1.5}
+
+
+def _ordenes_por_grupo(consumo: pd.DataFrame) -> pd.Series:
+    """Trabajos/órdenes como se calculaban antes: un set de textos por SKU, ordenado grupo a grupo."""
+    return consumo.groupby('SKU')['ID Parte'].apply(
+        lambda x: sorted(set(str(id_parte) for id_parte in x if pd.notna(id_parte)))
+    )
+
+
+def _analisis_con_merge(dotacion: pd.DataFrame, conteo: pd.DataFrame, consumo: pd.DataFrame,
+                        stock_maleta, stock_oficina) -> pd.DataFrame:
+    """Cruce de dotación, conteo, consumo y stocks con groupby + merge outer, como antes de codificar los SKUs."""
+    conteo_agg = conteo.groupby('SKU', as_index=False).agg({'Cantidad': 'sum'}).rename(columns={'Cantidad': 'Contada'})
+    consumo_agg = consumo.groupby('SKU', as_index=False).agg({'Cantidad': 'sum'}).rename(columns={'Cantidad': 'Usada'})
+
+    df = pd.merge(dotacion, conteo_agg, on='SKU', how='outer')
+    df = pd.merge(df, consumo_agg, on='SKU', how='outer')
+    df[['DOTACIÓN', 'Contada', 'Usada']] = df[['DOTACIÓN', 'Contada', 'Usada']].fillna(0)
+    df['Reposición'] = df['DOTACIÓN'] - df['Contada']
+    df['Stock Maleta Holded'] = df['SKU'].map(stock_maleta).fillna(0) if stock_maleta else 0
+    df['Stock Oficina'] = df['SKU'].map(stock_oficina).fillna(0)
+
+    ordenes = _ordenes_por_grupo(consumo).map(', '.join)
+    df['Trabajos/Órdenes'] = df['SKU'].map(ordenes).fillna('Sin órdenes registradas')
+    df['Ubicación'] = df['SKU'].str.extract(r'^\d{3}-(\w+)-\d+', expand=False).fillna('SIN_UBICACION')
+    return df.sort_values(['Ubicación', 'SKU']).reset_index(drop=True)
+
+
+@pytest.fixture
+def dotacion():
+    return pd.DataFrame({
+        'SKU': ['001-A-1', '002-B-2', '001-A-1', '003-C-9', '004-A-2'],  # SKU repetido en dotación
+        'DOTACIÓN': [3, 2, 1, np.nan, 4],
+        'CAJA': [1, 2, 3, 4, 5],
+        'SECCION': [1, 1, 2, 2, 3],
+        'Nº ORDEN': pd.Series(['a', 1, None, 2, 3], dtype=object)
+    })
+
+
+@pytest.fixture
+def conteo():
+    return pd.DataFrame({'SKU': ['001-A-1', 'ZZ', 'ZZ', '003-C-9', '002-B-2'], 'Cantidad': [1.0, 2, 3, np.nan, 2]})
+
+
+@pytest.fixture
+def consumo():
+    return pd.DataFrame({
+        'SKU': ['001-A-1', '001-A-1', 'YY', 'ZZ', 'YY', '003-C-9', '001-A-1', '004-A-2'],
+        'Cantidad': [1.0, 2, 3, 4, 5, 1, 0.5, 10],
+        # ID Parte mezcla enteros, textos y vacíos; 101 y '101' son la misma orden como texto
+        'ID Parte': pd.Series([101, '101', np.nan, 'OT-7', 8, None, 'OT-2', 3], dtype=object)
+    })
+
+
+# user-001
+def test_origen_consumo_vectorizado_igual_que_escalar():
+    valores = [0, 0.5, 1, 2, 3, 7]
+    df = pd.DataFrame(list(itertools.product(valores, valores, valores)), columns=['Usada', 'Contada', 'Stock Oficina'])
+    df['SKU'] = [f'SKU-{i}' for i in range(len(df))]
+    stock_oficina = dict(zip(df['SKU'], df['Stock Oficina']))
+
+    for entrada in (df, df.drop(columns='Stock Oficina')):
+        resultado = app.analizar_origen_consumo_vectorizado(entrada, stock_oficina)
+        for fila, esperado in zip(df.itertuples(index=False), resultado.itertuples(index=False)):
+            if fila.Usada > 0:
+                origen = app.analizar_origen_consumo(fila.SKU, fila.Usada, fila.Contada, stock_oficina)
+            else:
+                origen = ('⚪ Sin consumo', 0, 0, 'No hay consumo registrado')
+            assert (str(esperado[0]), esperado[1], esperado[2], esperado[3]) == origen
+
+
+# user-002
+def test_estado_vectorizado_igual_que_escalar():
+    valores = [0, 0.5, 1, 2, 4]
+    df = pd.DataFrame(list(itertools.product(valores, repeat=5)),
+                      columns=['DOTACIÓN', 'Contada', 'Usada', 'Stock Maleta Holded', 'Desde Oficina'])
+
+    resultado = app.determinar_estado_vectorizado(df)
+    esperado = [
+        app.determinar_estado_completo(f.DOTACIÓN, f.Contada, f.Usada, f._3, f._4)
+        for f in df.itertuples(index=False)
+    ]
+    assert resultado['Diagnóstico'].tolist() == esperado
+
+    # Sin columna de stock de maleta el diagnóstico es el de stock_maleta=None
+    sin_stock = app.determinar_estado_vectorizado(df.drop(columns='Stock Maleta Holded'))
+    esperado = [
+        app.determinar_estado_completo(f.DOTACIÓN, f.Contada, f.Usada, None, f._4)
+        for f in df.itertuples(index=False)
+    ]
+    assert sin_stock['Diagnóstico'].tolist() == esperado
+
+
+# user-024
+@pytest.mark.parametrize('filas', [slice(None), slice(0, 0)], ids=['con_consumo', 'consumo_vacio'])
+def test_ordenes_por_sku_igual_que_groupby(consumo, filas):
+    consumo = consumo.iloc[filas]
+    esperado = _ordenes_por_grupo(consumo)
+
+    texto = app.agregar_ordenes_por_sku(consumo, 'texto')
+    lista = app.agregar_ordenes_por_sku(consumo, 'lista')
+    conteo = app.agregar_ordenes_por_sku(consumo, 'conteo')
+
+    assert texto.sort_index().to_dict() == esperado.map(', '.join).to_dict()
+    assert lista.sort_index().to_dict() == esperado.to_dict()
+    assert conteo.sort_index().to_dict() == esperado.map(len).to_dict()
+
+
+# user-025
+@pytest.mark.parametrize('stock_maleta', [None, STOCK_MALETA], ids=['sin_maleta', 'con_maleta'])
+@pytest.mark.parametrize('vacio', [None, 'consumo', 'conteo'])
+def test_procesar_analisis_igual_que_merge(dotacion, conteo, consumo, stock_maleta, vacio):
+    if vacio == 'consumo':
+        consumo = consumo.iloc[:0]
+    elif vacio == 'conteo':
+        conteo = conteo.iloc[:0]
+
+    resultado, _ = app.procesar_analisis(dotacion, conteo, consumo, stock_maleta, 'Rigoberto',
+                                         stock_oficina=STOCK_OFICINA)
+    esperado = _analisis_con_merge(dotacion, conteo, consumo, stock_maleta, STOCK_OFICINA)
+
+    columnas = ['SKU', 'CAJA', 'SECCION', 'DOTACIÓN', 'Contada', 'Usada', 'Reposición', 'Stock Oficina']
+    if stock_maleta:
+        columnas.append('Stock Maleta Holded')
+    pd.testing.assert_frame_equal(resultado[columnas], esperado[columnas], check_dtype=False)
+    for columna in ('DOTACIÓN', 'Contada', 'Usada', 'Reposición'):
+        assert resultado[columna].dtype == np.float64
+    assert resultado['Nº ORDEN'].tolist() == esperado['Nº ORDEN'].tolist()
+    assert resultado['Ubicación'].tolist() == esperado['Ubicación'].tolist()
+    assert resultado['Trabajos/Órdenes'].tolist() == esperado['Trabajos/Órdenes'].tolist()
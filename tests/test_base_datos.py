@@ -0,0 +1,117 @@
+"""Base de datos de inventarios y análisis: los análisis se recargan igual que se guardaron.
+
+Cubre user-011 (base de datos SQLite) y user-013 (resumen y vista previa del historial).
+"""
+
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def _analisis(formato_ordenes: str = 'texto') -> pd.DataFrame:
+    dotacion = pd.DataFrame({
+        'SKU': ['001-A-1', '002-B-2', '003-C-3'],
+        'DOTACIÓN': [2.0, 3, 1],
+        'CAJA': [1, 2, 3],
+        'SECCION': [1, 1, 2],
+        # 'Nº ORDEN' mezcla fechas de Excel, textos y vacíos
+        'Nº ORDEN': pd.Series([datetime(2024, 2, 12), 'x', np.nan], dtype=object)
+    })
+    conteo = pd.DataFrame({'SKU': ['001-A-1', 'ZZ'], 'Cantidad': [1.0, 2]})
+    consumo = pd.DataFrame({'SKU': ['001-A-1', 'YY'], 'Cantidad': [1.0, 3],
+                            'ID Parte': pd.Series([101, 'OT-1'], dtype=object)})
+    resultado, _ = app.procesar_analisis(dotacion, conteo, consumo, {'001-A-1': 1}, 'Rigoberto',
+                                         stock_oficina={'YY': 1}, formato_ordenes=formato_ordenes)
+    return resultado
+
+
+@pytest.fixture
+def bd(tmp_path):
+    return app.BaseDatosMaleta(str(tmp_path / 'maleta.db'))
+
+
+@pytest.mark.parametrize('formato_ordenes', app.FORMATOS_ORDENES)
+def test_analisis_ida_y_vuelta(bd, formato_ordenes):
+    resultado = _analisis(formato_ordenes)
+    bd.guardar_analisis('rigoberto.xlsx', resultado, 'Rigoberto', '2024-01-01', '2024-02-01')
+
+    recargado = bd.cargar_analisis('rigoberto.xlsx')
+    pd.testing.assert_frame_equal(recargado, resultado)
+    assert recargado['Nº ORDEN'][resultado['SKU'] == '001-A-1'].item() == datetime(2024, 2, 12)
+
+    # Filtrando por código de estado se conservan también los tipos
+    codigo = int(resultado['Código Estado'].iloc[0])
+    esperado = resultado[resultado['Código Estado'] == codigo].reset_index(drop=True)
+    pd.testing.assert_frame_equal(bd.cargar_analisis('rigoberto.xlsx', [codigo]), esperado)
+
+
+def test_analisis_sin_tipos_se_lee_del_excel(bd):
+    bd.guardar_analisis('antiguo.xlsx', _analisis(), 'Rigoberto', '2024-01-01', '2024-02-01')
+    with bd._conectar() as conn:
+        conn.execute("UPDATE analisis SET tipos = NULL")
+    assert bd.cargar_analisis('antiguo.xlsx') is None
+
+
+def test_base_datos_anterior_recibe_columnas_nuevas(tmp_path):
+    ruta = str(tmp_path / 'antigua.db')
+    with sqlite3.connect(ruta) as conn:
+        conn.executescript(app.ESQUEMA_BD.replace('    columnas TEXT NOT NULL,\n    tipos TEXT\n', '    columnas TEXT NOT NULL\n'))
+    bd = app.BaseDatosMaleta(ruta)
+    bd.guardar_analisis('a.xlsx', _analisis(), 'Rigoberto', '2024-01-01', '2024-02-01')
+    assert bd.cargar_analisis('a.xlsx') is not None
+
+
+def test_fallo_de_base_datos_conserva_el_excel(tmp_path, monkeypatch):
+    historial = tmp_path / 'historial'
+    inventarios = tmp_path / 'inventarios'
+    historial.mkdir()
+    inventarios.mkdir()
+
+    class BaseDatosBloqueada:
+        def guardar_analisis(self, *args, **kwargs):
+            raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(app, 'HISTORIAL_DIR', str(historial))
+    monkeypatch.setattr(app, 'obtener_base_datos', BaseDatosBloqueada)
+    ruta = app.guardar_analisis_en_historial('rigoberto.xlsx', _analisis(), 'Rigoberto',
+                                             datetime(2024, 1, 1).date(), datetime(2024, 2, 1).date())
+    assert os.path.exists(ruta)
+
+    # La siguiente sincronización registra el Excel que quedó sin registrar
+    bd = app.BaseDatosMaleta(str(tmp_path / 'maleta.db'))
+    assert bd.sincronizar_archivos(str(inventarios), str(historial)) == (0, 1)
+    assert [a['archivo'] for a in bd.listar_analisis('Rigoberto')] == ['rigoberto.xlsx']
+    assert bd.sincronizar_archivos(str(inventarios), str(historial)) == (0, 0)
+
+
+def test_sincronizacion_no_reintenta_archivos_ilegibles(bd, tmp_path):
+    inventarios = tmp_path / 'inventarios'
+    inventarios.mkdir()
+    (inventarios / 'roto.json').write_text('{no es json')
+    (inventarios / 'bueno.json').write_text(json.dumps({
+        'tecnico': 'Rigoberto', 'fecha': '2024-02-12', 'timestamp': '20240212_100000',
+        'estado': 'completado', 'inventario': {'001-A-1': 2}
+    }))
+
+    assert bd.sincronizar_archivos(str(inventarios), str(tmp_path)) == (1, 0)
+    assert 'roto.json' not in {i['archivo'] for i in bd.listar_inventarios()}
+    assert len(bd._no_importables) == 1
+
+
+def test_resumen_y_vista_previa_sin_leer_el_analisis(bd):
+    resultado = _analisis()
+    bd.guardar_analisis('rigoberto.xlsx', resultado, 'Rigoberto', '2024-01-01', '2024-02-01')
+
+    assert bd.cargar_resumen_analisis('rigoberto.xlsx') == app.calcular_resumen_analisis(resultado)
+    pd.testing.assert_frame_equal(bd.cargar_analisis('rigoberto.xlsx', limite=2), resultado.head(2))
+
+    with bd._conectar() as conn:
+        conn.execute("UPDATE analisis SET resumen = NULL")
+    assert bd.cargar_resumen_analisis('rigoberto.xlsx') is None
@@ -0,0 +1,32 @@
+"""Caché de análisis: la clave sale de los archivos de origen y de la versión del snapshot de stock.
+
+Cubre user-016 (caché de análisis por hash de las entradas).
+"""
+
+import time
+
+import app
+
+ENTRADAS = {'dotacion': '1:100', 'conteo': 'conteo.xlsx:aa', 'consumo': 'consumo.csv:bb'}
+
+
+def test_version_del_snapshot_sin_consultar_holded(tmp_path):
+    almacen = app.AlmacenSnapshotsStock(str(tmp_path), cliente=None, ttl=10, max_edad=60)
+    assert almacen.version('oficina') is None
+
+    snapshot = almacen.guardar('oficina', {'001-A-1': 2})
+    assert almacen.version('oficina') == snapshot['timestamp']
+
+    # Demasiado antiguo: obtener() consultaría Holded, así que no hay versión con la que buscar en caché
+    almacen.guardar('oficina', {'001-A-1': 2})
+    almacen._memoria['oficina'][1]['timestamp'] = time.time() - 61
+    assert almacen.version('oficina') is None
+
+
+def test_clave_depende_de_entradas_y_version_del_stock():
+    clave = app.clave_analisis(ENTRADAS, {'oficina': 1.0, 'maleta': 2.0}, 'Rigoberto')
+
+    assert clave == app.clave_analisis(dict(reversed(ENTRADAS.items())), {'maleta': 2.0, 'oficina': 1.0}, 'Rigoberto')
+    assert clave != app.clave_analisis(ENTRADAS, {'oficina': 1.5, 'maleta': 2.0}, 'Rigoberto')
+    assert clave != app.clave_analisis({**ENTRADAS, 'consumo': 'consumo.csv:cc'}, {'oficina': 1.0, 'maleta': 2.0}, 'Rigoberto')
+    assert clave != app.clave_analisis(ENTRADAS, {'oficina': 1.0, 'maleta': 2.0}, 'Francisco Javier')
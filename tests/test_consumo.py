@@ -0,0 +1,69 @@
+"""Lectura del consumo: leído entero o por bloques, en CSV o xlsx, el análisis sale igual.
+
+Cubre user-021 (consumo por bloques).
+"""
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import app
+
+FILAS = [
+    # (ID Parte, Cantidad, Articulo): enteros con huecos, textos y artículos con descripción
+    (101, 1, '001-A-1 Tornillo'),
+    (None, 2, '001-A-1 Tornillo'),
+    (102, 1, '002-B-2 Tuerca'),
+    (101, 3, '002-B-2 Tuerca'),
+    ('OT-7', 1, '001-A-1'),
+    (None, 4, '003-C-3 Junta'),
+    (102, 1, '001-A-1 Tornillo'),
+    (103, 2, '004-D-4'),
+    (101, 1, '004-D-4'),
+    (None, 1, None),
+] * 3
+
+
+@pytest.fixture
+def dotacion():
+    return pd.DataFrame({'SKU': ['001-A-1', '002-B-2', '005-E-5'], 'DOTACIÓN': [2.0, 3, 1],
+                         'CAJA': [1, 2, 3], 'SECCION': [1, 1, 2], 'Nº ORDEN': [1, 2, 3]})
+
+
+@pytest.fixture
+def rutas(tmp_path):
+    libro = Workbook()
+    hoja = libro.active
+    hoja.append(['Fecha', 'ID Parte', 'Cantidad', 'Articulo'])
+    for id_parte, cantidad, articulo in FILAS:
+        hoja.append(['2024-02-12', id_parte, cantidad, articulo])
+    ruta_xlsx = str(tmp_path / 'consumo.xlsx')
+    libro.save(ruta_xlsx)
+
+    ruta_csv = str(tmp_path / 'consumo.csv')
+    pd.DataFrame(FILAS, columns=['ID Parte', 'Cantidad', 'Articulo'], dtype=object).to_csv(ruta_csv, index=False)
+    return {'xlsx': ruta_xlsx, 'csv': ruta_csv}
+
+
+def _analizar(dotacion: pd.DataFrame, consumo_df: pd.DataFrame) -> pd.DataFrame:
+    conteo = pd.DataFrame({'SKU': ['001-A-1'], 'Cantidad': [1.0]})
+    resultado, _ = app.procesar_analisis(dotacion, conteo, app.limpiar_consumo(consumo_df), None, 'Rigoberto',
+                                         stock_oficina={'003-C-3': 5})
+    return resultado[['SKU', 'Usada', 'Trabajos/Órdenes']]
+
+
+@pytest.mark.parametrize('formato', ['xlsx', 'csv'])
+def test_consumo_por_bloques_igual_que_entero(dotacion, rutas, formato):
+    ruta = rutas[formato]
+    entero = _analizar(dotacion, app.leer_consumo(ruta, ruta))
+    agregado, filas_leidas = app.cargar_consumo_agregado(ruta, ruta, filas_bloque=7)
+
+    assert filas_leidas == len(FILAS)
+    pd.testing.assert_frame_equal(_analizar(dotacion, agregado), entero)
+    assert entero.set_index('SKU').loc['001-A-1', 'Trabajos/Órdenes'] == '101, 102, OT-7'
+
+
+def test_consumo_xlsx_igual_que_csv(dotacion, rutas):
+    xlsx = _analizar(dotacion, app.leer_consumo(rutas['xlsx'], rutas['xlsx']))
+    csv = _analizar(dotacion, app.leer_consumo(rutas['csv'], rutas['csv']))
+    pd.testing.assert_frame_equal(xlsx, csv)
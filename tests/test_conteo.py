@@ -0,0 +1,74 @@
+"""Lectura del conteo: columnas B y D desde la tercera fila de datos, validando el tamaño del archivo.
+
+Cubre user-022 (lectores de conteo y consumo con solo las columnas necesarias).
+"""
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import app
+
+
+def _xlsx(ruta, filas):
+    libro = Workbook()
+    hoja = libro.active
+    for fila in filas:
+        hoja.append(fila)
+    libro.save(ruta)
+    return str(ruta)
+
+
+CONTEO = [
+    ['Caja', 'SKU', 'Producto', 'Cantidad'],
+    ['', 'Cabecera', '', ''],
+    [None, None, None, None],
+    [1, '001-A-1', 'Tornillo', 3],
+    [1, '002-B-2', 'Tuerca', 'dos'],
+    [2, '003-C-3', None, None],
+]
+
+
+@pytest.mark.parametrize('formato', ['xlsx', 'csv'])
+def test_conteo_igual_que_leido_entero(tmp_path, formato):
+    if formato == 'xlsx':
+        ruta = _xlsx(tmp_path / 'conteo.xlsx', CONTEO)
+        entero = pd.read_excel(ruta)
+    else:
+        ruta = str(tmp_path / 'conteo.csv')
+        pd.DataFrame(CONTEO[1:], columns=CONTEO[0]).to_csv(ruta, index=False)
+        entero = pd.read_csv(ruta)
+
+    conteo = app.leer_conteo(ruta, ruta)
+    esperado = entero.iloc[2:, [1, 3]]
+    assert list(conteo.columns) == ['SKU', 'Cantidad']
+    assert conteo['SKU'].tolist() == esperado.iloc[:, 0].tolist()
+    assert pd.to_numeric(conteo['Cantidad'], errors='coerce').tolist() == pytest.approx(
+        pd.to_numeric(esperado.iloc[:, 1], errors='coerce').tolist(), nan_ok=True
+    )
+
+
+@pytest.mark.parametrize('formato', ['xlsx', 'csv'])
+def test_conteo_con_menos_de_cuatro_columnas(tmp_path, formato):
+    filas = [fila[:2] for fila in CONTEO]
+    if formato == 'xlsx':
+        ruta = _xlsx(tmp_path / 'conteo.xlsx', filas)
+    else:
+        ruta = str(tmp_path / 'conteo.csv')
+        pd.DataFrame(filas[1:], columns=filas[0]).to_csv(ruta, index=False)
+
+    with pytest.raises(ValueError, match="4 columnas"):
+        app.leer_conteo(ruta, ruta)
+
+
+def test_conteo_con_menos_de_tres_filas(tmp_path):
+    ruta = _xlsx(tmp_path / 'conteo.xlsx', CONTEO[:3])
+    with pytest.raises(ValueError, match="3 filas"):
+        app.leer_conteo(ruta, ruta)
+
+
+def test_conteo_ancho_por_los_datos(tmp_path):
+    # Sin título en D, pero con cantidades: el archivo tiene 4 columnas
+    filas = [fila[:3] for fila in CONTEO[:1]] + CONTEO[1:]
+    ruta = _xlsx(tmp_path / 'conteo.xlsx', filas)
+    assert app.leer_conteo(ruta, ruta)['SKU'].tolist() == ['001-A-1', '002-B-2', '003-C-3']
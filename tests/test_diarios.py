@@ -0,0 +1,79 @@
+"""Diarios de escaneos: reproducirlos devuelve el inventario y los abiertos en otra sesión no se ofrecen.
+
+Cubre user-010 (diario de escaneos y recuperación).
+"""
+
+import pytest
+
+import app
+
+TECNICO = 'Rigoberto'
+
+
+@pytest.fixture
+def diarios(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'DIARIOS_DIR', str(tmp_path))
+    return tmp_path
+
+
+def _aplicar(inventario, sku, delta):
+    """Cambio de cantidad como en la interfaz: al llegar a 0 el SKU desaparece."""
+    cantidad = inventario.get(sku, 0) + delta
+    if cantidad > 0:
+        inventario[sku] = cantidad
+    else:
+        inventario.pop(sku, None)
+
+
+def test_reproducir_diario_devuelve_el_inventario(diarios):
+    diario = app.DiarioEscaneos.crear(TECNICO)
+    inventario = {}
+    for sku, delta in [('001-A-1', 1), ('001-A-1', 1), ('002-B-2', 3), ('001-A-1', -2), ('003-C-3', 1)]:
+        diario.registrar(sku, delta)
+        _aplicar(inventario, sku, delta)
+
+    # Compactar conserva el inventario y se puede seguir escribiendo detrás
+    diario.compactar(inventario)
+    for sku, delta in [('002-B-2', -1), ('001-A-1', 4)]:
+        diario.registrar(sku, delta)
+        _aplicar(inventario, sku, delta)
+    diario.cerrar()
+
+    # Una línea a medio escribir por una caída se ignora
+    with open(diario.ruta, 'a', encoding='utf-8') as f:
+        f.write('{"sku": "004-D-4", "d"')
+
+    cabecera, reconstruido = app.DiarioEscaneos.reconstruir(diario.ruta)
+    assert cabecera['tecnico'] == TECNICO
+    assert reconstruido == inventario == {'001-A-1': 4, '002-B-2': 2, '003-C-3': 1}
+
+    recuperado, reconstruido = app.DiarioEscaneos.abrir(diario.ruta)
+    assert reconstruido == inventario
+    assert recuperado.cabecera == cabecera
+    recuperado.cerrar()
+
+
+@pytest.mark.skipif(app.fcntl is None, reason="cerrojos de archivo solo en POSIX")
+def test_diario_abierto_no_se_ofrece_ni_se_abre(diarios):
+    diario = app.DiarioEscaneos.crear(TECNICO)
+    diario.registrar('001-A-1', 2)
+
+    assert app.diario_en_uso(diario.ruta)
+    assert app.listar_diarios_pendientes(TECNICO) == []
+    with pytest.raises(app.DiarioEnUso):
+        app.DiarioEscaneos.abrir(diario.ruta)
+
+    # El cerrojo sigue tomado tras compactar, que sustituye el archivo del diario
+    diario.compactar({'001-A-1': 2})
+    assert app.diario_en_uso(diario.ruta)
+
+    # Cerrado (sesión interrumpida) pasa a ser recuperable
+    diario.cerrar()
+    pendientes = app.listar_diarios_pendientes(TECNICO)
+    assert [p['ruta'] for p in pendientes] == [diario.ruta]
+    assert pendientes[0]['inventario'] == {'001-A-1': 2}
+
+    recuperado, _ = app.DiarioEscaneos.abrir(diario.ruta)
+    assert app.listar_diarios_pendientes(TECNICO) == []
+    recuperado.eliminar()
+    assert list(diarios.iterdir()) == []
@@ -0,0 +1,61 @@
+"""Inventarios guardados: el JSON es el dato y los listados funcionan también sin base de datos.
+
+Cubre user-012 (listados de inventarios sin abrir cada archivo).
+"""
+
+import json
+import os
+import sqlite3
+
+import pytest
+
+import app
+
+
+def _sin_base_datos():
+    raise sqlite3.OperationalError("unable to open database file")
+
+
+@pytest.fixture
+def directorios(tmp_path, monkeypatch):
+    inventarios = tmp_path / 'inventarios'
+    historial = tmp_path / 'historial'
+    inventarios.mkdir()
+    historial.mkdir()
+    monkeypatch.setattr(app, 'INVENTARIOS_DIR', str(inventarios))
+    monkeypatch.setattr(app, 'HISTORIAL_DIR', str(historial))
+    return inventarios
+
+
+def test_fallo_de_base_datos_conserva_el_json(directorios, monkeypatch):
+    monkeypatch.setattr(app, 'obtener_base_datos', _sin_base_datos)
+
+    nombre = app.guardar_inventario('Rigoberto', {'001-A-1': 2, '002-B-2': 1}, completado=True)
+    assert nombre is not None
+    with open(os.path.join(directorios, nombre)) as f:
+        assert json.load(f)['inventario'] == {'001-A-1': 2, '002-B-2': 1}
+
+
+def test_listado_sin_base_datos_igual_que_con_ella(directorios, tmp_path, monkeypatch):
+    for tecnico, fecha, timestamp, estado in [
+        ('Rigoberto', '2024-02-12', '20240212_100000', 'completado'),
+        ('Rigoberto', '2024-02-12', '20240212_120000', 'en_progreso'),
+        ('Francisco Javier', '2024-02-13', '20240213_090000', 'completado'),
+        ('Rigoberto', '2024-02-10', '20240210_080000', 'completado'),
+    ]:
+        datos = {'tecnico': tecnico, 'fecha': fecha, 'timestamp': timestamp, 'estado': estado,
+                 'inventario': {'001-A-1': 2, '002-B-2': 3}}
+        (directorios / f"{tecnico}_{timestamp}_{estado}.json").write_text(json.dumps(datos))
+    (directorios / 'roto.json').write_text('{')
+
+    bd = app.BaseDatosMaleta(str(tmp_path / 'maleta.db'))
+    monkeypatch.setattr(app, 'obtener_base_datos', lambda: bd)
+    con_base_datos = {
+        filtro: app.cargar_inventarios_disponibles(*filtro)
+        for filtro in [(None, None), ('Rigoberto', None), (None, 'completado'), ('Rigoberto', 'completado')]
+    }
+    assert len(con_base_datos[(None, None)]) == 4
+
+    monkeypatch.setattr(app, 'obtener_base_datos', _sin_base_datos)
+    for filtro, esperado in con_base_datos.items():
+        assert app.cargar_inventarios_disponibles(*filtro) == esperado
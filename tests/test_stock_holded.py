@@ -0,0 +1,48 @@
+"""Normalización del stock de Holded: el parser por flujo da lo mismo que el que decodifica el JSON entero.
+
+Cubre user-007 (normalización única del stock de Holded, con streaming).
+"""
+
+import io
+import json
+
+import pytest
+
+import app
+import holded_fake
+
+PAYLOADS_LIMITE = {
+    'items_invalidos': [{'sku': ' abc-1 ', 'stock': 3}, 'texto', 7, [1, 2], {'stock': 4}, {'sku': '', 'stock': 1},
+                        {'sku': None, 'stock': 2}, {'sku': 'X', 'stock': {'a': 1}}, {'sku': 'Y'}],
+    'sku_repetido': [{'sku': 'a', 'stock': 1}, {'sku': 'A ', 'stock': 2}],
+    'prioridad_data': {'products': [{'sku': 'P', 'stock': 1}], 'data': [{'sku': 'D', 'stock': 2}]},
+    'data_no_lista': {'data': {'sku': 'D', 'stock': 2}, 'items': [{'sku': 'I', 'stock': 3}]},
+    'plano_mixto': {'a': 1, 'b': 2.5, 'c': {'stock': 4}, 'd': {'cantidad': 1}, 'e': 'texto', ' ': 3, 'f': [1],
+                    'meta': {'total': 2}},
+    'valores_no_escalares': [{'sku': {'codigo': 'A'}, 'stock': [1, {'b': 2.5}]}, {'sku': ['B'], 'stock': 1},
+                             {'stock': {'a': 1}, 'sku': 'C'}],
+    'plano_stock_objeto': {'a': {'stock': {'total': 3}}, 'b': {'stock': [1], 'sku': 'x'}, 'c': {'sku': 'x'}},
+    'anidado': {'items': [{'sku': 'A', 'stock': 1, 'extra': {'sku': 'B', 'stock': 9}, 'lista': [{'sku': 'C'}]}]},
+    'lista_vacia': [],
+    'objeto_vacio': {},
+    'escalar': 5,
+}
+
+
+def _payloads():
+    for formato in holded_fake.FORMATOS:
+        yield pytest.param(holded_fake.generar_payload_stock('oficina', 200, formato), id=formato)
+    for nombre, payload in PAYLOADS_LIMITE.items():
+        yield pytest.param(payload, id=nombre)
+
+
+@pytest.mark.parametrize('payload', _payloads())
+@pytest.mark.parametrize('con_ijson', [True, False], ids=['ijson', 'sin_ijson'])
+def test_normalizar_por_flujo_igual_que_completo(payload, con_ijson, monkeypatch):
+    if con_ijson and app.ijson is None:
+        pytest.skip("ijson no instalado")
+    if not con_ijson:
+        monkeypatch.setattr(app, 'ijson', None)
+
+    esperado = app.normalizar_stock_holded(payload)
+    assert app.normalizar_stock_holded_stream(io.BytesIO(json.dumps(payload).encode())) == esperado